@@ -0,0 +1,467 @@
+"""
+Load-testing and latency benchmark for the prediction backend.
+
+HTTP mode starts src/flask/app.py locally (Flask dev server, gunicorn or the ASGI app) with the
+real models/*.onnx, or targets a running server with --url, and drives /predict, /models and
+/model_list with synthetic patients shaped like the Streamlit form. Micro mode calls the ONNX
+sessions directly, to separate HTTP/JSON overhead from model time. KNN mode fits a KNN on
+synthetic reference sets of increasing size and compares the brute-force ONNX graph with the
+KD-tree, ball-tree and inverted-file indexes of src/flask/knn_index.py: latency per batch size,
+model size and agreement with scikit-learn.
+
+Results (throughput, p50/p95/p99 latency, per-model breakdown) are printed and saved as JSON,
+tagged with the current git commit, so runs can be compared with --compare.
+
+Examples:
+    python benchmarks/bench_api.py http --server gunicorn --concurrency 16 --duration 20
+    python benchmarks/bench_api.py http --url http://localhost:5001 --rate 200
+    python benchmarks/bench_api.py micro --batch-sizes 1 16 256
+    python benchmarks/bench_api.py knn --reference-sizes 1000 10000 100000
+    python benchmarks/bench_api.py http --compare benchmarks/results/previous.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLASK_DIR = os.path.join(ROOT, 'src', 'flask')
+MODEL_PATH = os.path.join(ROOT, 'models') + os.sep
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, FLASK_DIR)
+
+from encoding import CATEGORICAL_LEVELS, encode_records  # noqa: E402
+
+# Ranges of the numeric inputs of the Streamlit form
+NUMERIC_RANGES = {
+    'age': (29, 77),
+    'blood_pressure_resting': (94.0, 200.0),
+    'cholesterol': (126.0, 564.0),
+    'max_heart_rate': (71.0, 202.0),
+    'st_depression_exercise': (0.0, 6.2),
+    'major_vessels_colored': (0, 3),
+}
+
+
+def synthetic_patients(n, seed=42):
+    """
+    Generates n random raw patient records with the fields sent by the Streamlit form.
+    """
+    rng = random.Random(seed)
+    patients = []
+    for _ in range(n):
+        patient = {column: rng.choice(levels) for column, levels in CATEGORICAL_LEVELS.items()}
+        for column, (low, high) in NUMERIC_RANGES.items():
+            if isinstance(low, int):
+                patient[column] = rng.randint(low, high)
+            else:
+                patient[column] = round(rng.uniform(low, high), 1)
+        patient['fasting_blood_sugar'] = patient['fasting_blood_sugar'] == 'True'
+        patient['exercise_induced_angina'] = patient['exercise_induced_angina'] == 'True'
+        patients.append(patient)
+    return patients
+
+
+def percentiles(latencies_ms):
+    if not latencies_ms:
+        return {"count": 0}
+    values = np.asarray(latencies_ms)
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Local server management ---
+
+def start_server(kind, port, workers):
+    """
+    Starts the backend in a subprocess with the real models and waits until it answers.
+    """
+    env = dict(os.environ, MODEL_PATH=MODEL_PATH)
+    if kind == 'flask':
+        command = [sys.executable, '-c',
+                   f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    elif kind == 'gunicorn':
+        command = ['gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app']
+    else:
+        command = ['uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(port)]
+    process = subprocess.Popen(command, cwd=FLASK_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"The {kind} server exited with code {process.returncode}.")
+        try:
+            requests.post(f'{url}/model_list', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f"The {kind} server did not start within 60 seconds.")
+
+
+# --- HTTP load generator ---
+
+def build_requests(url, models, patients, payload, batch_size):
+    """
+    Returns the list of (label, endpoint, body) requests cycled through by the load generator.
+    """
+    endpoints = []
+    for model_name in models:
+        for start in range(0, len(patients), batch_size):
+            batch = patients[start:start + batch_size]
+            if payload == 'patients':
+                body = {"model_name": model_name, "patients": batch}
+            else:
+                body = {"model_name": model_name, "data": encode_records(batch).tolist()}
+            endpoints.append((f"/predict [{model_name}]", f"{url}/predict", body))
+        endpoints.append((f"/models [{model_name}]", f"{url}/models", {"model_name": model_name}))
+    endpoints.append(("/model_list", f"{url}/model_list", None))
+    return endpoints
+
+
+def run_load(endpoints, concurrency, duration, rate, mix):
+    """
+    Drives the endpoints from concurrency threads for duration seconds, optionally capped at
+    rate requests/sec overall. mix is the fraction of requests going to /predict.
+    """
+    predict_requests = [endpoint for endpoint in endpoints if endpoint[0].startswith('/predict')]
+    other_requests = [endpoint for endpoint in endpoints if not endpoint[0].startswith('/predict')]
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    interval = concurrency / rate if rate else 0.0
+    started = time.perf_counter()
+    stop_at = started + duration
+
+    def worker(index):
+        rng = random.Random(index)
+        session = requests.Session()
+        next_send = time.perf_counter() + rng.random() * interval
+        local_latencies, local_errors = {}, {}
+        while True:
+            if interval:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send += interval
+            if time.perf_counter() >= stop_at:
+                break
+            pool = predict_requests if (not other_requests or rng.random() < mix) else other_requests
+            label, endpoint, body = rng.choice(pool)
+            sent = time.perf_counter()
+            try:
+                response = session.post(endpoint, json=body, timeout=30)
+                ok = response.status_code == 200
+                status = response.status_code
+            except requests.RequestException as e:
+                ok, status = False, type(e).__name__
+            elapsed_ms = (time.perf_counter() - sent) * 1000.0
+            if ok:
+                local_latencies.setdefault(label, []).append(elapsed_ms)
+            else:
+                local_errors.setdefault(label, {}).setdefault(str(status), 0)
+                local_errors[label][str(status)] += 1
+        with lock:
+            for label, values in local_latencies.items():
+                latencies.setdefault(label, []).extend(values)
+            for label, counts in local_errors.items():
+                for status, count in counts.items():
+                    errors.setdefault(label, {}).setdefault(status, 0)
+                    errors[label][status] += count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    n_errors = sum(sum(counts.values()) for counts in errors.values())
+    return {
+        "elapsed_s": elapsed,
+        "requests": len(all_latencies) + n_errors,
+        "errors": n_errors,
+        "throughput_rps": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency": percentiles(all_latencies),
+        "endpoints": {label: percentiles(values) for label, values in sorted(latencies.items())},
+        "error_breakdown": errors,
+    }
+
+
+# --- Micro-benchmark of the ONNX sessions ---
+
+def run_micro(patients, batch_sizes, iterations, intra_op_threads):
+    from inference import make_session_options
+    from registry import ModelRegistry
+
+    registry = ModelRegistry(MODEL_PATH, sess_options_factory=lambda: make_session_options(intra_op_threads))
+    registry.reload()
+    features = encode_records(patients)
+    results = {}
+    for model_name, plan in registry.models.items():
+        results[model_name] = {}
+        for batch_size in batch_sizes:
+            input_array = np.ascontiguousarray(np.resize(features, (batch_size, features.shape[1])))
+            for _ in range(min(10, iterations)):
+                plan.run(input_array)
+            latencies = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                plan.run(input_array)
+                latencies.append((time.perf_counter() - started) * 1000.0)
+            stats = percentiles(latencies)
+            stats["rows_per_s"] = batch_size * 1000.0 / stats["mean_ms"] if stats["mean_ms"] else 0.0
+            results[model_name][str(batch_size)] = stats
+    return results
+
+
+# --- KNN engines across reference set sizes ---
+
+def time_plan(plan, features, batch_sizes, iterations):
+    """
+    Latency percentiles and rows/s of plan.run() for each batch size.
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        input_array = np.ascontiguousarray(np.resize(features, (batch_size, features.shape[1])))
+        for _ in range(min(3, iterations)):
+            plan.run(input_array)
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            plan.run(input_array)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+        stats = percentiles(latencies)
+        stats["rows_per_s"] = batch_size * 1000.0 / stats["mean_ms"] if stats["mean_ms"] else 0.0
+        results[str(batch_size)] = stats
+    return results
+
+
+def run_knn(patients, reference_sizes, batch_sizes, iterations, n_neighbors, weights):
+    import io
+    import tempfile
+
+    from skl2onnx import to_onnx
+    from skl2onnx.common.data_types import FloatTensorType
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    from inference import InferencePlan, make_session_options
+    from knn_index import ALGORITHMS, IndexedKNNPlan, save_index
+
+    queries = encode_records(patients).astype(np.float32)
+    # Synthetic ground truth: a fixed random linear rule over the standardized features
+    direction = np.random.default_rng(0).normal(size=queries.shape[1])
+    results = {}
+    for reference_size in reference_sizes:
+        reference = encode_records(synthetic_patients(reference_size, seed=reference_size)).astype(np.float32)
+        scaler = StandardScaler().fit(reference)
+        labels = (scaler.transform(reference) @ direction > 0).astype(np.int64)
+        model = KNeighborsClassifier(n_neighbors=n_neighbors, weights=weights)
+        pipeline = Pipeline([('scale', scaler), ('model', model.fit(scaler.transform(reference), labels))])
+        expected_labels = pipeline.predict(queries)
+        expected_probabilities = pipeline.predict_proba(queries)
+
+        engines = {}
+        started = time.perf_counter()
+        graph = to_onnx(pipeline, initial_types=[('input', FloatTensorType([None, queries.shape[1]]))],
+                        target_opset={'': 15, 'ai.onnx.ml': 3}, options={id(model): {'optim': 'cdist'}})
+        with tempfile.TemporaryDirectory() as directory:
+            model_file = os.path.join(directory, 'knn.onnx')
+            with open(model_file, 'wb') as file:
+                file.write(graph.SerializeToString())
+            engines['onnx'] = (InferencePlan.from_file(model_file, make_session_options(1)),
+                               os.path.getsize(model_file), time.perf_counter() - started)
+        for algorithm in ALGORITHMS:
+            started = time.perf_counter()
+            buffer = io.BytesIO()
+            save_index(buffer, scaler.transform(reference), labels, model.classes_, n_neighbors, weights,
+                       'euclidean', scaler.mean_, scaler.scale_, algorithm)
+            buffer.seek(0)
+            engines[algorithm] = (IndexedKNNPlan.from_file(buffer), buffer.getbuffer().nbytes,
+                                  time.perf_counter() - started)
+
+        results[str(reference_size)] = {}
+        for engine, (plan, size_bytes, build_s) in engines.items():
+            predicted_labels, probabilities = plan.run(queries)
+            results[str(reference_size)][engine] = {
+                "size_bytes": size_bytes,
+                "build_s": build_s,
+                "label_agreement": float(np.mean(predicted_labels == expected_labels)),
+                "max_probability_diff": float(np.max(np.abs(probabilities - expected_probabilities))),
+                "batches": time_plan(plan, queries, batch_sizes, iterations),
+            }
+    return results
+
+
+# --- Reporting ---
+
+def print_http_report(result):
+    latency = result["latency"]
+    print(f"\n{result['requests']} requests in {result['elapsed_s']:.1f}s, {result['errors']} errors, "
+          f"{result['throughput_rps']:.1f} req/s")
+    if latency["count"]:
+        print(f"latency: p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms")
+    print(f"\n{'endpoint':45} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, stats in result["endpoints"].items():
+        print(f"{label:45} {stats['count']:>7} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    if result["error_breakdown"]:
+        print(f"\nerrors: {result['error_breakdown']}")
+
+
+def print_micro_report(result):
+    print(f"\n{'model':25} {'batch':>6} {'p50 ms':>8} {'p99 ms':>8} {'rows/s':>12}")
+    for model_name, batches in result.items():
+        for batch_size, stats in batches.items():
+            print(f"{model_name:25} {batch_size:>6} {stats['p50_ms']:>8.3f} {stats['p99_ms']:>8.3f} "
+                  f"{stats['rows_per_s']:>12,.0f}")
+
+
+def print_knn_report(result):
+    print(f"\n{'references':>10} {'engine':10} {'size':>12} {'build s':>8} {'agree':>7} {'max diff':>9} "
+          f"{'batch':>6} {'p50 ms':>9} {'p99 ms':>9} {'rows/s':>12}")
+    for reference_size, engines in result.items():
+        for engine, stats in engines.items():
+            for batch_size, batch in stats["batches"].items():
+                print(f"{reference_size:>10} {engine:10} {stats['size_bytes']:>12,} {stats['build_s']:>8.2f} "
+                      f"{stats['label_agreement']:>7.2%} {stats['max_probability_diff']:>9.1e} {batch_size:>6} "
+                      f"{batch['p50_ms']:>9.3f} {batch['p99_ms']:>9.3f} {batch['rows_per_s']:>12,.0f}")
+
+
+def compare(current, previous_file):
+    """
+    Prints the p50/p99 change of every endpoint (or model and batch size) against a previous result file.
+    """
+    with open(previous_file, 'r', encoding='utf-8') as file:
+        previous = json.load(file)
+    if previous.get("mode") != current["mode"]:
+        print(f"\nCannot compare a '{current['mode']}' run with a '{previous.get('mode')}' run.")
+        return
+    print(f"\nCompared with {previous_file} (commit {previous.get('commit')}):")
+    if current["mode"] == 'http':
+        pairs = [(label, stats, previous["result"]["endpoints"].get(label))
+                 for label, stats in current["result"]["endpoints"].items()]
+    elif current["mode"] == 'knn':
+        pairs = [(f"{engine} {reference_size} refs x{batch_size}", stats,
+                  previous["result"].get(reference_size, {}).get(engine, {}).get("batches", {}).get(batch_size))
+                 for reference_size, engines in current["result"].items() for engine, engine_stats in engines.items()
+                 for batch_size, stats in engine_stats["batches"].items()]
+    else:
+        pairs = [(f"{model_name} x{batch_size}", stats, previous["result"].get(model_name, {}).get(batch_size))
+                 for model_name, batches in current["result"].items() for batch_size, stats in batches.items()]
+    for label, stats, old in pairs:
+        if not old or not old.get("count"):
+            continue
+        changes = [f"{key[:-3]} {old[key]:.2f} -> {stats[key]:.2f} ms ({(stats[key] / old[key] - 1) * 100:+.1f}%)"
+                   for key in ('p50_ms', 'p99_ms') if old[key]]
+        print(f"  {label:45} " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prediction backend.")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    http = subparsers.add_parser('http', help="Load-test the HTTP endpoints")
+    http.add_argument('--url', help="Target a running server instead of starting one")
+    http.add_argument('--server', choices=['flask', 'gunicorn', 'asgi'], default='gunicorn')
+    http.add_argument('--workers', type=int, default=4, help="gunicorn workers (default: 4, as in the Dockerfile)")
+    http.add_argument('--port', type=int, default=5099)
+    http.add_argument('--concurrency', type=int, default=8)
+    http.add_argument('--duration', type=float, default=10.0, help="Seconds of load")
+    http.add_argument('--rate', type=float, default=None, help="Overall requests/sec cap (default: closed loop)")
+    http.add_argument('--predict-mix', type=float, default=0.9, help="Fraction of requests sent to /predict")
+    http.add_argument('--payload', choices=['patients', 'data'], default='patients',
+                      help="Send raw patient fields or encoded feature rows")
+    http.add_argument('--batch-size', type=int, default=1, help="Patients per /predict request")
+
+    micro = subparsers.add_parser('micro', help="Time the ONNX sessions directly")
+    micro.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 256, 4096])
+    micro.add_argument('--iterations', type=int, default=500)
+    micro.add_argument('--intra-op-threads', type=int, default=1)
+
+    knn = subparsers.add_parser('knn', help="Compare the ONNX KNN with the indexes of knn_index.py")
+    knn.add_argument('--reference-sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                     help="Training (reference) set sizes")
+    knn.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64, 1024])
+    knn.add_argument('--iterations', type=int, default=50)
+    knn.add_argument('--n-neighbors', type=int, default=5)
+    knn.add_argument('--weights', choices=['uniform', 'distance'], default='uniform')
+
+    for subparser in (http, micro, knn):
+        subparser.add_argument('--patients', type=int, default=256, help="Synthetic patients to cycle through")
+        subparser.add_argument('--output', help="Result file (default: benchmarks/results/<mode>-<commit>-<time>.json)")
+        subparser.add_argument('--compare', help="Previous result file to compare against")
+    args = parser.parse_args()
+
+    patients = synthetic_patients(args.patients)
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+
+    if args.mode == 'http':
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(args.server, args.port, args.workers)
+        try:
+            models = requests.post(f'{url}/model_list', timeout=10).json()["available_models"]
+            endpoints = build_requests(url, models, patients, args.payload, args.batch_size)
+            result = run_load(endpoints, args.concurrency, args.duration, args.rate, args.predict_mix)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        print_http_report(result)
+    elif args.mode == 'knn':
+        result = run_knn(patients, args.reference_sizes, args.batch_sizes, args.iterations,
+                         args.n_neighbors, args.weights)
+        print_knn_report(result)
+    else:
+        result = run_micro(patients, args.batch_sizes, args.iterations, args.intra_op_threads)
+        print_micro_report(result)
+
+    commit = git_commit()
+    report = {
+        "mode": args.mode,
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "result": result,
+    }
+    output_file = args.output or os.path.join(
+        RESULTS_DIR, f"{args.mode}-{commit or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults saved to '{output_file}'.")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
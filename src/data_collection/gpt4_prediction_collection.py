@@ -1,51 +1,323 @@
-import pandas as pd
-from openai import OpenAI
+"""
+Asks GPT-4 whether each patient of heart_disease_clean.csv has heart disease (y/n).
+
+Requests are sent concurrently (--concurrency), rate limits and transient errors are
+retried with exponential backoff, and every answer is appended to a checkpoint file as
+soon as it arrives: after a crash or Ctrl+C, rerunning the script only asks for the
+patients that are not labeled yet. The dataset is read from its columnar store (see
+src/flask/data_store.py) and at the end the labels are stored there as the 'gpt_prediction'
+prediction set (--prediction-set), keyed by id; --output-file also writes the labeled dataset as CSV.
+
+Answers are also kept in a persistent SQLite cache keyed by model and prompt, and identical
+prompts are sent once per run, so repeated runs (or A/B runs of a new prompt template
+version) only pay for prompts never asked before.
+
+Example:
+    python src/data_collection/gpt4_prediction_collection.py --concurrency 16
+
+To measure throughput offline, point it at the local stand-in server:
+    python src/data_collection/stand_in_server.py --port 8000 &
+    python src/data_collection/gpt4_prediction_collection.py --base-url http://127.0.0.1:8000/v1
+"""
+import argparse
+import asyncio
 import os
+import random
+import sys
+import time
+
+import pandas as pd
 from dotenv import load_dotenv
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, RateLimitError
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from label_store import AppendOnlyWriter, read_records
+from response_cache import ResponseCache
 
-# Load your dataset
-input_file = '../data/heart_disease_clean.csv'
-df = pd.read_csv(input_file)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
 
-# Prepare label list
-gpt_labels = []
+from data_store import open_store  # noqa: E402
 
-print(f"\n--- Reviewing {len(df)} patient records ---\n")
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+DEFAULT_INPUT_FILE = os.path.join(DATA_PATH, 'heart_disease_clean.csv')
+DEFAULT_CHECKPOINT_FILE = os.path.join(DATA_PATH, 'heart_disease_gpt_prediction.checkpoint.jsonl')
+DEFAULT_CACHE_FILE = os.path.join(DATA_PATH, 'gpt_response_cache.sqlite')
+# Default name of the prediction set written to the data store
+PREDICTION_SET = 'gpt_prediction'
 
-# Loop through each row
-for idx, row in df.iterrows():
-    
-    # Construct patient string from row
-    patient_string = ' '.join([
-        f"{col}: {row[col]}" for col in df.columns
-        if col not in ['id', 'dataset', 'heart_disease_prediction', 'sick']
-    ])
+# Columns that are not shown to the model (identifiers and the ground truth)
+EXCLUDED_COLUMNS = ['id', 'dataset', 'heart_disease_prediction', 'sick']
+# Prompt templates by version ({patient} is replaced by "col: value col: value ..."). Never edit a
+# published version: add a new one, so cached answers and checkpoints stay tied to their prompt.
+PROMPT_TEMPLATES = {
+    'v1': "Without searching on the internet answer with a yes or no (y/n), does this patient have heart disease? {patient}",
+}
+DEFAULT_PROMPT_VERSION = 'v1'
 
-    prompt = f"Without searching on the internet answer with a yes or no (y/n), does this patient have heart disease? {patient_string}"
+# Errors worth retrying: rate limits, timeouts, dropped connections and server-side failures
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError)
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
+
+def build_prompts(df, prompt_version=DEFAULT_PROMPT_VERSION):
+    """
+    Builds the prompt of every row at once, column by column ("col: value col: value ...").
+    """
+    columns = [col for col in df.columns if col not in EXCLUDED_COLUMNS]
+    patient_strings = pd.Series('', index=df.index)
+    for position, col in enumerate(columns):
+        separator = '' if position == 0 else ' '
+        patient_strings = patient_strings + f"{separator}{col}: " + df[col].astype(str)
+    prefix, suffix = PROMPT_TEMPLATES[prompt_version].split('{patient}')
+    return prefix + patient_strings + suffix
+
+
+def parse_label(message):
+    return 1 if message.strip().lower().startswith('y') else 0
+
+
+def read_checkpoint(checkpoint_file, prompt_version=DEFAULT_PROMPT_VERSION):
+    """
+    Returns {row id: label} of the rows already answered with prompt_version.
+    A line truncated by a crash is ignored.
+    """
+    labels = {}
+    for record in read_records(checkpoint_file):
+        if record.get('prompt_version', DEFAULT_PROMPT_VERSION) == prompt_version:
+            labels[str(record['id'])] = record['gpt_prediction']
+    return labels
+
+
+class CheckpointWriter:
+    """
+    Appends one JSON line per answered row, flushed immediately so a crash loses at most one row.
+    """
+
+    def __init__(self, checkpoint_file, prompt_version=DEFAULT_PROMPT_VERSION):
+        self.prompt_version = prompt_version
+        self._writer = AppendOnlyWriter(checkpoint_file)
+
+    def write(self, row_ids, answer):
+        label = parse_label(answer)
+        self._writer.write(
+            {"id": row_id, "gpt_prediction": label, "answer": answer, "prompt_version": self.prompt_version}
+            for row_id in row_ids
         )
-        message = response.choices[0].message.content.strip().lower()
-        label = 1 if message.startswith('y') else 0
-    except OpenAI.error.OpenAIError as e:
-        print(f"⚠️ Error on row {idx}: {e}")
-        label = None
-    gpt_labels.append(label)
-
-# Save results
-if any(label is not None for label in gpt_labels):
-    labeled_df = df.iloc[:len(gpt_labels)].copy()
-    labeled_df['gpt_prediction'] = gpt_labels
-
-    output_file = '../data/heart_disease_gpt_prediction.csv'
-    labeled_df.to_csv(output_file, index=False)
-
-    print(f"\n✅ Done. {len(labeled_df)} rows saved to '{output_file}'.")
-else:
-    print("\n⚠️ No data labeled. Nothing saved.")
+
+    def close(self):
+        self._writer.close()
+
+
+def _retry_delay(error, attempt, base_delay, max_delay):
+    """
+    Seconds to wait before the next attempt: the server's Retry-After when given, otherwise
+    exponential backoff with full jitter so concurrent workers do not retry in lockstep.
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            return min(float(response.headers.get('retry-after')), max_delay)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def ask_model(client, model, prompt, max_retries=6, base_delay=1.0, max_delay=60.0):
+    """
+    Sends one prompt and returns the answer text, retrying rate limits and transient errors.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            return response.choices[0].message.content or ''
+        except (RETRYABLE_ERRORS + (APIStatusError,)) as e:
+            retryable = isinstance(e, RETRYABLE_ERRORS) or (isinstance(e, APIStatusError) and e.status_code >= 500)
+            if not retryable or attempt >= max_retries:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt, base_delay, max_delay))
+            attempt += 1
+
+
+class Progress:
+    """
+    Prints answered prompts, errors and prompts/sec every few seconds.
+    """
+
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    @property
+    def rate(self):
+        return self.done / max(time.perf_counter() - self.started, 1e-9)
+
+    def update(self, error=False):
+        self.done += 1
+        self.errors += error
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval or self.done == self.total:
+            self._last_report = now
+            print(f"{self.done}/{self.total} prompts, {self.errors} errors, {self.rate:.1f} prompts/sec", file=sys.stderr)
+
+
+async def label_rows(client, model, pending, checkpoint, cache, concurrency, max_retries):
+    """
+    Sends each (prompt, row ids) pair of pending with at most concurrency requests in flight,
+    labeling every row that shares the prompt with the same answer.
+    """
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    progress = Progress(len(pending))
+
+    async def worker():
+        while True:
+            try:
+                prompt, row_ids = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                answer = await ask_model(client, model, prompt, max_retries=max_retries)
+            except Exception as e:
+                # Not checkpointed: the rows are asked again on the next run
+                print(f"⚠️ Error on row {', '.join(row_ids)}: {e}", file=sys.stderr)
+                progress.update(error=True)
+                continue
+            if cache is not None:
+                cache.put(model, checkpoint.prompt_version, prompt, answer)
+            checkpoint.write(row_ids, answer)
+            progress.update()
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(pending)) or 1)))
+    return progress
+
+
+def seed_cache(cache, labeled_file, model, prompt_version):
+    """
+    Stores the labels of an existing gpt_prediction CSV (produced with prompt_version) as cached
+    'yes'/'no' answers, so the prompts of past runs are never paid for again.
+    """
+    df = pd.read_csv(labeled_file)
+    df = df[df['gpt_prediction'].notna()]
+    prompts = build_prompts(df.drop(columns=['gpt_prediction']), prompt_version)
+    for prompt, label in zip(prompts, df['gpt_prediction']):
+        cache.put(model, prompt_version, prompt, 'yes' if int(label) == 1 else 'no')
+    print(f"Seeded the cache with {len(df)} answers from '{labeled_file}' ({model}, prompt {prompt_version}).")
+
+
+def collect(input_file, output_file=None, checkpoint_file=None, model='gpt-4', concurrency=8, max_retries=6,
+            base_url=None, limit=None, prompt_version=DEFAULT_PROMPT_VERSION, cache_file=DEFAULT_CACHE_FILE,
+            prediction_set=PREDICTION_SET):
+    store = open_store(input_file)
+    df = store.frame().reset_index()
+    if limit is not None:
+        df = df.iloc[:limit]
+    row_ids = df['id'].astype(str)
+    prompts = build_prompts(df, prompt_version)
+
+    if checkpoint_file is None:
+        checkpoint_file = os.path.splitext(output_file)[0] + '.checkpoint.jsonl' if output_file else DEFAULT_CHECKPOINT_FILE
+    labels = read_checkpoint(checkpoint_file, prompt_version)
+
+    # Deduplicate: identical patient strings are sent once and their answer shared by all their rows
+    pending = {}
+    for row_id, prompt in zip(row_ids, prompts):
+        if row_id not in labels:
+            pending.setdefault(prompt, []).append(row_id)
+    n_pending_rows = sum(len(ids) for ids in pending.values())
+    print(f"\n--- Reviewing {len(df)} patient records with prompt {prompt_version}: {len(df) - n_pending_rows} "
+          f"already labeled in '{checkpoint_file}', {n_pending_rows} to go ({len(pending)} distinct prompts) ---\n")
+
+    cache = ResponseCache(cache_file) if cache_file else None
+    checkpoint = CheckpointWriter(checkpoint_file, prompt_version)
+    try:
+        if cache is not None and pending:
+            cached = cache.get_many(model, list(pending))
+            for prompt, answer in cached.items():
+                checkpoint.write(pending.pop(prompt), answer)
+            print(f"Cache '{cache_file}': {cache.hits} hits, {cache.misses} misses ({cache.hit_rate:.1%} hit rate)")
+
+        if pending:
+            load_dotenv()
+            # With a stand-in server any key works; retries are handled by ask_model
+            api_key = os.getenv("OPENAI_API_KEY") or ('stand-in' if base_url else None)
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+            progress = asyncio.run(label_rows(
+                client, model, list(pending.items()), checkpoint, cache, concurrency, max_retries
+            ))
+            print(f"Asked {progress.done - progress.errors} prompts in {time.perf_counter() - progress.started:.1f}s "
+                  f"({progress.rate:.1f} prompts/sec, {progress.errors} errors)")
+    finally:
+        checkpoint.close()
+        if cache is not None:
+            cache.close()
+    labels = read_checkpoint(checkpoint_file, prompt_version)
+
+    # Save results (rows still without an answer have no gpt_prediction)
+    if labels:
+        n_labeled = store.write_predictions(prediction_set, store.ids, pd.Series(store.ids).astype(str).map(labels))
+        print(f"\n✅ Done. {n_labeled}/{store.n_rows} rows labeled, saved as '{prediction_set}' "
+              f"in '{store.store_dir}'.")
+        if output_file:
+            labeled_df = df.copy()
+            labeled_df['gpt_prediction'] = row_ids.map(labels).astype('Int64')
+            labeled_df.to_csv(output_file, index=False)
+            print(f"Labeled dataset also saved to '{output_file}'.")
+    else:
+        print("\n⚠️ No data labeled. Nothing saved.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label the heart disease dataset with GPT-4 (y/n) answers.")
+    parser.add_argument('--input-file', default=DEFAULT_INPUT_FILE, help="Cleaned dataset to label")
+    parser.add_argument('--output-file', default=None,
+                        help="Also write the labeled dataset to this CSV (the labels are always stored in the data store)")
+    parser.add_argument('--prediction-set', default=PREDICTION_SET,
+                        help=f"Name of the prediction set stored in the data store (default: {PREDICTION_SET})")
+    parser.add_argument('--checkpoint-file', default=None,
+                        help="Append-only JSONL of the answers so far "
+                             "(default: <output-file>.checkpoint.jsonl, or data/heart_disease_gpt_prediction.checkpoint.jsonl)")
+    parser.add_argument('--model', default='gpt-4', help="Chat model to ask (default: gpt-4)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight at once (default: 8)")
+    parser.add_argument('--max-retries', type=int, default=6, help="Retries per row on rate limits and transient errors")
+    parser.add_argument('--base-url', default=os.getenv('OPENAI_BASE_URL'),
+                        help="OpenAI-compatible endpoint, e.g. the local stand-in server http://127.0.0.1:8000/v1")
+    parser.add_argument('--limit', type=int, default=None, help="Only label the first N rows")
+    parser.add_argument('--prompt-version', default=DEFAULT_PROMPT_VERSION, choices=sorted(PROMPT_TEMPLATES),
+                        help=f"Prompt template version (default: {DEFAULT_PROMPT_VERSION})")
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_FILE, help="SQLite cache of the answers")
+    parser.add_argument('--no-cache', action='store_true', help="Always ask the model, without reading or filling the cache")
+    parser.add_argument('--seed-cache-from', default=None, metavar='CSV',
+                        help="Store the labels of an existing gpt_prediction CSV in the cache, then exit")
+    parser.add_argument('--list-cache', action='store_true', help="Print the cached answers per model and prompt version, then exit")
+    parser.add_argument('--drop-cache-version', default=None, metavar='VERSION',
+                        help="Delete the cached answers of a prompt version (of --model), then exit")
+    args = parser.parse_args()
+
+    if args.seed_cache_from or args.list_cache or args.drop_cache_version:
+        cache = ResponseCache(args.cache_file)
+        if args.seed_cache_from:
+            seed_cache(cache, args.seed_cache_from, args.model, args.prompt_version)
+        if args.drop_cache_version:
+            deleted = cache.drop_version(args.drop_cache_version, args.model)
+            print(f"Deleted {deleted} cached answers of prompt {args.drop_cache_version} ({args.model}).")
+        if args.list_cache:
+            for model, prompt_version, count in cache.versions():
+                print(f"{model}\t{prompt_version}\t{count}")
+        cache.close()
+        return
+
+    collect(args.input_file, args.output_file, checkpoint_file=args.checkpoint_file, model=args.model,
+            concurrency=args.concurrency, max_retries=args.max_retries, base_url=args.base_url, limit=args.limit,
+            prompt_version=args.prompt_version, cache_file=None if args.no_cache else args.cache_file,
+            prediction_set=args.prediction_set)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,177 @@
+"""
+Interactive labeling session: shows each patient of heart_disease_clean.csv and asks whether they are sick (y/n).
+
+Every answer is appended to the annotator's own label file (data/human_labels/<annotator>.jsonl)
+and synced to disk immediately, so closing the terminal loses nothing and the next session
+starts from the first record not labeled yet. Several annotators can label different shards
+of the file at the same time, each writing only to their own file. The merge step then
+stores the labels of all the label files, in one pass, as the 'human_prediction' prediction set
+of the dataset's columnar store (see src/flask/data_store.py); with --output-file it also
+writes the labeled rows as CSV.
+
+Example:
+    python src/data_collection/human_prediction_collection.py --annotator anna --shard 1/2
+    python src/data_collection/human_prediction_collection.py --annotator luca --shard 2/2
+    python src/data_collection/human_prediction_collection.py --merge
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
 import pandas as pd
 
-# Load your dataset
-input_file = '../../data/heart_disease_clean.csv'
-df = pd.read_csv(input_file)
+from label_store import AppendOnlyWriter, read_records
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
+
+from data_store import open_store  # noqa: E402
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+DEFAULT_INPUT_FILE = os.path.join(DATA_PATH, 'heart_disease_clean.csv')
+DEFAULT_LABELS_DIR = os.path.join(DATA_PATH, 'human_labels')
+# Name of the prediction set written to the data store
+PREDICTION_SET = 'human_prediction'
+
+# Columns that are not shown to the annotator (identifiers and the ground truth)
+EXCLUDED_COLUMNS = ['id', 'dataset', 'heart_disease_prediction', 'sick']
 
-# Collect human labels here
-human_labels = []
 
-print(f"\n--- Reviewing {len(df)} patient records ---\n")
+def row_ids(df):
+    return (df['id'] if 'id' in df.columns else df.index.to_series()).astype(str)
 
-# Loop through each row
-for idx, row in df.iterrows():
-    print(f"\n🩺 Patient {idx + 1} of {len(df)}")
 
-    # Display as table using transpose
-    for col in df.columns:
-        if col in ['id', 'dataset', 'heart_disease_prediction', 'sick']:
-            continue
-        print(f"{col}: {row[col]}")
+def parse_shard(shard):
+    """
+    Parses "i/n" (1-based) into (index, count).
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', shard)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"Invalid shard '{shard}': expected i/n with 1 <= i <= n, e.g. 2/4.")
+    return int(match.group(1)) - 1, int(match.group(2))
 
-    # Ask for input
+
+def read_labels(labels_dir):
+    """
+    Returns {row id: record} from every annotator's label file. When a record was labeled more
+    than once the most recent answer wins.
+    """
+    labels = {}
+    for path in sorted(glob.glob(os.path.join(labels_dir, '*.jsonl'))):
+        for record in read_records(path):
+            row_id = str(record['id'])
+            if row_id not in labels or record.get('labeled_at', 0) >= labels[row_id].get('labeled_at', 0):
+                labels[row_id] = record
+    return labels
+
+
+def ask(prompt, choices):
     while True:
-        user_input = input("👉 Is this patient sick? (y/n) or type 'quit' to stop: ").strip().lower()
-        if user_input in ['y', 'n', 'quit']:
-            break
-        else:
-            print("❗ Invalid input. Type 'y', 'n', or 'quit'.")
+        user_input = input(prompt).strip().lower()
+        if user_input in choices:
+            return user_input
+        print(f"❗ Invalid input. Type {', '.join(repr(choice) for choice in choices)}.")
 
-    if user_input == 'quit':
-        break
 
-    human_labels.append(1 if user_input == 'y' else 0)
+def label_session(input_file, labels_dir, annotator, shard=(0, 1)):
+    df = open_store(input_file).frame().reset_index()
+    ids = row_ids(df)
+    shard_index, shard_count = shard
 
-# Save output if any
-if human_labels:
-    labeled_df = df.iloc[:len(human_labels)].copy()
-    labeled_df['human_prediction'] = human_labels
+    # Rows of this shard (every shard_count-th row) that nobody has labeled yet
+    labeled = read_labels(labels_dir)
+    in_shard = [position for position in range(len(df)) if position % shard_count == shard_index]
+    todo = [position for position in in_shard if ids.iloc[position] not in labeled]
+    shown_columns = [col for col in df.columns if col not in EXCLUDED_COLUMNS]
 
+    print(f"\n--- Reviewing shard {shard_index + 1}/{shard_count}: {len(in_shard)} patient records, "
+          f"{len(in_shard) - len(todo)} already labeled, {len(todo)} to go ---\n")
+    if not todo:
+        return
+
+    writer = AppendOnlyWriter(os.path.join(labels_dir, f"{annotator}.jsonl"), fsync=True)
+    done = 0
     try:
-        output_file = '../../data/heart_disease_human_prediction.csv'
-        labeled_df.to_csv(output_file, index=False)
-        print(f"\n✅ Done. {len(labeled_df)} rows saved to '{output_file}'.")
-    except FileNotFoundError as e:
-        print(f"\n Error: {e}. Please check the output file path.")
-
-    
-    print(f"\n✅ Done. {len(labeled_df)} rows saved to '{output_file}'.")
-else:
-    print("\n⚠️ No data labeled. Nothing saved.")
+        for position in todo:
+            row = df.iloc[position]
+            print(f"\n🩺 Patient {position + 1} of {len(df)} ({done + 1}/{len(todo)} of this session)")
+
+            # Display as table using transpose
+            for col in shown_columns:
+                print(f"{col}: {row[col]}")
+
+            user_input = ask("👉 Is this patient sick? (y/n) or type 'quit' to stop: ", ['y', 'n', 'quit'])
+            if user_input == 'quit':
+                break
+
+            writer.write([{
+                "id": ids.iloc[position],
+                "human_prediction": 1 if user_input == 'y' else 0,
+                "annotator": annotator,
+                "labeled_at": time.time()
+            }])
+            done += 1
+    except (KeyboardInterrupt, EOFError):
+        print()
+    finally:
+        writer.close()
+
+    print(f"\n✅ {done} labels saved to '{writer.path}'. {len(todo) - done} left in this shard; "
+          f"run the same command to resume.")
+
+
+def merge(input_file, labels_dir, output_file=None):
+    """
+    Stores the labels of all label files as a prediction set of the data store and, if output_file
+    is given, also writes the labeled dataset (only the labeled rows, in dataset order) as CSV.
+    """
+    store = open_store(input_file)
+    df = store.frame().reset_index()
+    labels = read_labels(labels_dir)
+    if not labels:
+        print(f"\n⚠️ No labels found in '{labels_dir}'. Nothing saved.")
+        return
+
+    human_labels = row_ids(df).map({row_id: record['human_prediction'] for row_id, record in labels.items()})
+    store.write_predictions(PREDICTION_SET, df['id'], human_labels)
+    labeled_df = df[human_labels.notna()].copy()
+    labeled_df['human_prediction'] = human_labels[human_labels.notna()].astype(int)
+
+    annotators = sorted({labels[row_id].get('annotator', '?') for row_id in row_ids(labeled_df)})
+    print(f"\n✅ Done. {len(labeled_df)} of {len(df)} rows labeled by {', '.join(annotators)} "
+          f"saved as '{PREDICTION_SET}' in '{store.store_dir}'.")
+
+    if output_file:
+        try:
+            labeled_df.to_csv(output_file, index=False)
+        except FileNotFoundError as e:
+            print(f"\n Error: {e}. Please check the output file path.")
+            return
+        print(f"Labeled dataset also saved to '{output_file}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect (or merge) human labels for the heart disease dataset.")
+    parser.add_argument('--input-file', default=DEFAULT_INPUT_FILE, help="Cleaned dataset to label")
+    parser.add_argument('--labels-dir', default=DEFAULT_LABELS_DIR, help="Folder of the per-annotator label files")
+    parser.add_argument('--annotator', default=os.getenv('USER', 'annotator'),
+                        help="Name of the annotator, used as label file name (default: $USER)")
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1),
+                        help="Label only shard i of n (every n-th record), e.g. 2/4 (default: 1/1)")
+    parser.add_argument('--merge', action='store_true',
+                        help="Instead of labeling, store the labels of all the label files in the data store")
+    parser.add_argument('--output-file', default=None, help="Also write the labeled dataset to this CSV with --merge")
+    args = parser.parse_args()
+
+    if args.merge:
+        merge(args.input_file, args.labels_dir, args.output_file)
+    elif not re.fullmatch(r'[\w.-]+', args.annotator):
+        parser.error("--annotator may only contain letters, digits, '_', '-' and '.'.")
+    else:
+        label_session(args.input_file, args.labels_dir, args.annotator, args.shard)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Append-only JSONL files used to persist labels one answer at a time.
+
+Each label is written as one JSON line and flushed immediately, so a crash loses at most the
+line being written; a truncated last line is skipped on read and terminated before the next
+append.
+"""
+import json
+import os
+
+
+def read_records(path):
+    """
+    Yields the JSON records of an append-only file, skipping a line truncated by a crash.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class AppendOnlyWriter:
+    """
+    Appends JSON records to a file, flushing (and optionally fsyncing) after every write.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Terminate a line left truncated by a previous crash before appending
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                needs_newline = file.read(1) != b'\n'
+        self._file = open(path, 'a', encoding='utf-8')
+        if needs_newline:
+            self._file.write('\n')
+
+    def write(self, records):
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,99 @@
+"""
+Persistent cache of LLM answers, so repeated labeling runs only pay for prompts never asked before.
+
+Answers are stored in SQLite, keyed by a hash of the model and the full prompt text, and tagged
+with the prompt template version that produced the prompt: entries of one version can be
+counted, listed or dropped without touching the others.
+"""
+import hashlib
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    template_version TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_version ON responses (model, template_version);
+"""
+
+
+def response_key(model, prompt):
+    return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite store of {hash(model, prompt): answer}, with hit/miss counters for the current run.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._connection = sqlite3.connect(db_file)
+        # WAL keeps the file consistent if a run is killed mid-write
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model, prompts):
+        """
+        Returns {prompt: answer} for the prompts already answered by model, counting hits and misses.
+        """
+        keys = {response_key(model, prompt): prompt for prompt in prompts}
+        answers = {}
+        key_list = list(keys)
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(key_list), 500):
+            batch = key_list[start:start + 500]
+            rows = self._connection.execute(
+                f"SELECT key, answer FROM responses WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            for key, answer in rows:
+                answers[keys[key]] = answer
+        self.hits += len(answers)
+        self.misses += len(keys) - len(answers)
+        return answers
+
+    def put(self, model, template_version, prompt, answer):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, model, template_version, prompt, answer, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (response_key(model, prompt), model, template_version, prompt, answer, time.time())
+        )
+        self._connection.commit()
+
+    def versions(self):
+        """
+        Returns [(model, template version, number of cached answers)].
+        """
+        return self._connection.execute(
+            "SELECT model, template_version, COUNT(*) FROM responses GROUP BY model, template_version ORDER BY 1, 2"
+        ).fetchall()
+
+    def drop_version(self, template_version, model=None):
+        """
+        Deletes the cached answers of one prompt template version (of every model unless given).
+        Returns the number of deleted entries.
+        """
+        if model is None:
+            cursor = self._connection.execute("DELETE FROM responses WHERE template_version = ?", (template_version,))
+        else:
+            cursor = self._connection.execute(
+                "DELETE FROM responses WHERE template_version = ? AND model = ?", (template_version, model)
+            )
+        self._connection.commit()
+        return cursor.rowcount
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,87 @@
+"""
+Local stand-in for the OpenAI chat completions API, to benchmark the GPT-4 labeling pipeline offline.
+
+Answers POST /v1/chat/completions with "yes" or "no" (derived from a hash of the prompt, so
+the same prompt always gets the same answer) after a configurable latency, and can reject a
+fraction of the requests with 429 to exercise the retry logic.
+
+Example:
+    python src/data_collection/stand_in_server.py --port 8000 --latency-ms 400 --rate-limit-ratio 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    rate_limit_ratio = 0.0
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (e.g. the collector was interrupted)
+            pass
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        if random.random() < self.rate_limit_ratio:
+            self._send_json(429, {"error": {"message": "Rate limit reached (stand-in).", "type": "rate_limit_exceeded"}},
+                            headers={"Retry-After": "0.1"})
+            return
+
+        time.sleep(self.latency)
+        prompt = request.get('messages', [{}])[-1].get('content', '')
+        answer = 'yes' if hashlib.blake2b(prompt.encode('utf-8'), digest_size=1).digest()[0] % 2 else 'no'
+        self._send_json(200, {
+            "id": "chatcmpl-stand-in",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'stand-in'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": 1,
+                      "total_tokens": len(prompt.split()) + 1}
+        })
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency-ms', type=float, default=300.0, help="Simulated model latency per request")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    StandInHandler.latency = args.latency_ms / 1000.0
+    StandInHandler.rate_limit_ratio = args.rate_limit_ratio
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    server.daemon_threads = True
+    print(f"Stand-in OpenAI API listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
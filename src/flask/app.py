@@ -1,46 +1,308 @@
-import pickle
-from flask import Flask, request, jsonify
+import hmac
+import json
+from flask import Flask, Response, request, jsonify, stream_with_context
 import numpy as np
 import os
-import onnxruntime as ort
+from inference import ProfileSampler, make_session_options
+from batching import MicroBatcher, QueueFullError
+from cache import PredictionCache
+from registry import ModelRegistry
+from encoding import RAW_COLUMNS, encode_records
+from explain import BACKGROUND_FILE, Background, BackgroundNotFoundError, make_explainer
+from metrics import ROWS_BUCKETS, MetricsRegistry, RequestTimer
+from bulk import (
+    CSV_CONTENT_TYPES, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, NDJSON_CONTENT_TYPES,
+    BulkInputError, iter_chunks, iter_csv_rows, iter_ndjson_rows, score_chunks,
+)
 # Initialize the Flask application
 app = Flask(__name__)
 
-# Define the path to your pickled model file
+# Define the path to your onnx model files
 MODEL_PATH = os.getenv('MODEL_PATH', 'models/')  
+# Display names of the models, used for files not described in the MODEL_PATH manifest (models.json)
 MODEL_FILES = {
     'K-Nearest Neighbors': 'best_knn_model.onnx',
     'Logistic Regression': 'best_log_model.onnx',
 }
 
 MODEL_STATS = 'tuned_model_performance.csv'
-# Global variable to store the loaded model
-loaded_models = {}
-# --- Model Loading Function ---
+
+# ONNX Runtime session tuning: threads per session (0 lets ONNX Runtime pick) and graph optimization level
+ORT_INTRA_OP_THREADS = int(os.getenv('ORT_INTRA_OP_THREADS', '1'))
+ORT_INTER_OP_THREADS = int(os.getenv('ORT_INTER_OP_THREADS', '1'))
+ORT_OPTIMIZATION_LEVEL = os.getenv('ORT_OPTIMIZATION_LEVEL', 'all')
+
+# Hot reload: poll MODEL_PATH every MODEL_WATCH_INTERVAL seconds (0 disables), or call /admin/reload_models
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', '0'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Opt-in dynamic micro-batching: concurrent requests for the same model are grouped into one ONNX run.
+# It only pays off when a worker serves several requests at once (e.g. gunicorn --threads).
+BATCHING_ENABLED = os.getenv('BATCHING_ENABLED', '0') == '1'
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '64'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '2'))
+BATCH_MAX_QUEUE = int(os.getenv('BATCH_MAX_QUEUE', '1024'))
+
+# Opt-in LRU cache of predictions, keyed by model name and the float32 bytes of each row
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', '0') == '1'
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', '300'))
+
+# Prometheus metrics: with several gunicorn workers, METRICS_DIR must be a folder shared by the workers
+METRICS_DIR = os.getenv('METRICS_DIR')
+# Opt-in ONNX Runtime profiling of a sample of the requests (e.g. 0.001), traces written to ORT_PROFILE_DIR
+ORT_PROFILE_SAMPLE_RATE = float(os.getenv('ORT_PROFILE_SAMPLE_RATE', '0'))
+ORT_PROFILE_DIR = os.getenv('ORT_PROFILE_DIR', 'profiles/')
+
+# Explanations (/explain): permutations sampled per patient for the models that are not linear (KNN)
+EXPLAIN_PERMUTATIONS = int(os.getenv('EXPLAIN_PERMUTATIONS', '10'))
+
+# Registry of the models found in MODEL_PATH, swapped atomically on reload
+model_registry = ModelRegistry(
+    MODEL_PATH,
+    sess_options_factory=lambda: make_session_options(
+        ORT_INTRA_OP_THREADS, ORT_INTER_OP_THREADS, ORT_OPTIMIZATION_LEVEL
+    ),
+    default_names={file_name: name for name, file_name in MODEL_FILES.items()},
+)
+# Global variable to store the loaded models (kept up to date by the registry)
+loaded_models = model_registry.models
+# Micro-batchers sitting in front of loaded_models (only populated when batching is enabled)
+model_batchers = {}
+# Prediction cache sitting in front of the models (None when caching is disabled)
+prediction_cache = PredictionCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS) if CACHE_ENABLED else None
+# Explainers of the loaded models, built on the first /explain request (see explain.py)
+model_explainers = {}
+# Per-row cache of explanations, like the prediction cache (None when caching is disabled)
+explanation_cache = PredictionCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS) if CACHE_ENABLED else None
+
+# --- Metrics ---
+metrics = MetricsRegistry(METRICS_DIR)
+metrics.counter('prediction_requests_total', 'Prediction requests by endpoint, model and status code.')
+metrics.histogram('prediction_request_seconds', 'End-to-end prediction request latency in seconds.')
+metrics.histogram('prediction_stage_seconds', 'Time spent in each stage (parse, convert, inference, serialize) of a request.')
+metrics.histogram('prediction_batch_rows', 'Rows per model run (source: request or batcher).', ROWS_BUCKETS)
+metrics.gauge('model_load_seconds', 'Time taken to load the current version of each model.')
+metrics.gauge('batcher_queue_depth', 'Requests waiting in each model micro-batcher.')
+metrics.gauge('prediction_cache_entries', 'Rows currently held by the prediction cache.')
+metrics.counter('prediction_cache_hits_total', 'Prediction cache hits.')
+metrics.counter('prediction_cache_misses_total', 'Prediction cache misses.')
+metrics.counter('prediction_cache_evictions_total', 'Prediction cache evictions (LRU and TTL).')
+metrics.counter('onnx_profiles_total', 'ONNX Runtime profiling traces written, by model.')
+
+def collect_metrics(registry):
+    """
+    Copies the values owned by the registry, the batchers and the cache into the metrics before each export.
+    """
+    for model_name, metadata in list(model_registry.metadata.items()):
+        if metadata.get('load_seconds') is not None:
+            registry.set('model_load_seconds', {"model": model_name}, metadata['load_seconds'])
+    for model_name, batcher in list(model_batchers.items()):
+        registry.set('batcher_queue_depth', {"model": model_name}, batcher.queue_depth())
+    if prediction_cache is not None:
+        stats = prediction_cache.stats.snapshot()
+        registry.set('prediction_cache_entries', None, len(prediction_cache))
+        # The cache statistics only grow: exported as counters, they outlive the worker like the others
+        registry.set('prediction_cache_hits_total', None, stats["hits"])
+        registry.set('prediction_cache_misses_total', None, stats["misses"])
+        registry.set('prediction_cache_evictions_total', None, stats["evictions"] + stats["expirations"])
+
+metrics.add_collector(collect_metrics)
+metrics.start_flusher()
+
+profile_sampler = ProfileSampler(
+    ORT_PROFILE_DIR, ORT_PROFILE_SAMPLE_RATE,
+    on_profile=lambda model_name, trace_file: metrics.inc('onnx_profiles_total', {"model": model_name}),
+) if ORT_PROFILE_SAMPLE_RATE > 0 else None
+
+# --- Model Loading Functions ---
+def on_model_swapped(model_name, plan):
+    """
+    Points the batcher and the cache of a model at its newly loaded version (plan is None if removed).
+    """
+    if BATCHING_ENABLED:
+        if plan is None:
+            batcher = model_batchers.pop(model_name, None)
+            if batcher is not None:
+                batcher.close()
+        elif model_name in model_batchers:
+            model_batchers[model_name].plan = plan
+        else:
+            model_batchers[model_name] = MicroBatcher(
+                plan,
+                max_batch_size=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                max_queue_size=BATCH_MAX_QUEUE,
+                name=model_name,
+                on_batch=lambda n_requests, n_rows, model_name=model_name: metrics.observe(
+                    'prediction_batch_rows', {"model": model_name, "source": "batcher"}, n_rows
+                ),
+            )
+    model_explainers.pop(model_name, None)
+    for cache in (prediction_cache, explanation_cache):
+        if cache is not None:
+            cache.invalidate(model_name)
+            if plan is not None:
+                cache.watch(model_name, os.path.join(MODEL_PATH, model_registry.metadata[model_name]['file']))
+
+model_registry.add_listener(on_model_swapped)
+
 def load_models():
     """
-    Loads the scikit-learn model from the specified onnx file.
-    This function will be called once when the Flask app starts.
+    Loads (or reloads) the onnx models found in MODEL_PATH.
+    This function is called when the Flask app starts, then by the file watcher or /admin/reload_models.
     """
     
-    for save_name, model_name in MODEL_FILES.items():
-        if os.path.exists(MODEL_PATH + model_name):
-            try:
-                with open(MODEL_PATH + model_name, 'rb') as _:
-                    loaded_models[save_name] = ort.InferenceSession(MODEL_PATH + model_name)
-                print(f"Model {save_name} successfully loaded from {model_name}")
-            except (FileNotFoundError, IOError) as e:
-                print(f"Error loading model '{save_name}' from {model_name}: {e}")
-        else:
-            print(f"Model file for '{save_name}' not found at {MODEL_PATH + model_name}. Skipping.")
+    summary = model_registry.reload()
     
     if not loaded_models:
         print("WARNING: No models were loaded successfully. Prediction endpoint will fail.")
     else:
         print(f"Successfully loaded models: {list(loaded_models.keys())}")
+    return summary
 
 # Ensure models are loaded when the app starts
 load_models()
+model_registry.start_watcher(MODEL_WATCH_INTERVAL)
+
+# --- Request Helpers (shared with the ASGI entry point) ---
+
+def prepare_input(chosen_model, input_data, patients=None):
+    """
+    Converts encoded feature rows, or raw patient records encoded by the server,
+    to a NumPy array of the model's input dtype. Raises ValueError on invalid input,
+    including an empty batch (ONNX Runtime cannot score zero rows).
+    """
+    if patients is not None:
+        # Encode the whole batch of raw records in one vectorized pass
+        if isinstance(patients, dict):
+            patients = [patients]
+        if isinstance(patients, list) and not patients:
+            raise ValueError("'patients' is an empty list")
+        input_data = encode_records(patients)
+    elif isinstance(input_data, list) and not input_data:
+        raise ValueError("'data' is an empty list")
+
+    # Convert the input list of lists to a NumPy array of the model's input dtype
+    return chosen_model.prepare(input_data)
+
+def run_prediction(model_name, chosen_model, input_array, timer=None):
+    """
+    Makes a prediction using the chosen model (through its cache and batcher, if enabled):
+    labels and probabilities in a single run. Returns the response body.
+    """
+    if timer is not None:
+        timer.mark('convert')
+    metrics.observe('prediction_batch_rows', {"model": model_name, "source": "request"}, len(input_array))
+    if profile_sampler is not None:
+        profile_sampler.maybe_profile(model_name, chosen_model, input_array)
+
+    runner = model_batchers.get(model_name, chosen_model)
+    if prediction_cache is not None:
+        predictions, probabilities = prediction_cache.run(model_name, runner, input_array)
+    else:
+        predictions, probabilities = runner.run(input_array)
+    if timer is not None:
+        timer.mark('inference')
+    response = {
+        "model_used": model_name,
+        "predictions": predictions.tolist()  # Convert ndarray to list
+    }
+    if probabilities is not None:
+        # ONNX models may not always provide probabilities
+        response["classes"] = chosen_model.classes
+        response["probabilities"] = probabilities.tolist()  # Convert ndarray to list
+    return response
+
+def get_explainer(model_name, chosen_model):
+    """
+    Returns the explainer of a loaded model, (re)built when the model or the background file changed.
+    Raises BackgroundNotFoundError when MODEL_PATH has no background file, ValueError when the model cannot be explained.
+    """
+    background_file = os.path.join(MODEL_PATH, BACKGROUND_FILE)
+    background_version = Background.file_version(background_file)
+    explainer = model_explainers.get(model_name)
+    if explainer is not None and explainer.plan is chosen_model and explainer.background_version == background_version:
+        return explainer
+    if background_version is None:
+        raise BackgroundNotFoundError(
+            f"Explanation background '{BACKGROUND_FILE}' not found in MODEL_PATH: "
+            f"export the models with src/training/train_export.py."
+        )
+
+    model_file = os.path.join(MODEL_PATH, model_registry.metadata[model_name]['file'])
+    explainer = make_explainer(chosen_model, model_file, Background(background_file), EXPLAIN_PERMUTATIONS)
+    if explainer is None:
+        raise ValueError(f"Model '{model_name}' returns no probabilities to explain.")
+    model_explainers[model_name] = explainer
+    if explanation_cache is not None:
+        # Cached explanations may come from a previous background
+        explanation_cache.invalidate(model_name)
+    return explainer
+
+def run_explanation(model_name, chosen_model, input_array, timer=None):
+    """
+    Explains the model output for each row: one contribution per raw patient field, summing to
+    the output minus the base value (expected output on the background). Returns the response body.
+    """
+    explainer = get_explainer(model_name, chosen_model)
+    if timer is not None:
+        timer.mark('convert')
+    if explanation_cache is not None:
+        outputs, contributions = explanation_cache.run(model_name, explainer, input_array)
+    else:
+        outputs, contributions = explainer.run(input_array)
+    if timer is not None:
+        timer.mark('inference')
+    return {
+        "model_used": model_name,
+        "method": explainer.method,
+        "output": explainer.output,
+        "base_value": explainer.base_value,
+        "outputs": outputs.tolist(),
+        "contributions": [dict(zip(RAW_COLUMNS, row)) for row in contributions.tolist()],
+    }
+
+def is_explainable(model_name):
+    """
+    Whether /explain can answer for a model: it is loaded with probabilities and MODEL_PATH has a background file.
+    """
+    chosen_model = loaded_models.get(model_name)
+    return (chosen_model is not None and chosen_model.has_probabilities
+            and os.path.exists(os.path.join(MODEL_PATH, BACKGROUND_FILE)))
+
+def read_model_performance(model_name):
+    """
+    Reads a model's accuracy, recall and roc_auc from the performance file, and whether the
+    model can be explained. Returns (response body, status code).
+    """
+    # load MODEL_PATH + tunded_model_performance.csv
+    performance_file = MODEL_PATH + MODEL_STATS
+    if not os.path.exists(performance_file):
+        return {"error": f"Model performace file '{MODEL_STATS}' not found."}, 404
+    try:
+        with open(performance_file, 'r', encoding='utf-8') as file:
+            lines = file.readlines()
+            # Find the line for the requested model
+            for line in lines:
+                if line.startswith(model_name):
+                    stats = line.strip().split(',')
+                    return {
+                        "model_name": model_name,
+                        "accuracy": stats[1],
+                        "recall": stats[2],
+                        "roc_auc": stats[3],
+                        "explainable": is_explainable(model_name)
+                    }, 200
+            return {"error": f"Model '{model_name}' performace file not found."}, 404
+    except IOError as e:
+        return {"error": f"Error reading model performance file: {e}"}, 500
+
+def model_label(model_name):
+    """
+    Model name used as a metrics label: unknown names are grouped to keep the number of series bounded.
+    """
+    return model_name if model_name in loaded_models else 'unknown'
 
 # --- Flask Routes ---
 
@@ -68,60 +330,172 @@ def predict():
         "model_name": string  # or "K-Nearest Neighbors", "Logistic Regression", "SVC"
         "data": [[feature1_val1, feature2_val1, ...]]
     }
+    or, with raw patient fields (as in heart_disease_clean.csv) encoded by the server:
+    {
+        "model_name": string
+        "patients": [{"age": 63, "sex": "Male", "chest_pain_type": "typical angina", ...}]
+    }
     """
 
+    timer = RequestTimer()
+
+    def respond(body, status, model_name=None):
+        response = jsonify(body)
+        timer.mark('serialize')
+        timer.record(metrics, '/predict', model_label(model_name), status)
+        return response, status
+
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+        return respond({"error": "Request must be JSON"}, 400)
 
     request_data = request.get_json()
+    timer.mark('parse')
 
     # Get the model name from the request
     model_name = request_data.get('model_name')
     if not model_name:
-        return jsonify({"error": "Missing 'model_name' field in request body."}), 400
+        return respond({"error": "Missing 'model_name' field in request body."}, 400)
 
     # Retrieve the chosen model
     chosen_model = loaded_models.get(model_name)
     if chosen_model is None:
-        return jsonify({
+        return respond({
             "error": f"Model '{model_name}' not found or not loaded. Available models: {list(loaded_models.keys())}"
-        }), 404 
+        }, 404)
 
-    # Get the data for prediction
+    # Get the data for prediction: encoded feature rows or raw patient fields
     input_data = request_data.get('data')
-    if input_data is None: # Check explicitly for None, as get() returns None if key is missing
-        return jsonify({"error": "Missing 'data' field in request body."}), 400
+    patients = request_data.get('patients')
+    if input_data is None and patients is None: # Check explicitly for None, as get() returns None if key is missing
+        return respond({"error": "Missing 'data' or 'patients' field in request body."}, 400, model_name)
 
     try:
-        # Convert the input list of lists to a NumPy array
-        input_array = np.array(input_data)
-        print(input_array)
-
-        # Make prediction using the chosen model
-        input_name = chosen_model.get_inputs()[0].name
-        label_name = chosen_model.get_outputs()[0].name
-        predictions = chosen_model.run([label_name], {input_name: input_array.astype(np.float32)})[0]
-        probabilities = None  # ONNX models may not always provide probabilities
-        
-        try:
-            # Check if the model provides probabilities
-            prob_output_name = chosen_model.get_outputs()[1].name  # Assuming the second output is probabilities
-            probabilities = chosen_model.run([prob_output_name], {input_name: input_array.astype(np.float32)})[0]
-        except IndexError:
-            # If the model does not have a second output for probabilities, skip
-            probabilities = None
-        response = {
-            "model_used": model_name,
-            "predictions": predictions.tolist()  # Convert ndarray to list
-        }
-        if probabilities is not None:
-            response["probabilities"] = probabilities  # Convert ndarray to list
-        return jsonify(response), 200
+        input_array = prepare_input(chosen_model, input_data, patients)
+        return respond(run_prediction(model_name, chosen_model, input_array, timer), 200, model_name)
 
     except ValueError as ve:
         # Handle cases where input data dimensions don't match model's expected features
-        return jsonify({"error": f"Invalid input data format or dimensions for model '{model_name}': {ve}"}), 400
+        return respond({"error": f"Invalid input data format or dimensions for model '{model_name}': {ve}"}, 400, model_name)
+    except QueueFullError as qe:
+        # The batcher is saturated: ask the client to retry later
+        return respond({"error": str(qe)}, 503, model_name)
     
+@app.route('/explain', methods=['POST'])
+def explain():
+    """
+    API endpoint returning, for each patient, the contribution of every raw field to the model output.
+
+    Same request body as /predict ('model_name' and 'data' or 'patients'). Logistic Regression is
+    explained exactly in log-odds, the other models (KNN) by permutation sampling on the
+    probability of the positive class:
+    {
+        "model_used": string, "method": "linear" | "permutation", "output": "log-odds" | "probability",
+        "base_value": float,        # expected output on the training background
+        "outputs": [float],         # model output of each patient = base_value + sum of its contributions
+        "contributions": [{"age": float, "sex": float, ...}]
+    }
+    """
+
+    timer = RequestTimer()
+
+    def respond(body, status, model_name=None):
+        response = jsonify(body)
+        timer.mark('serialize')
+        timer.record(metrics, '/explain', model_label(model_name), status)
+        return response, status
+
+    if not request.is_json:
+        return respond({"error": "Request must be JSON"}, 400)
+
+    request_data = request.get_json()
+    timer.mark('parse')
+
+    model_name = request_data.get('model_name')
+    if not model_name:
+        return respond({"error": "Missing 'model_name' field in request body."}, 400)
+
+    chosen_model = loaded_models.get(model_name)
+    if chosen_model is None:
+        return respond({
+            "error": f"Model '{model_name}' not found or not loaded. Available models: {list(loaded_models.keys())}"
+        }, 404)
+
+    input_data = request_data.get('data')
+    patients = request_data.get('patients')
+    if input_data is None and patients is None:
+        return respond({"error": "Missing 'data' or 'patients' field in request body."}, 400, model_name)
+
+    try:
+        input_array = prepare_input(chosen_model, input_data, patients)
+        return respond(run_explanation(model_name, chosen_model, input_array, timer), 200, model_name)
+
+    except BackgroundNotFoundError as be:
+        return respond({"error": str(be)}, 503, model_name)
+    except ValueError as ve:
+        return respond({"error": f"Cannot explain the input for model '{model_name}': {ve}"}, 400, model_name)
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    API endpoint to score a whole file of patients in one streamed call.
+
+    The upload is read incrementally, packed into float32 chunks of 'chunk_size' rows
+    and each chunk is run through the chosen model; results are streamed back as NDJSON,
+    one line per row: {"row": int, "id": ..., "prediction": int, "probabilities": [...]}.
+
+    Query parameters:
+        model_name: string  # "K-Nearest Neighbors", "Logistic Regression"
+        chunk_size: int     # optional, rows per ONNX run
+
+    Expected request body (streamed):
+        text/csv:             header line (optional 'id' column + feature columns), then one row per patient
+        application/x-ndjson: one JSON array of features, or {"id": ..., "data": [...]}, per line
+    """
+
+    model_name = request.args.get('model_name')
+    if not model_name:
+        return jsonify({"error": "Missing 'model_name' query parameter."}), 400
+
+    chosen_model = loaded_models.get(model_name)
+    if chosen_model is None:
+        return jsonify({
+            "error": f"Model '{model_name}' not found or not loaded. Available models: {list(loaded_models.keys())}"
+        }), 404
+    if chosen_model.n_features is None:
+        return jsonify({"error": f"Model '{model_name}' does not declare a fixed number of features."}), 500
+
+    try:
+        chunk_size = int(request.args.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        return jsonify({"error": "'chunk_size' must be an integer."}), 400
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        return jsonify({"error": f"'chunk_size' must be between 1 and {MAX_CHUNK_SIZE}."}), 400
+
+    if request.mimetype in CSV_CONTENT_TYPES:
+        rows = iter_csv_rows(request.stream)
+    elif request.mimetype in NDJSON_CONTENT_TYPES:
+        rows = iter_ndjson_rows(request.stream)
+    else:
+        return jsonify({"error": "Request body must be CSV (text/csv) or NDJSON (application/x-ndjson)."}), 415
+
+    def generate():
+        timer = RequestTimer()
+        status = 200
+        try:
+            yield from score_chunks(chosen_model, iter_chunks(rows, chosen_model.n_features, chunk_size))
+        except BulkInputError as e:
+            # The status code is already sent: report the error as the last NDJSON line
+            status = 400
+            yield json.dumps({
+                "error": f"Invalid input data format or dimensions for model '{model_name}': {e}",
+                "row": e.row_number
+            }) + '\n'
+        finally:
+            timer.record(metrics, '/predict_batch', model_label(model_name), status)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/models', methods=['POST'])
 def get_model_performace():
     """
@@ -142,26 +516,8 @@ def get_model_performace():
     if not model_name:
         return jsonify({"error": "Missing 'model_name' field in request body."}), 400
 
-    # load MODEL_PATH + tunded_model_performance.csv
-    performance_file = MODEL_PATH + MODEL_STATS
-    if not os.path.exists(performance_file):
-        return jsonify({"error": f"Model performace file '{MODEL_STATS}' not found."}), 404
-    try:
-        with open(performance_file, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-            # Find the line for the requested model
-            for line in lines:
-                if line.startswith(model_name):
-                    stats = line.strip().split(',')
-                    return jsonify({
-                        "model_name": model_name,
-                        "accuracy": stats[1],
-                        "recall": stats[2],
-                        "roc_auc": stats[3]
-                    }), 200
-            return jsonify({"error": f"Model '{model_name}' performace file not found."}), 404
-    except IOError as e:
-        return jsonify({"error": f"Error reading model performance file: {e}"}), 500
+    body, status = read_model_performance(model_name)
+    return jsonify(body), status
     
 @app.route('/model_list', methods=['POST'])
 def return_model_list():
@@ -175,6 +531,75 @@ def return_model_list():
     return jsonify({"available_models": list(loaded_models.keys())}), 200
 
 
+@app.route('/batching_stats', methods=['GET'])
+def get_batching_stats():
+    """
+    API endpoint to return the micro-batching metrics (batch sizes, wait times, queue depth) of each model.
+    """
+
+    if not BATCHING_ENABLED:
+        return jsonify({"batching_enabled": False}), 200
+
+    stats = {}
+    for model_name, batcher in model_batchers.items():
+        stats[model_name] = batcher.stats.snapshot()
+        stats[model_name]["queue_depth"] = batcher.queue_depth()
+    return jsonify({
+        "batching_enabled": True,
+        "max_batch_size": BATCH_MAX_SIZE,
+        "max_wait_ms": BATCH_MAX_WAIT_MS,
+        "max_queue_size": BATCH_MAX_QUEUE,
+        "models": stats
+    }), 200
+
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """
+    API endpoint to return the prediction cache counters (hits, misses, evictions) of this worker.
+    """
+
+    if prediction_cache is None:
+        return jsonify({"cache_enabled": False}), 200
+
+    stats = prediction_cache.stats.snapshot()
+    stats.update({
+        "cache_enabled": True,
+        "entries": len(prediction_cache),
+        "max_entries": CACHE_MAX_ENTRIES,
+        "ttl_seconds": CACHE_TTL_SECONDS
+    })
+    return jsonify(stats), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    API endpoint exposing request counts, latency histograms (total and per stage), batch sizes,
+    queue depth, cache counters and model load times in the Prometheus text format.
+    """
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/reload_models', methods=['POST'])
+def reload_models():
+    """
+    Admin endpoint to reload the models of MODEL_PATH without restarting the server.
+    Requires the 'X-Admin-Token' header to match the ADMIN_TOKEN environment variable.
+    Only the worker serving the request reloads; use MODEL_WATCH_INTERVAL to reload every worker.
+    """
+
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled (ADMIN_TOKEN is not set)."}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({"error": "Invalid or missing 'X-Admin-Token' header."}), 401
+
+    summary = load_models()
+    summary["models"] = model_registry.metadata
+    return jsonify(summary), 200
+
+
 # --- Main execution block ---
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,202 @@
+"""
+Async ASGI entry point for the prediction API, with the same /predict, /models and /model_list
+contract as the Flask app. Models, encoding, batching and caching are shared with app.py.
+
+ONNX runs are handed to a bounded thread pool (ONNX Runtime releases the GIL), so one process
+keeps every core busy while the event loop handles thousands of idle or slow connections.
+When too many predictions are waiting the API answers 429, and on shutdown it stops accepting
+new predictions and drains the pending ones.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import app as backend
+from batching import QueueFullError
+from metrics import RequestTimer
+
+ASGI_INFERENCE_THREADS = int(os.getenv('ASGI_INFERENCE_THREADS', str(os.cpu_count() or 1)))
+ASGI_MAX_PENDING = int(os.getenv('ASGI_MAX_PENDING', '256'))
+ASGI_SHUTDOWN_TIMEOUT = float(os.getenv('ASGI_SHUTDOWN_TIMEOUT', '30'))
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for model runs, with admission control.
+
+    The pending counter is only touched from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.accepting = True
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='onnx')
+
+    def is_full(self):
+        return self.pending >= self.max_pending
+
+    async def run(self, function, *args):
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self.pending -= 1
+
+    async def shutdown(self, timeout):
+        """
+        Stops accepting new work and waits (up to timeout seconds) for the pending runs to finish.
+        """
+        self.accepting = False
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.pending and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        self._executor.shutdown(wait=True)
+
+
+inference_executor = InferenceExecutor(ASGI_INFERENCE_THREADS, ASGI_MAX_PENDING)
+
+
+def _predict(model_name, chosen_model, input_data, patients, timer):
+    """
+    Encodes, converts and scores a request; runs in the inference thread pool.
+    """
+    input_array = backend.prepare_input(chosen_model, input_data, patients)
+    return backend.run_prediction(model_name, chosen_model, input_array, timer)
+
+
+async def _read_json(request):
+    if request.headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+        return None
+    try:
+        request_data = await request.json()
+    except ValueError:
+        return None
+    return request_data if isinstance(request_data, dict) else None
+
+
+# --- ASGI Routes ---
+
+async def home(request):
+    """
+    Basic home route to confirm the server is running.
+    """
+    available_models = list(backend.loaded_models.keys())
+    return HTMLResponse(
+        f"ASGI multi-model prediction backend is running!<br>"
+        f"Available models: {', '.join(available_models) if available_models else 'None'}<br>"
+        f"Use /predict to make predictions, specifying 'model_name' in your JSON request."
+    )
+
+
+async def predict(request):
+    """
+    Same contract as the Flask /predict endpoint; see app.predict().
+    """
+    timer = RequestTimer()
+
+    def respond(body, status, model_name=None, headers=None):
+        response = JSONResponse(body, status_code=status, headers=headers)
+        timer.mark('serialize')
+        timer.record(backend.metrics, '/predict', backend.model_label(model_name), status)
+        return response
+
+    request_data = await _read_json(request)
+    if request_data is None:
+        return respond({"error": "Request must be JSON"}, 400)
+    timer.mark('parse')
+
+    model_name = request_data.get('model_name')
+    if not model_name:
+        return respond({"error": "Missing 'model_name' field in request body."}, 400)
+
+    chosen_model = backend.loaded_models.get(model_name)
+    if chosen_model is None:
+        return respond({
+            "error": f"Model '{model_name}' not found or not loaded. Available models: {list(backend.loaded_models.keys())}"
+        }, 404)
+
+    input_data = request_data.get('data')
+    patients = request_data.get('patients')
+    if input_data is None and patients is None:
+        return respond({"error": "Missing 'data' or 'patients' field in request body."}, 400, model_name)
+
+    # Backpressure: refuse new work while shutting down or when too many predictions are waiting
+    if not inference_executor.accepting:
+        return respond({"error": "Server is shutting down."}, 503, model_name)
+    if inference_executor.is_full():
+        return respond(
+            {"error": f"Too many pending predictions ({inference_executor.pending}). Retry later."},
+            429, model_name, headers={"Retry-After": "1"}
+        )
+
+    try:
+        response = await inference_executor.run(_predict, model_name, chosen_model, input_data, patients, timer)
+    except ValueError as ve:
+        return respond(
+            {"error": f"Invalid input data format or dimensions for model '{model_name}': {ve}"}, 400, model_name
+        )
+    except QueueFullError as qe:
+        return respond({"error": str(qe)}, 503, model_name)
+    return respond(response, 200, model_name)
+
+
+async def get_model_performace(request):
+    """
+    Same contract as the Flask /models endpoint; see app.get_model_performace().
+    """
+    request_data = await _read_json(request)
+    if request_data is None:
+        return JSONResponse({"error": "Request must be JSON"}, status_code=400)
+
+    model_name = request_data.get('model_name')
+    if not model_name:
+        return JSONResponse({"error": "Missing 'model_name' field in request body."}, status_code=400)
+
+    body, status = await run_in_threadpool(backend.read_model_performance, model_name)
+    return JSONResponse(body, status_code=status)
+
+
+async def return_model_list(request):
+    """
+    Same contract as the Flask /model_list endpoint.
+    """
+    if not backend.loaded_models:
+        return JSONResponse({"error": "No models are loaded. Server misconfiguration."}, status_code=500)
+    return JSONResponse({"available_models": list(backend.loaded_models.keys())})
+
+
+async def get_metrics(request):
+    """
+    Same contract as the Flask /metrics endpoint.
+    """
+    body = await run_in_threadpool(backend.metrics.render)
+    return PlainTextResponse(body, media_type='text/plain; version=0.0.4')
+
+
+@asynccontextmanager
+async def lifespan(_):
+    yield
+    # Graceful shutdown: the server has stopped accepting connections, drain the pending predictions
+    await inference_executor.shutdown(ASGI_SHUTDOWN_TIMEOUT)
+
+
+app = Starlette(
+    routes=[
+        Route('/', home, methods=['GET']),
+        Route('/predict', predict, methods=['POST']),
+        Route('/models', get_model_performace, methods=['POST']),
+        Route('/model_list', return_model_list, methods=['POST']),
+        Route('/metrics', get_metrics, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,199 @@
+"""
+Offline batch scorer for the ONNX models in models/.
+
+Reads a (possibly huge) CSV or Parquet file of patients in chunks, spreads the chunks
+over a pool of worker processes (one InferenceSession each) and writes predictions and
+probabilities to CSV or Parquet, reporting progress and rows/sec on stderr.
+
+Example:
+    python src/flask/batch_score.py data/patients.csv predictions.parquet \\
+        --model models/best_log_model.onnx --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import onnxruntime as ort
+import pandas as pd
+
+from encoding import RAW_COLUMNS, EncodingError, encode_columns, is_raw
+from registry import load_plan
+
+DEFAULT_MODEL = os.path.join(os.getenv('MODEL_PATH', 'models/'), 'best_log_model.onnx')
+DEFAULT_CHUNK_SIZE = 65536
+
+# Inference plan of the current worker process, built once by _init_worker
+_worker_plan = None
+
+
+def _init_worker(model_file, intra_op_threads):
+    """
+    Loads one InferenceSession per worker, limiting its threads so workers don't oversubscribe cores.
+    """
+    global _worker_plan
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = intra_op_threads
+    sess_options.inter_op_num_threads = 1
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    _worker_plan = load_plan(model_file, sess_options)
+
+
+def _score_chunk(ids, input_array):
+    predictions, probabilities = _worker_plan.run(input_array)
+    return ids, predictions, probabilities, _worker_plan.classes
+
+
+def _read_parquet_chunks(input_file, chunk_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit("Reading Parquet files requires pyarrow (pip install pyarrow).")
+    parquet_file = pq.ParquetFile(input_file)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+def read_chunks(input_file, chunk_size):
+    """
+    Yields DataFrames of at most chunk_size rows from a CSV or Parquet file.
+    """
+    if input_file.endswith('.parquet'):
+        yield from _read_parquet_chunks(input_file, chunk_size)
+    else:
+        yield from pd.read_csv(input_file, chunksize=chunk_size)
+
+
+def to_feature_chunks(frames, id_column):
+    """
+    Splits each DataFrame into (ids, float32 feature matrix).
+
+    Files with the raw patient fields of heart_disease_clean.csv are encoded chunk by chunk;
+    otherwise every column except id_column is an already encoded feature. Raises EncodingError
+    with the 0-based index of the offending row in the whole file.
+    """
+    offset = 0
+    for frame in frames:
+        ids = frame[id_column].to_numpy() if id_column in frame.columns else None
+        try:
+            if is_raw(frame.columns):
+                columns = {column: frame[column].to_numpy() for column in RAW_COLUMNS}
+                features = encode_columns(columns, len(frame))
+            else:
+                features = frame.drop(columns=[id_column], errors='ignore')
+                features = np.ascontiguousarray(features.to_numpy(dtype=np.float32))
+        except EncodingError as e:
+            raise EncodingError(offset + e.index, e.reason)
+        except ValueError as e:
+            raise EncodingError(offset, f"non-numeric encoded features in this chunk of {len(frame)} rows ({e})")
+        offset += len(frame)
+        yield ids, features
+
+
+class ResultWriter:
+    """
+    Appends scored chunks to a CSV or Parquet file.
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.is_parquet = output_file.endswith('.parquet')
+        self._parquet_writer = None
+        self._header_written = False
+
+    def write(self, ids, predictions, probabilities, classes):
+        frame = pd.DataFrame({'prediction': predictions})
+        if ids is not None:
+            frame.insert(0, 'id', ids)
+        if probabilities is not None:
+            labels = classes if classes is not None else range(probabilities.shape[1])
+            for index, label in enumerate(labels):
+                frame[f'probability_{label}'] = probabilities[:, index]
+
+        if self.is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.output_file, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            frame.to_csv(self.output_file, mode='a' if self._header_written else 'w',
+                         header=not self._header_written, index=False)
+            self._header_written = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def score_file(input_file, output_file, model_file=DEFAULT_MODEL, workers=None,
+               chunk_size=DEFAULT_CHUNK_SIZE, intra_op_threads=None, id_column='id'):
+    """
+    Scores input_file with model_file using a pool of worker processes; returns the number of rows scored.
+    Chunks are written in input order and at most 2 chunks per worker are in flight, bounding memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // workers)
+
+    chunks = to_feature_chunks(read_chunks(input_file, chunk_size), id_column)
+    writer = ResultWriter(output_file)
+    started = time.perf_counter()
+    n_rows = 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_file, intra_op_threads)) as pool:
+            pending = deque()
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                    else:
+                        pending.append(pool.submit(_score_chunk, *chunk))
+                if not pending:
+                    break
+
+                ids, predictions, probabilities, classes = pending.popleft().result()
+                writer.write(ids, predictions, probabilities, classes)
+                n_rows += len(predictions)
+                elapsed = time.perf_counter() - started
+                print(f"\r{n_rows} rows scored ({n_rows / elapsed:,.0f} rows/sec)", end='', file=sys.stderr)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+    print(f"\nDone. {n_rows} rows scored in {elapsed:.1f}s "
+          f"({n_rows / elapsed if elapsed else 0:,.0f} rows/sec), saved to '{output_file}'.", file=sys.stderr)
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of patients with an ONNX model.")
+    parser.add_argument('input_file', help="CSV or Parquet file of patients (raw fields or encoded features, optional id column)")
+    parser.add_argument('output_file', help="Output file; '.parquet' writes Parquet, anything else CSV")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f"ONNX model or KNN index (*.knn.npz) file (default: {DEFAULT_MODEL})")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per chunk")
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                        help="ONNX Runtime threads per worker (default: cores / workers)")
+    parser.add_argument('--id-column', default='id', help="Column echoed back in the output (default: id)")
+    args = parser.parse_args()
+
+    try:
+        score_file(args.input_file, args.output_file, model_file=args.model, workers=args.workers,
+                   chunk_size=args.chunk_size, intra_op_threads=args.intra_op_threads, id_column=args.id_column)
+    except EncodingError as e:
+        # The chunks before the bad row are already written: don't leave a truncated output behind
+        if os.path.exists(args.output_file):
+            os.remove(args.output_file)
+        sys.exit(f"\nError: row {e.index + 1} of '{args.input_file}' (header excluded): {e.reason}. "
+                 f"No output written.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a request cannot be queued because the batcher is saturated.
+    """
+
+
+# Queued by close(): the worker thread scores the requests queued before it, then exits
+_STOP = object()
+
+
+class _PendingRequest:
+    """
+    A single caller's rows waiting to be scored, with the future that will receive its results.
+    """
+    __slots__ = ('input_array', 'future', 'enqueued_at')
+
+    def __init__(self, input_array):
+        self.input_array = input_array
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchingStats:
+    """
+    Thread-safe counters describing how the batcher is grouping requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.max_queue_depth = 0
+        self.batch_size_counts = {}
+
+    def record_batch(self, n_requests, n_rows, wait_times_ms):
+        with self._lock:
+            self.batches += 1
+            self.requests += n_requests
+            self.rows += n_rows
+            self.total_wait_ms += sum(wait_times_ms)
+            self.max_wait_ms = max(self.max_wait_ms, max(wait_times_ms))
+            self.batch_size_counts[n_rows] = self.batch_size_counts.get(n_rows, 0) + 1
+
+    def record_queue_depth(self, depth):
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "rows": self.rows,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+                "mean_wait_ms": self.total_wait_ms / self.requests if self.requests else 0.0,
+                "max_wait_ms": self.max_wait_ms,
+                "max_queue_depth": self.max_queue_depth,
+                "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            }
+
+
+class MicroBatcher:
+    """
+    Groups concurrent prediction requests for one model into a single ONNX run.
+
+    Callers submit their (already validated) float32 rows; a background thread waits
+    up to max_wait_ms for more requests, stacks them into one matrix of at most
+    max_batch_size rows, runs the model once and hands each caller back its own rows.
+    close() stops the thread once the requests already queued are scored.
+    """
+
+    def __init__(self, plan, max_batch_size=64, max_wait_ms=2.0, max_queue_size=1024, name='model', on_batch=None):
+        self.plan = plan
+        # Optional callback(n_requests, n_rows) called after every batch, e.g. to export metrics
+        self.on_batch = on_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatchingStats()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, input_array):
+        """
+        Queues rows for prediction and returns a Future resolving to (predictions, probabilities).
+        """
+        pending = _PendingRequest(input_array)
+        # Under the lock, so no request can be queued behind the stop marker of close()
+        with self._close_lock:
+            if self._closed:
+                raise QueueFullError("Prediction queue is closed (the model is being unloaded).")
+            try:
+                self._queue.put_nowait(pending)
+            except queue.Full:
+                raise QueueFullError(f"Prediction queue is full ({self._queue.maxsize} pending requests).")
+        self.stats.record_queue_depth(self._queue.qsize())
+        return pending.future
+
+    def run(self, input_array, timeout=None):
+        """
+        Same interface as InferencePlan.run(), blocking until the batch containing the rows is scored.
+        """
+        return self.submit(input_array).result(timeout)
+
+    def close(self, timeout=None):
+        """
+        Refuses new requests, scores the ones already queued and stops the worker thread.
+        """
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """
+        Blocks for the first request, then gathers more until the row cap or the time window is hit.
+        Returns (batch, n_rows, whether close() was called).
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], 0, True
+        batch = [first]
+        n_rows = len(first.input_array)
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if pending is _STOP:
+                return batch, n_rows, True
+            batch.append(pending)
+            n_rows += len(pending.input_array)
+        return batch, n_rows, False
+
+    def _loop(self):
+        while True:
+            batch, n_rows, stopping = self._collect()
+            if batch:
+                self._run_batch(batch, n_rows)
+            if stopping:
+                return
+
+    def _run_batch(self, batch, n_rows):
+        started = time.perf_counter()
+        try:
+            if len(batch) == 1:
+                input_array = batch[0].input_array
+            else:
+                input_array = np.concatenate([pending.input_array for pending in batch])
+            predictions, probabilities = self.plan.run(input_array)
+        except Exception as e:
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+
+        # Hand each caller back the slice of rows it submitted
+        offset = 0
+        for pending in batch:
+            end = offset + len(pending.input_array)
+            pending.future.set_result((
+                predictions[offset:end],
+                probabilities[offset:end] if probabilities is not None else None,
+            ))
+            offset = end
+
+        self.stats.record_batch(
+            len(batch), n_rows, [(started - pending.enqueued_at) * 1000.0 for pending in batch]
+        )
+        if self.on_batch is not None:
+            # A failing callback must not kill the thread: every later request would hang
+            try:
+                self.on_batch(len(batch), n_rows)
+            except Exception as e:
+                print(f"Error in the on_batch callback of {self._thread.name}: {e}")
@@ -0,0 +1,163 @@
+import csv
+import json
+
+import numpy as np
+
+from encoding import N_FEATURES, EncodingError, encode_records, is_raw
+
+# Number of rows scored per ONNX run by /predict_batch, unless the client asks otherwise
+DEFAULT_CHUNK_SIZE = 4096
+MAX_CHUNK_SIZE = 65536
+
+CSV_CONTENT_TYPES = ('text/csv', 'application/csv')
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+class BulkInputError(ValueError):
+    """
+    Raised when a row of a bulk upload cannot be parsed; carries the 1-based row number.
+    """
+
+    def __init__(self, row_number, message):
+        super().__init__(f"row {row_number}: {message}")
+        self.row_number = row_number
+
+
+def _decode_lines(byte_lines):
+    for line in byte_lines:
+        line = line.decode('utf-8').rstrip('\r\n')
+        if line:
+            yield line
+
+
+def iter_csv_rows(byte_lines):
+    """
+    Yields (id, features) for every row of a CSV upload.
+
+    The first line is a header and an optional 'id' column is echoed back in the output.
+    If the header contains every raw patient field (as in heart_disease_clean.csv), rows are
+    yielded as dicts of raw fields to be encoded by the server; otherwise every other column
+    is treated as an encoded model feature, in order.
+    """
+    reader = csv.reader(_decode_lines(byte_lines))
+    header = next(reader, None)
+    if header is None:
+        return
+    raw = is_raw(header)
+    id_index = header.index('id') if 'id' in header else None
+    feature_indices = [i for i, name in enumerate(header) if i != id_index]
+    for row_number, row in enumerate(reader, start=1):
+        if len(row) != len(header):
+            raise BulkInputError(row_number, f"expected {len(header)} columns, got {len(row)}")
+        row_id = row[id_index] if id_index is not None else None
+        if raw:
+            yield row_id, dict(zip(header, row))
+        else:
+            yield row_id, [row[i] for i in feature_indices]
+
+
+def iter_ndjson_rows(byte_lines):
+    """
+    Yields (id, features) for every line of an NDJSON upload.
+
+    Each line is either a JSON array of features, an object {"id": ..., "data": [...]},
+    or an object of raw patient fields {"id": ..., "age": ..., "sex": ..., ...}.
+    """
+    for row_number, line in enumerate(_decode_lines(byte_lines), start=1):
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise BulkInputError(row_number, f"invalid JSON: {e}")
+        if isinstance(record, dict):
+            row_id, features = record.get('id'), record['data'] if 'data' in record else record
+        else:
+            row_id, features = None, record
+        if not isinstance(features, (dict, list)):
+            raise BulkInputError(row_number, f"expected a JSON object or array, got {type(features).__name__}")
+        yield row_id, features
+
+
+def _emit_chunk(buffer, ids, records, first_row_number):
+    """
+    Yields the (ids, array) of a filled chunk, encoding its raw records first if there are any.
+    Records before an invalid one are still yielded before the error is raised.
+    """
+    chunk = buffer[:len(ids)]
+    if records:
+        try:
+            encode_records(records, out=chunk)
+        except EncodingError as e:
+            if e.index:
+                encode_records(records[:e.index], out=chunk[:e.index])
+                yield ids[:e.index], chunk[:e.index]
+            raise BulkInputError(first_row_number + e.index, e.reason)
+    yield ids, chunk
+
+
+def iter_chunks(rows, n_features, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float32):
+    """
+    Packs (id, features) rows into fixed-size arrays, yielding (ids, array) per chunk.
+
+    features is either a list of encoded feature values or a dict of raw patient fields;
+    raw records are encoded a whole chunk at a time. A single buffer of chunk_size rows
+    is reused, so memory stays bounded whatever the size of the upload; the yielded array
+    is only valid until the next chunk is requested.
+    """
+    buffer = np.empty((chunk_size, n_features), dtype=dtype)
+    ids = []
+    records = []
+    raw = None
+    row_number = 0
+    try:
+        for row_id, features in rows:
+            row_number += 1
+            is_record = isinstance(features, dict)
+            if raw is None:
+                raw = is_record
+                if raw and n_features != N_FEATURES:
+                    raise BulkInputError(row_number, f"raw patient fields cannot be encoded for a model with {n_features} features")
+            elif is_record != raw:
+                raise BulkInputError(row_number, "rows mix raw patient fields and encoded features")
+
+            if raw:
+                records.append(features)
+            elif len(features) != n_features:
+                raise BulkInputError(row_number, f"expected {n_features} features, got {len(features)}")
+            else:
+                try:
+                    buffer[len(ids)] = features
+                except (TypeError, ValueError) as e:
+                    raise BulkInputError(row_number, f"non-numeric feature value ({e})")
+            ids.append(row_id)
+            if len(ids) == chunk_size:
+                chunk_ids, chunk_records = ids, records
+                ids, records = [], []
+                yield from _emit_chunk(buffer, chunk_ids, chunk_records, row_number - chunk_size + 1)
+    except BulkInputError:
+        # Rows parsed before the invalid one are still scored
+        if ids:
+            yield from _emit_chunk(buffer, ids, records, row_number - len(ids))
+        raise
+    if ids:
+        yield from _emit_chunk(buffer, ids, records, row_number - len(ids) + 1)
+
+
+def score_chunks(plan, chunks):
+    """
+    Runs every chunk through the inference plan and yields NDJSON text, one block per chunk.
+    """
+    row_index = 0
+    for ids, input_array in chunks:
+        predictions, probabilities = plan.run(input_array)
+        predictions = predictions.tolist()
+        probabilities = probabilities.tolist() if probabilities is not None else None
+        lines = []
+        for i, row_id in enumerate(ids):
+            result = {"row": row_index + i, "prediction": predictions[i]}
+            if row_id is not None:
+                result["id"] = row_id
+            if probabilities is not None:
+                result["probabilities"] = probabilities[i]
+            lines.append(json.dumps(result))
+        row_index += len(ids)
+        yield '\n'.join(lines) + '\n'
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CacheStats:
+    """
+    Counters describing what the prediction cache saves.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def snapshot(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+class PredictionCache:
+    """
+    Bounded in-process LRU cache of per-row predictions, with a time-to-live.
+
+    Rows are keyed by model name plus a hash of their float32 feature bytes, so values that
+    only differ below float32 precision share an entry. Entries of a model are dropped when
+    its file in MODEL_PATH changes (checked at most every check_interval seconds).
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=300.0, check_interval=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.check_interval = check_interval
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_files = {}
+
+    @staticmethod
+    def _file_version(model_file):
+        try:
+            stat = os.stat(model_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def watch(self, model_name, model_file):
+        """
+        Ties the cached entries of model_name to the current version of model_file.
+        """
+        with self._lock:
+            self._model_files[model_name] = [model_file, self._file_version(model_file), time.monotonic()]
+
+    def _check_model_file(self, model_name, now):
+        watched = self._model_files.get(model_name)
+        if watched is None or now - watched[2] < self.check_interval:
+            return
+        watched[2] = now
+        version = self._file_version(watched[0])
+        if version != watched[1]:
+            watched[1] = version
+            self._invalidate(model_name)
+
+    def _invalidate(self, model_name):
+        stale = [key for key in self._entries if key[0] == model_name]
+        for key in stale:
+            del self._entries[key]
+        self.stats.invalidations += 1
+
+    def invalidate(self, model_name=None):
+        """
+        Drops the entries of one model, or of every model when model_name is None.
+        """
+        with self._lock:
+            if model_name is None:
+                self._entries.clear()
+                self.stats.invalidations += 1
+            else:
+                self._invalidate(model_name)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def run(self, model_name, runner, input_array):
+        """
+        Same interface as InferencePlan.run(): rows found in the cache are served from it,
+        the others are scored together in a single runner.run() call and stored.
+        """
+        if len(input_array) == 0:
+            return runner.run(input_array)
+        input_array = np.ascontiguousarray(input_array)
+        keys = [(model_name, hashlib.blake2b(row.tobytes(), digest_size=16).digest()) for row in input_array]
+        results = [None] * len(keys)
+        now = time.monotonic()
+
+        with self._lock:
+            self._check_model_file(model_name, now)
+            for index, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[2] < now:
+                    del self._entries[key]
+                    self.stats.expirations += 1
+                    continue
+                self._entries.move_to_end(key)
+                results[index] = entry
+            missing = [index for index, result in enumerate(results) if result is None]
+            self.stats.hits += len(keys) - len(missing)
+            self.stats.misses += len(missing)
+
+        if missing:
+            predictions, probabilities = runner.run(input_array[missing])
+            expires_at = time.monotonic() + self.ttl
+            with self._lock:
+                for position, index in enumerate(missing):
+                    entry = (
+                        predictions[position],
+                        probabilities[position].copy() if probabilities is not None else None,
+                        expires_at,
+                    )
+                    results[index] = entry
+                    self._entries[keys[index]] = entry
+                    self._entries.move_to_end(keys[index])
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats.evictions += 1
+
+        predictions = np.array([result[0] for result in results])
+        if results[0][1] is None:
+            return predictions, None
+        return predictions, np.stack([result[1] for result in results])
@@ -0,0 +1,352 @@
+"""
+Columnar store of the cleaned dataset (heart_disease_clean.csv) and of the prediction sets made on it.
+
+The CSV is parsed once into a folder next to it (heart_disease_clean.store/), one .npy file per
+column, and every later load memory-maps those files instead of parsing the text again:
+
+- columns/<name>.npy: numeric columns as parsed by pandas; text columns (the categorical fields
+  of encoding.py, 'dataset') as integer codes, with their categories listed in meta.json;
+- features.npy: the float32 design matrix in the model feature layout (encoding.FEATURE_NAMES),
+  which can be passed as is to an inference plan;
+- predictions/<name>.npy: one int8 column per prediction set (GPT, human annotators, each model),
+  aligned with the rows of the dataset, -1 where a patient has no prediction.
+
+Rows keep the order of the CSV, so positional splits (train_test_split on the store or on
+pd.read_csv(source_file, index_col='id')) select the same patients. ids_order.npy holds the
+permutation that sorts the ids: prediction sets are written and joined by id with a binary search
+on it, without copying the dataset. When the CSV changes, the store is rebuilt on the next
+open_store() and the existing prediction sets are re-aligned by id.
+
+Example:
+    python src/flask/data_store.py
+    python src/flask/data_store.py --import data/heart_disease_gpt_prediction.csv --column gpt_prediction
+    python src/flask/data_store.py --score models/best_log_model.onnx
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from encoding import CATEGORICAL_LEVELS, FEATURE_NAMES, RAW_COLUMNS, encode_columns, is_raw
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DEFAULT_SOURCE_FILE = os.path.join(ROOT, 'data', 'heart_disease_clean.csv')
+STORE_SUFFIX = '.store'
+FORMAT_VERSION = 2
+META_FILE = 'meta.json'
+IDS_FILE = 'ids.npy'
+IDS_ORDER_FILE = 'ids_order.npy'
+FEATURES_FILE = 'features.npy'
+COLUMNS_DIR = 'columns'
+PREDICTIONS_DIR = 'predictions'
+# Value of a prediction column for the patients without a prediction
+MISSING = -1
+
+
+def store_dir_for(source_file):
+    return os.path.splitext(source_file)[0] + STORE_SUFFIX
+
+
+def _source_version(source_file):
+    stat = os.stat(source_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _check_name(name):
+    if not re.fullmatch(r'[\w.-]+', name):
+        raise ValueError(f"Invalid name '{name}': only letters, digits, '_', '-' and '.' are allowed.")
+
+
+def _save_array(path, array):
+    """
+    Writes an .npy file atomically: readers that memory-mapped the previous version keep it.
+    """
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, np.ascontiguousarray(array), allow_pickle=False)
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+
+def _load_array(path):
+    array = np.load(path, mmap_mode='r', allow_pickle=False)
+    # A memory map is read-only: hand out plain ndarray views of it
+    return np.asarray(array)
+
+
+def _lookup(ids, order, query):
+    """
+    Positions in ids (sorted by the permutation order) of the query ids, and the mask of the
+    query ids that are not in ids.
+    """
+    if not len(ids):
+        return np.zeros(len(query), dtype=np.intp), np.ones(len(query), dtype=bool)
+    sorted_positions = np.minimum(np.searchsorted(ids[order], query), len(ids) - 1)
+    positions = order[sorted_positions]
+    return positions, ids[positions] != query
+
+
+def _categorize(series, levels=()):
+    """
+    Returns (codes, categories) of a text column: the given levels first, then any other value
+    in sorted order; missing values get code -1.
+    """
+    present = series.notna().to_numpy()
+    values = series[present].astype(str)
+    categories = list(levels) + sorted(set(values.unique()) - set(levels))
+    dtype = np.int8 if len(categories) <= np.iinfo(np.int8).max else np.int32
+    codes = np.full(len(series), -1, dtype=dtype)
+    codes[present] = pd.Categorical(values, categories=categories).codes
+    return codes, categories
+
+
+def build(source_file, store_dir=None):
+    """
+    Parses source_file into a store and returns its folder. Prediction sets already in the
+    folder are kept, re-aligned by id with the new rows.
+    """
+    store_dir = store_dir or store_dir_for(source_file)
+    df = pd.read_csv(source_file)
+    if 'id' in df.columns:
+        ids = pd.to_numeric(df.pop('id'), downcast=None).to_numpy()
+        if not np.issubdtype(ids.dtype, np.integer):
+            raise ValueError(f"The 'id' column of '{source_file}' must contain integers.")
+    else:
+        ids = np.arange(len(df))
+    ids = ids.astype(np.int64)
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    if len(ids) > 1 and (sorted_ids[1:] == sorted_ids[:-1]).any():
+        raise ValueError(f"The 'id' column of '{source_file}' contains duplicates.")
+
+    previous = None
+    if os.path.exists(os.path.join(store_dir, META_FILE)):
+        previous = DataStore(store_dir)
+    os.makedirs(os.path.join(store_dir, COLUMNS_DIR), exist_ok=True)
+    os.makedirs(os.path.join(store_dir, PREDICTIONS_DIR), exist_ok=True)
+
+    columns = []
+    for name in df.columns:
+        _check_name(name)
+        series = df[name]
+        if name in CATEGORICAL_LEVELS or not pd.api.types.is_numeric_dtype(series.dtype):
+            values, categories = _categorize(series, CATEGORICAL_LEVELS.get(name, ()))
+            columns.append({"name": name, "categories": categories})
+        else:
+            values = series.to_numpy()
+            columns.append({"name": name})
+        _save_array(os.path.join(store_dir, COLUMNS_DIR, f"{name}.npy"), values)
+
+    has_features = is_raw(df.columns)
+    if has_features:
+        features = encode_columns({column: df[column].to_numpy() for column in RAW_COLUMNS}, len(df))
+        _save_array(os.path.join(store_dir, FEATURES_FILE), features)
+    _save_array(os.path.join(store_dir, IDS_FILE), ids)
+    _save_array(os.path.join(store_dir, IDS_ORDER_FILE), order)
+
+    if previous is not None:
+        # Re-align the prediction sets of the previous rows with the new ones
+        for name in previous.prediction_names():
+            labels = np.array(previous.predictions(name))
+            known = labels != MISSING
+            new_positions, unknown = _lookup(ids, order, previous.ids[known])
+            column = np.full(len(ids), MISSING, dtype=np.int8)
+            column[new_positions[~unknown]] = labels[known][~unknown]
+            _save_array(os.path.join(store_dir, PREDICTIONS_DIR, f"{name}.npy"), column)
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "source": {"file": os.path.basename(source_file), "version": _source_version(source_file)},
+        "n_rows": len(ids),
+        "columns": columns,
+        "features": FEATURE_NAMES if has_features else None,
+    }
+    fd, tmp_file = tempfile.mkstemp(dir=store_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(tmp_file, os.path.join(store_dir, META_FILE))
+    return store_dir
+
+
+def open_store(source_file=DEFAULT_SOURCE_FILE, store_dir=None):
+    """
+    Opens the store of source_file, (re)building it first if it is missing or older than the file.
+    Without the source file an existing store is opened as is.
+    """
+    store_dir = store_dir or store_dir_for(source_file)
+    if os.path.exists(source_file):
+        try:
+            with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            fresh = meta['format'] == FORMAT_VERSION and meta['source']['version'] == _source_version(source_file)
+        except (OSError, ValueError, KeyError):
+            fresh = False
+        if not fresh:
+            build(source_file, store_dir)
+    return DataStore(store_dir)
+
+
+class DataStore:
+    """
+    Read access to a store built by build(); columns, features and prediction sets are memory-mapped.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as file:
+            self.meta = json.load(file)
+        self.ids = _load_array(os.path.join(store_dir, IDS_FILE))
+        self._ids_order = _load_array(os.path.join(store_dir, IDS_ORDER_FILE))
+        self.n_rows = self.meta['n_rows']
+        self.columns = [column['name'] for column in self.meta['columns']]
+        self._categories = {column['name']: column['categories'] for column in self.meta['columns']
+                            if 'categories' in column}
+        self.feature_names = self.meta['features']
+        self.features = _load_array(os.path.join(store_dir, FEATURES_FILE)) if self.feature_names else None
+
+    def categories(self, name):
+        """
+        Categories of a categorical column (indexed by its codes), None for numeric columns.
+        """
+        return self._categories.get(name)
+
+    def column(self, name):
+        """
+        Raw values of a column: integer codes for categorical columns (see categories()).
+        """
+        if name not in self.columns:
+            raise KeyError(f"Column '{name}' not in the store. Available columns: {self.columns}")
+        return _load_array(os.path.join(self.store_dir, COLUMNS_DIR, f"{name}.npy"))
+
+    def values(self, name):
+        """
+        Values of a column ready for pandas: a Categorical over the stored codes for categorical
+        columns, the numpy column otherwise.
+        """
+        categories = self.categories(name)
+        if categories is None:
+            return self.column(name)
+        return pd.Categorical.from_codes(self.column(name), categories=categories)
+
+    def positions(self, ids):
+        """
+        Row positions of the given ids (integers or their string form); KeyError for unknown ids.
+        """
+        ids = np.asarray(ids).astype(np.int64)
+        positions, unknown = _lookup(self.ids, self._ids_order, ids)
+        if unknown.any():
+            raise KeyError(f"{int(unknown.sum())} ids not in the store, e.g. {ids[unknown][:5].tolist()}")
+        return positions
+
+    def prediction_names(self):
+        directory = os.path.join(self.store_dir, PREDICTIONS_DIR)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(file[:-len('.npy')] for file in os.listdir(directory) if file.endswith('.npy'))
+
+    def predictions(self, name):
+        """
+        int8 column of a prediction set, aligned with the rows; MISSING (-1) where there is no prediction.
+        """
+        path = os.path.join(self.store_dir, PREDICTIONS_DIR, f"{name}.npy")
+        if not os.path.exists(path):
+            raise KeyError(f"Prediction set '{name}' not in the store. Available sets: {self.prediction_names()}")
+        return _load_array(path)
+
+    def label_matrix(self, names):
+        """
+        (n_rows, len(names)) int8 matrix of the given prediction sets, one column per set.
+        """
+        matrix = np.empty((self.n_rows, len(names)), dtype=np.int8)
+        for index, name in enumerate(names):
+            matrix[:, index] = self.predictions(name)
+        return matrix
+
+    def write_predictions(self, name, ids, labels):
+        """
+        Stores a prediction set (replacing one with the same name): labels[i] is the 0/1 prediction
+        for patient ids[i], None/NaN if there is none. Patients not in ids have no prediction.
+        """
+        _check_name(name)
+        labels = pd.to_numeric(pd.Series(labels, dtype=object), errors='raise')
+        known = labels.notna().to_numpy()
+        column = np.full(self.n_rows, MISSING, dtype=np.int8)
+        column[self.positions(np.asarray(ids)[known])] = labels[known].to_numpy().astype(np.int8)
+        _save_array(os.path.join(self.store_dir, PREDICTIONS_DIR, f"{name}.npy"), column)
+        return int(known.sum())
+
+    def frame(self, columns=None, predictions=()):
+        """
+        DataFrame indexed by id with the given columns (default: all of them, categorical columns
+        with a category dtype) and prediction sets (nullable Int8, <NA> where missing).
+        """
+        data = {name: self.values(name) for name in (self.columns if columns is None else columns)}
+        for name in predictions:
+            labels = self.predictions(name)
+            data[name] = pd.arrays.IntegerArray(labels, labels == MISSING)
+        return pd.DataFrame(data, index=pd.Index(self.ids, name='id'), copy=False)
+
+
+def score(store, model_file, name=None, chunk_size=65536):
+    """
+    Runs a model (ONNX graph or KNN index) on the design matrix, chunk_size rows at a time, and
+    stores its predictions as a set.
+    """
+    from registry import load_plan
+    from knn_index import INDEX_SUFFIX
+
+    if store.features is None:
+        raise ValueError("The store has no design matrix: the source file lacks the raw patient fields.")
+    plan = load_plan(model_file)
+    predictions = np.empty(store.n_rows, dtype=np.int8)
+    for start in range(0, store.n_rows, chunk_size):
+        chunk = np.ascontiguousarray(store.features[start:start + chunk_size], dtype=plan.input_dtype)
+        predictions[start:start + chunk_size] = plan.run(chunk)[0]
+    base_name = os.path.basename(model_file)
+    name = name or (base_name[:-len(INDEX_SUFFIX)] if base_name.endswith(INDEX_SUFFIX) else os.path.splitext(base_name)[0])
+    return name, store.write_predictions(name, store.ids, predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the columnar store of the cleaned dataset and add prediction sets to it."
+    )
+    parser.add_argument('--source-file', default=DEFAULT_SOURCE_FILE, help="Cleaned dataset (heart_disease_clean.csv)")
+    parser.add_argument('--store-dir', default=None, help="Folder of the store (default: <source-file>.store)")
+    parser.add_argument('--import', dest='import_file', default=None, metavar='CSV',
+                        help="Store the --column of a CSV with an 'id' column as a prediction set")
+    parser.add_argument('--column', default=None, help="Prediction column of the imported CSV")
+    parser.add_argument('--score', default=None, metavar='MODEL',
+                        help="Run a model (.onnx or .knn.npz) on every patient and store its predictions")
+    parser.add_argument('--name', default=None,
+                        help="Name of the stored prediction set (default: the column name or the model file name)")
+    args = parser.parse_args()
+
+    store = open_store(args.source_file, args.store_dir)
+    if args.import_file:
+        if not args.column:
+            parser.error("--import requires --column.")
+        df = pd.read_csv(args.import_file, usecols=['id', args.column])
+        name = args.name or args.column
+        count = store.write_predictions(name, df['id'], df[args.column])
+        print(f"Stored {count} predictions of '{args.import_file}' as '{name}'.")
+    if args.score:
+        name, count = score(store, args.score, args.name)
+        print(f"Stored {count} predictions of '{args.score}' as '{name}'.")
+
+    print(f"Store '{store.store_dir}': {store.n_rows} patients, {len(store.columns)} columns, "
+          f"design matrix {'yes' if store.features is not None else 'no'}.")
+    for name in store.prediction_names():
+        labels = store.predictions(name)
+        print(f"  {name}: {int((labels != MISSING).sum())} predictions")
+
+
+if __name__ == '__main__':
+    main()
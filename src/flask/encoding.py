@@ -0,0 +1,135 @@
+import numpy as np
+
+# Categorical columns of heart_disease_clean.csv and their levels, in the order produced by the
+# OneHotEncoder of the training notebook (columns sorted, levels sorted within each column)
+CATEGORICAL_LEVELS = {
+    'sex': ['Female', 'Male'],
+    'chest_pain_type': ['asymptomatic', 'atypical angina', 'non-anginal', 'typical angina'],
+    'fasting_blood_sugar': ['False', 'True'],
+    'ecg_resting': ['lv hypertrophy', 'normal', 'st-t abnormality'],
+    'exercise_induced_angina': ['False', 'True'],
+    'st_slope_type': ['downsloping', 'flat', 'upsloping'],
+    'thal_defect_type': ['fixed defect', 'normal', 'reversable defect'],
+}
+
+# Numerical columns, passed through after the one-hot encoded ones
+NUMERIC_COLUMNS = [
+    'age', 'blood_pressure_resting', 'cholesterol', 'max_heart_rate',
+    'st_depression_exercise', 'major_vessels_colored',
+]
+
+RAW_COLUMNS = list(CATEGORICAL_LEVELS) + NUMERIC_COLUMNS
+
+# Names of the encoded features, in the order expected by the models
+FEATURE_NAMES = [
+    f"{column}_{level}" for column, levels in CATEGORICAL_LEVELS.items() for level in levels
+] + NUMERIC_COLUMNS
+N_FEATURES = len(FEATURE_NAMES)
+
+# Alternative spellings accepted for boolean levels (JSON booleans, 0/1 flags)
+_BOOLEAN_ALIASES = {'false': 'false', '0': 'false', '0.0': 'false', 'true': 'true', '1': 'true', '1.0': 'true'}
+
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+
+def _build_lookup():
+    """
+    Precomputes, for every categorical column, the position of each normalized level in the encoded vector.
+    """
+    lookup = {}
+    offset = 0
+    for column, levels in CATEGORICAL_LEVELS.items():
+        table = {_normalize(level): offset + index for index, level in enumerate(levels)}
+        if set(table) == {'false', 'true'}:
+            table.update({alias: table[target] for alias, target in _BOOLEAN_ALIASES.items()})
+        lookup[column] = table
+        offset += len(levels)
+    return lookup
+
+
+FEATURE_LOOKUP = _build_lookup()
+NUMERIC_OFFSET = N_FEATURES - len(NUMERIC_COLUMNS)
+
+
+class EncodingError(ValueError):
+    """
+    Raised when a raw patient record cannot be encoded; carries the 0-based index of the offending row.
+    """
+
+    def __init__(self, index, message):
+        super().__init__(f"record {index}: {message}")
+        self.index = index
+        self.reason = message
+
+
+def is_raw(columns):
+    """
+    Returns True if the given column names contain every raw patient field.
+    """
+    return set(RAW_COLUMNS).issubset(columns)
+
+
+def encode_columns(columns, n_rows, out=None):
+    """
+    Encodes column-oriented raw patient fields into the model feature layout.
+
+    columns maps each name of RAW_COLUMNS to a sequence of n_rows values (extra keys are ignored).
+    The result is written into out (a float32 array of shape (n_rows, N_FEATURES)) when given,
+    otherwise into a newly allocated one, and returned.
+    """
+    if out is None:
+        out = np.zeros((n_rows, N_FEATURES), dtype=np.float32)
+    else:
+        out[:] = 0.0
+    rows = np.arange(n_rows)
+
+    for column, table in FEATURE_LOOKUP.items():
+        if column not in columns:
+            raise EncodingError(0, f"missing field '{column}'")
+        positions = np.fromiter(
+            (table.get(_normalize(value), -1) for value in columns[column]), dtype=np.intp, count=n_rows
+        )
+        unknown = np.flatnonzero(positions < 0)
+        if unknown.size:
+            index = int(unknown[0])
+            raise EncodingError(
+                index, f"unknown value {columns[column][index]!r} for '{column}', "
+                       f"expected one of {CATEGORICAL_LEVELS[column]}"
+            )
+        out[rows, positions] = 1.0
+
+    for offset, column in enumerate(NUMERIC_COLUMNS, start=NUMERIC_OFFSET):
+        if column not in columns:
+            raise EncodingError(0, f"missing field '{column}'")
+        try:
+            out[:, offset] = np.asarray(columns[column], dtype=np.float32)
+        except (TypeError, ValueError):
+            for index, value in enumerate(columns[column]):
+                try:
+                    float(value)
+                except (TypeError, ValueError):
+                    raise EncodingError(index, f"non-numeric value {value!r} for '{column}'")
+            raise
+        # None casts to NaN: reject it (and infinities) instead of answering with invalid JSON
+        not_finite = np.flatnonzero(~np.isfinite(out[:, offset]))
+        if not_finite.size:
+            index = int(not_finite[0])
+            raise EncodingError(index, f"non-numeric value {columns[column][index]!r} for '{column}'")
+    return out
+
+
+def encode_records(records, out=None):
+    """
+    Encodes a list of raw patient records (dicts shaped like a row of heart_disease_clean.csv)
+    into a float32 matrix in a single vectorized pass.
+    """
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise EncodingError(index, "expected an object of patient fields")
+        missing = [column for column in RAW_COLUMNS if column not in record]
+        if missing:
+            raise EncodingError(index, f"missing fields {missing}")
+    columns = {column: [record[column] for record in records] for column in RAW_COLUMNS}
+    return encode_columns(columns, len(records), out)
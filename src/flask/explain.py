@@ -0,0 +1,219 @@
+"""
+Per-patient explanations of the served models: one contribution per raw patient field.
+
+Contributions are SHAP values against a background set, the k-means summary of the training
+rows written next to the models (explain_background.npz, see save_background()), as the
+notebook's shap.kmeans(X_train, 10):
+
+- Linear models (the Logistic Regression graph, a LinearClassifier optionally preceded by a
+  Scaler) are explained exactly in closed form, in log-odds: the contribution of a feature is
+  coef * (x - background mean), and the one-hot columns of a field are summed.
+- Any other model with probabilities (KNN, as ONNX graph or spatial index) is explained by
+  permutation sampling over the fields, on the probability of the last class: every
+  coalition of every permutation is filled from the background rows and the whole batch is
+  scored in a few model runs. Permutations are fixed and antithetic (each one is also walked
+  in reverse), so explanations are deterministic and their sum is exactly the model output
+  minus the expected output on the background, which is computed once per model.
+"""
+import os
+
+import numpy as np
+import onnx
+from onnx import helper
+from sklearn.cluster import KMeans
+
+from encoding import CATEGORICAL_LEVELS, RAW_COLUMNS
+
+BACKGROUND_FILE = 'explain_background.npz'
+
+# Raw field of each encoded feature (encoding.FEATURE_NAMES order)
+FEATURE_GROUPS = np.array(
+    [index for index, levels in enumerate(CATEGORICAL_LEVELS.values()) for _ in levels]
+    + list(range(len(CATEGORICAL_LEVELS), len(RAW_COLUMNS)))
+)
+# (n_features, n_fields) matrix summing encoded contributions into field contributions
+GROUP_MATRIX = (FEATURE_GROUPS[:, None] == np.arange(len(RAW_COLUMNS))[None, :]).astype(np.float64)
+
+
+class BackgroundNotFoundError(LookupError):
+    """
+    Raised when an explanation is requested but the model folder has no background file.
+    """
+
+
+def save_background(background_file, features, n_clusters=10, random_state=0):
+    """
+    Writes the background set of encoded training rows: k-means centroids weighted by cluster
+    size, each value snapped to the nearest value seen in its column (one-hot columns stay
+    0/1, as with shap.kmeans), and the exact mean of the rows.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    kmeans = KMeans(n_clusters=min(n_clusters, len(features)), n_init=10, random_state=random_state).fit(features)
+    centers = kmeans.cluster_centers_.copy()
+    for column in range(features.shape[1]):
+        values = np.unique(features[:, column])
+        nearest = np.abs(centers[:, column][:, None] - values[None, :]).argmin(axis=1)
+        centers[:, column] = values[nearest]
+    weights = np.bincount(kmeans.labels_, minlength=len(centers)) / len(features)
+    np.savez(background_file, data=centers.astype(np.float32), weights=weights, mean=features.mean(axis=0))
+
+
+class Background:
+    """
+    Background set loaded from a file written by save_background().
+    """
+
+    def __init__(self, background_file):
+        with np.load(background_file, allow_pickle=False) as data:
+            self.data = data['data']
+            self.weights = data['weights'] / data['weights'].sum()
+            self.mean = data['mean']
+        self.version = self.file_version(background_file)
+
+    @staticmethod
+    def file_version(background_file):
+        try:
+            stat = os.stat(background_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+def linear_terms(model_file):
+    """
+    Returns (coef, intercept) of the log-odds of the last class if the ONNX graph is a binary
+    LinearClassifier over its input (optionally after a Scaler), None otherwise.
+    """
+    graph = onnx.load(model_file, load_external_data=False).graph
+    nodes = [node for node in graph.node if node.op_type not in ('Cast', 'ZipMap', 'Identity')]
+    if not nodes or nodes[-1].op_type != 'LinearClassifier' or len(nodes) > 2:
+        return None
+    if len(nodes) == 2 and (nodes[0].op_type != 'Scaler' or nodes[0].output[0] != nodes[1].input[0]):
+        return None
+    attributes = {attribute.name: helper.get_attribute_value(attribute) for attribute in nodes[-1].attribute}
+    intercepts = np.asarray(attributes['intercepts'], dtype=np.float64)
+    coefficients = np.asarray(attributes['coefficients'], dtype=np.float64).reshape(len(intercepts), -1)
+    post_transform = attributes.get('post_transform', b'NONE').decode()
+    if len(intercepts) == 1 or post_transform == 'LOGISTIC':
+        # One score per class, each one a log-odds
+        coef, intercept = coefficients[-1], intercepts[-1]
+    elif len(intercepts) == 2 and post_transform in ('SOFTMAX', 'NONE'):
+        coef, intercept = coefficients[1] - coefficients[0], intercepts[1] - intercepts[0]
+    else:
+        return None
+
+    if len(nodes) == 2:
+        # Scaler: (x - offset) * scale, folded into the coefficients
+        scaler = {attribute.name: helper.get_attribute_value(attribute) for attribute in nodes[0].attribute}
+        scale = np.broadcast_to(np.asarray(scaler.get('scale', [1.0]), dtype=np.float64), coef.shape)
+        offset = np.broadcast_to(np.asarray(scaler.get('offset', [0.0]), dtype=np.float64), coef.shape)
+        coef = coef * scale
+        intercept = intercept - coef @ offset
+    return coef, float(intercept)
+
+
+class LinearExplainer:
+    """
+    Exact SHAP values of a linear model with independent features: coef * (x - mean), in log-odds.
+    """
+
+    method = 'linear'
+    output = 'log-odds'
+
+    def __init__(self, plan, coef, intercept, background):
+        self.plan = plan
+        self.background_version = background.version
+        self.coef = coef
+        self.mean = background.mean
+        self.base_value = float(intercept + coef @ self.mean)
+
+    def run(self, input_array):
+        """
+        Returns (model output, field contributions) of each row, like InferencePlan.run().
+        """
+        contributions = ((np.asarray(input_array, dtype=np.float64) - self.mean) * self.coef) @ GROUP_MATRIX
+        return self.base_value + contributions.sum(axis=1), contributions
+
+
+class PermutationExplainer:
+    """
+    SHAP values estimated from a fixed set of antithetic permutations of the fields, on the
+    probability of the last class. Each permutation costs (n_fields - 1) x n_background rows
+    per explained row, scored in runs of at most max_rows.
+    """
+
+    method = 'permutation'
+    output = 'probability'
+
+    def __init__(self, plan, background, n_permutations=10, max_rows=8192, seed=0):
+        self.plan = plan
+        self.background_version = background.version
+        self.data = background.data.astype(plan.input_dtype)
+        self.weights = background.weights
+        self.max_rows = max_rows
+
+        rng = np.random.default_rng(seed)
+        forward = [rng.permutation(len(RAW_COLUMNS)) for _ in range(max(1, n_permutations // 2))]
+        self.permutations = np.array(forward + [permutation[::-1] for permutation in forward])
+        # inverse[m, field] = step at which permutation m adds field
+        self.inverse = np.argsort(self.permutations, axis=1)
+        # Coalitions strictly between empty and full: after steps 1..n_fields-1 of each permutation
+        steps = np.arange(1, len(RAW_COLUMNS))
+        field_masks = self.inverse[:, None, :] < steps[None, :, None]
+        self.masks = field_masks[:, :, FEATURE_GROUPS].reshape(-1, len(FEATURE_GROUPS))
+
+        self.base_value = float(self._expected(self.data) @ self.weights)
+
+    def _expected(self, rows):
+        """
+        Probability of the last class for each row, in runs of at most max_rows.
+        """
+        outputs = np.empty(len(rows), dtype=np.float64)
+        for start in range(0, len(rows), self.max_rows):
+            _, probabilities = self.plan.run(np.ascontiguousarray(rows[start:start + self.max_rows]))
+            outputs[start:start + self.max_rows] = probabilities[:, -1]
+        return outputs
+
+    def run(self, input_array):
+        """
+        Returns (model output, field contributions) of each row, like InferencePlan.run().
+        """
+        input_array = np.asarray(input_array, dtype=self.data.dtype)
+        outputs = self._expected(input_array)
+        contributions = np.empty((len(input_array), len(RAW_COLUMNS)), dtype=np.float64)
+        chunk = max(1, self.max_rows // (len(self.masks) * len(self.data)))
+        for start in range(0, len(input_array), chunk):
+            contributions[start:start + chunk] = self._contributions(
+                input_array[start:start + chunk], outputs[start:start + chunk]
+            )
+        return outputs, contributions
+
+    def _contributions(self, rows, outputs):
+        n_rows, n_permutations = len(rows), len(self.permutations)
+        # (rows, coalitions, background, features): the coalition's fields from the row, the others from the background
+        mixed = np.where(self.masks[None, :, None, :], rows[:, None, None, :], self.data[None, None, :, :])
+        inner = self._expected(mixed.reshape(-1, mixed.shape[-1])).reshape(n_rows, len(self.masks), -1) @ self.weights
+
+        values = np.concatenate([
+            np.full((n_rows, n_permutations, 1), self.base_value),
+            inner.reshape(n_rows, n_permutations, -1),
+            np.broadcast_to(outputs[:, None, None], (n_rows, n_permutations, 1)),
+        ], axis=2)
+        # Marginal contribution of the field added at each step, reordered by field
+        marginals = np.diff(values, axis=2)
+        contributions = np.take_along_axis(marginals, np.broadcast_to(self.inverse, marginals.shape), axis=2)
+        return contributions.mean(axis=1)
+
+
+def make_explainer(plan, model_file, background, n_permutations=10):
+    """
+    Exact explainer for linear ONNX graphs, permutation explainer for other models with
+    probabilities, None if the model cannot be explained.
+    """
+    if model_file and model_file.endswith('.onnx'):
+        terms = linear_terms(model_file)
+        if terms is not None:
+            return LinearExplainer(plan, *terms, background)
+    if not plan.has_probabilities:
+        return None
+    return PermutationExplainer(plan, background, n_permutations)
@@ -0,0 +1,186 @@
+import os
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import helper
+
+# Mapping between the ONNX tensor type strings reported by onnxruntime and numpy dtypes
+ONNX_TO_NUMPY = {
+    'tensor(float)': np.float32,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(int32)': np.int32,
+}
+
+
+def _strip_zipmap(model):
+    """
+    Removes the ZipMap node that skl2onnx appends to classifiers, so the
+    probability output becomes a plain float tensor of shape (n_rows, n_classes)
+    instead of a list of {class: probability} dictionaries.
+
+    Returns the class labels of the ZipMap (None if the graph has no ZipMap).
+    """
+    graph = model.graph
+    for node in graph.node:
+        if node.op_type != 'ZipMap':
+            continue
+        classes = None
+        for attribute in node.attribute:
+            if attribute.name in ('classlabels_int64s', 'classlabels_strings'):
+                classes = list(helper.get_attribute_value(attribute))
+                classes = [c.decode() if isinstance(c, bytes) else int(c) for c in classes]
+
+        zipmap_input, zipmap_output = node.input[0], node.output[0]
+        graph.node.remove(node)
+        for index, output in enumerate(graph.output):
+            if output.name == zipmap_output:
+                graph.output.remove(output)
+                graph.output.insert(index, helper.make_tensor_value_info(
+                    zipmap_input, onnx.TensorProto.FLOAT, [None, len(classes) if classes else None]
+                ))
+                break
+        return classes
+    return None
+
+
+def _uses_external_data(model):
+    return any(
+        initializer.data_location == onnx.TensorProto.EXTERNAL for initializer in model.graph.initializer
+    )
+
+
+def make_session_options(intra_op_threads=0, inter_op_threads=1, optimization_level='all'):
+    """
+    Builds the SessionOptions used to serve the models: full graph optimization and explicit
+    thread counts (0 lets ONNX Runtime pick), so several workers don't oversubscribe the cores.
+    """
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = {
+        'disabled': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[optimization_level]
+    sess_options.intra_op_num_threads = intra_op_threads
+    sess_options.inter_op_num_threads = inter_op_threads
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return sess_options
+
+
+class InferencePlan:
+    """
+    Precompiled inference plan for a single ONNX classifier.
+
+    Input/output names, the input dtype and the number of features are resolved
+    once when the model is loaded, and labels and probabilities are fetched
+    together in a single session.run() call.
+    """
+
+    def __init__(self, session, classes=None):
+        self.session = session
+        self.classes = classes
+        self.model_file = None
+
+        model_input = session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = ONNX_TO_NUMPY.get(model_input.type, np.float32)
+        n_features = model_input.shape[1] if len(model_input.shape) > 1 else None
+        self.n_features = n_features if isinstance(n_features, int) else None
+
+        outputs = session.get_outputs()
+        self.output_names = [output.name for output in outputs[:2]]
+        self.has_probabilities = len(self.output_names) > 1
+
+    @classmethod
+    def from_file(cls, model_file, sess_options=None):
+        """
+        Loads an ONNX model from disk, removes its ZipMap (if any) and builds the plan.
+
+        External tensor data is never read into Python: models without a ZipMap are opened
+        by path, and the others point ONNX Runtime at the model folder, so large weights
+        are memory-mapped and their pages shared between worker processes.
+        """
+        model = onnx.load(model_file, load_external_data=False)
+        classes = _strip_zipmap(model)
+        if classes is None:
+            session = ort.InferenceSession(model_file, sess_options, providers=['CPUExecutionProvider'])
+            plan = cls(session, classes)
+            plan.model_file = model_file
+            return plan
+
+        if _uses_external_data(model):
+            sess_options = sess_options or ort.SessionOptions()
+            sess_options.add_session_config_entry(
+                'session.model_external_initializers_file_folder_path',
+                os.path.dirname(os.path.abspath(model_file))
+            )
+        session = ort.InferenceSession(
+            model.SerializeToString(), sess_options, providers=['CPUExecutionProvider']
+        )
+        plan = cls(session, classes)
+        plan.model_file = model_file
+        return plan
+
+    def prepare(self, input_data):
+        """
+        Converts request data to a 2D array of the model's input dtype, checking its width.
+        """
+        input_array = np.asarray(input_data, dtype=self.input_dtype)
+        if input_array.ndim == 1:
+            input_array = input_array.reshape(1, -1)
+        if input_array.ndim != 2:
+            raise ValueError(f"expected a 2D array of features, got {input_array.ndim} dimensions")
+        if self.n_features is not None and input_array.shape[1] != self.n_features:
+            raise ValueError(f"expected {self.n_features} features, got {input_array.shape[1]}")
+        return input_array
+
+    def run(self, input_array):
+        """
+        Runs the model once and returns (predictions, probabilities).
+        probabilities is a float32 array of shape (n_rows, n_classes), or None.
+        """
+        results = self.session.run(self.output_names, {self.input_name: input_array})
+        predictions = results[0]
+        probabilities = results[1] if self.has_probabilities else None
+        return predictions, probabilities
+
+
+class ProfileSampler:
+    """
+    Records ONNX Runtime profiling traces for a random sample of requests.
+
+    A sampled request's rows are re-run in the background on a throw-away session created with
+    profiling enabled, so the serving sessions never pay the profiling overhead. Traces are
+    written as JSON files (chrome://tracing format) named after the model in profile_dir.
+    """
+
+    def __init__(self, profile_dir, sample_rate, on_profile=None):
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.on_profile = on_profile
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ort-profiler')
+
+    def maybe_profile(self, model_name, plan, input_array):
+        if plan.model_file is None or random.random() >= self.sample_rate:
+            return
+        self._executor.submit(self._profile, model_name, plan.model_file, np.array(input_array, copy=True))
+
+    def _profile(self, model_name, model_file, input_array):
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            sess_options = make_session_options()
+            sess_options.enable_profiling = True
+            sess_options.profile_file_prefix = os.path.join(self.profile_dir, re.sub(r'\W+', '_', model_name))
+            plan = InferencePlan.from_file(model_file, sess_options)
+            plan.run(input_array)
+            trace_file = plan.session.end_profiling()
+        except Exception as e:
+            print(f"Error profiling model '{model_name}': {e}")
+            return
+        if self.on_profile is not None:
+            self.on_profile(model_name, trace_file)
@@ -0,0 +1,273 @@
+"""
+K-Nearest Neighbors served from a spatial index instead of a brute-force ONNX graph.
+
+The ONNX KNN computes the distance to every reference row for every query, so latency and
+memory grow linearly with the reference set. IndexedKNNPlan keeps the (scaled) reference rows
+in a KD-tree or ball tree (exact) or in an inverted-file index (approximate: k-means cells,
+only the n_probe cells nearest to the query are searched) and answers a whole batch with one
+vectorized query, with the same interface as InferencePlan (prepare/run/classes/n_features)
+so it can sit in loaded_models, behind the batcher and the cache, like any other model.
+
+With the 25 encoded features the trees prune poorly and are exact but rarely faster than the
+ONNX graph; the inverted file scales with large reference sets at the cost of a few
+disagreements with the exact model (see `python benchmarks/bench_api.py knn`).
+
+Indexes are stored as <name>.knn.npz files next to the ONNX models (written by
+src/training/train_export.py). This module can also build a new index that adds a patient
+cohort to the references of an existing one, optionally switching the index type:
+    python src/flask/knn_index.py models/best_knn_model.knn.npz data/cohort.csv models/cohort_knn.knn.npz
+    python src/flask/knn_index.py models/best_knn_model.knn.npz data/cohort.csv models/cohort_ivf.knn.npz --algorithm ivf
+"""
+import argparse
+import csv
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.neighbors import BallTree, KDTree
+
+from encoding import RAW_COLUMNS, encode_columns
+from inference import InferencePlan
+
+INDEX_SUFFIX = '.knn.npz'
+TREE_CLASSES = {'kd_tree': KDTree, 'ball_tree': BallTree}
+ALGORITHMS = (*TREE_CLASSES, 'ivf')
+DEFAULT_N_PROBE = 8
+
+
+def save_index(index_file, reference, labels, classes, n_neighbors, weights='uniform', metric='euclidean',
+               mean=None, scale=None, algorithm='kd_tree', n_probe=DEFAULT_N_PROBE):
+    """
+    Writes an index file: reference rows in the scaled space (float32), their class labels,
+    the KNN hyperparameters, the StandardScaler applied to the queries and the index type
+    (n_probe is only used by the 'ivf' index).
+    """
+    n_features = reference.shape[1]
+    np.savez(
+        index_file,
+        reference=np.asarray(reference, dtype=np.float32),
+        labels=np.asarray(labels),
+        classes=np.asarray(classes),
+        n_neighbors=n_neighbors,
+        weights=weights,
+        metric=metric,
+        mean=np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64),
+        scale=np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64),
+        algorithm=algorithm,
+        n_probe=n_probe,
+    )
+
+
+class InvertedFileIndex:
+    """
+    Approximate nearest neighbours: the reference rows are grouped into ~sqrt(n) k-means
+    cells, and a query only computes the distances to the rows of its n_probe nearest cells.
+    A batch is scanned cell by cell: each probed cell is compared with all the queries that
+    probe it in one matrix operation, and merged into their running k nearest.
+    """
+
+    def __init__(self, reference, metric='euclidean', n_probe=DEFAULT_N_PROBE, n_lists=None, random_state=0):
+        if metric not in ('euclidean', 'manhattan'):
+            raise ValueError(f"Unsupported metric '{metric}' for the 'ivf' index.")
+        self.reference = np.asarray(reference, dtype=np.float64)
+        self.metric = metric
+        n_lists = min(len(self.reference), n_lists or max(1, int(np.sqrt(len(self.reference)))))
+        self.n_probe = max(1, min(int(n_probe), n_lists))
+
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=random_state, n_init=3,
+                                 batch_size=4096).fit(self.reference)
+        self.centroids = kmeans.cluster_centers_
+        # Rows grouped by cell: cell c holds rows[offsets[c]:offsets[c + 1]]
+        self.rows = np.argsort(kmeans.labels_, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(kmeans.labels_, minlength=n_lists))])
+        self.squared_norms = (self.reference ** 2).sum(axis=1)
+
+    def _distances(self, queries, members):
+        if self.metric == 'manhattan':
+            return np.abs(queries[:, None, :] - self.reference[members][None]).sum(axis=2)
+        squared = (self.squared_norms[members][None, :] - 2.0 * queries @ self.reference[members].T
+                   + (queries ** 2).sum(axis=1)[:, None])
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def query(self, queries, k):
+        """
+        Returns (distances, indices) of the k nearest candidates sorted by distance, like
+        KDTree.query(). Rows whose probed cells hold fewer than k rows are searched exactly; with
+        fewer than k reference rows in all, the missing neighbours have infinite distances.
+        """
+        queries = np.asarray(queries, dtype=np.float64)
+        centroid_distances = ((self.centroids ** 2).sum(axis=1)[None, :] - 2.0 * queries @ self.centroids.T)
+        if self.n_probe < len(self.centroids):
+            probed = np.argpartition(centroid_distances, self.n_probe - 1, axis=1)[:, :self.n_probe]
+        else:
+            probed = np.broadcast_to(np.arange(len(self.centroids)), centroid_distances.shape)
+
+        distances = np.full((len(queries), k), np.inf)
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+        # Group the (query, cell) pairs by cell
+        cells = probed.ravel()
+        by_cell = np.argsort(cells, kind='stable')
+        query_rows = np.repeat(np.arange(len(queries)), probed.shape[1])[by_cell]
+        probed_cells, starts = np.unique(cells[by_cell], return_index=True)
+        for cell, rows in zip(probed_cells, np.split(query_rows, starts[1:])):
+            members = self.rows[self.offsets[cell]:self.offsets[cell + 1]]
+            if not len(members):
+                continue
+            merged_distances = np.hstack([distances[rows], self._distances(queries[rows], members)])
+            merged_indices = np.hstack([indices[rows], np.broadcast_to(members, (len(rows), len(members)))])
+            nearest = np.argpartition(merged_distances, k - 1, axis=1)[:, :k]
+            distances[rows] = np.take_along_axis(merged_distances, nearest, axis=1)
+            indices[rows] = np.take_along_axis(merged_indices, nearest, axis=1)
+
+        # Probed cells holding fewer than k references in all: exact search over every row, so
+        # no query is left without neighbours (all its votes would be 0 and its probabilities NaN)
+        exact_k = min(k, len(self.reference))
+        short = np.flatnonzero(np.isfinite(distances).sum(axis=1) < exact_k)
+        if len(short):
+            all_distances = self._distances(queries[short], np.arange(len(self.reference)))
+            nearest = np.argpartition(all_distances, exact_k - 1, axis=1)[:, :exact_k]
+            distances[short, :exact_k] = np.take_along_axis(all_distances, nearest, axis=1)
+            indices[short, :exact_k] = nearest
+
+        ranking = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(distances, ranking, axis=1), np.take_along_axis(indices, ranking, axis=1)
+
+
+class IndexedKNNPlan:
+    """
+    Drop-in replacement for an InferencePlan, backed by a KD-tree, a ball tree or an
+    inverted-file index.
+
+    Predictions match scikit-learn's KNeighborsClassifier (exactly with the trees, on the
+    probed cells with 'ivf'): uniform or inverse-distance votes (an exact match takes all the
+    weight), ties broken towards the first class.
+    """
+
+    def __init__(self, reference, labels, classes, n_neighbors=5, weights='uniform', metric='euclidean',
+                 mean=None, scale=None, algorithm='kd_tree', leaf_size=40, n_probe=DEFAULT_N_PROBE):
+        self.classes = [c.item() if isinstance(c, np.generic) else c for c in classes]
+        self.input_dtype = np.float32
+        self.n_features = reference.shape[1]
+        self.has_probabilities = True
+        # Not an ONNX graph: never profiled by ProfileSampler
+        self.model_file = None
+
+        self.n_neighbors = int(n_neighbors)
+        self.weights = weights
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+        self.algorithm = algorithm
+        # Position of each reference row's label in classes, to count votes per class
+        self._label_index = np.searchsorted(np.asarray(classes), np.asarray(labels))
+        self._class_array = np.asarray(self.classes)
+        if algorithm == 'ivf':
+            self.index = InvertedFileIndex(reference, metric, n_probe)
+            self._query = self.index.query
+        elif algorithm in TREE_CLASSES:
+            self.index = TREE_CLASSES[algorithm](np.asarray(reference, dtype=np.float64), leaf_size=leaf_size,
+                                                 metric=metric)
+            # Dual-tree traversal also partitions the queries; never slower here, much faster on large batches
+            self._query = lambda queries, k: self.index.query(queries, k=k, dualtree=True)
+        else:
+            raise ValueError(f"Unknown index algorithm '{algorithm}', expected one of {', '.join(ALGORITHMS)}.")
+
+    @classmethod
+    def from_file(cls, index_file, algorithm=None, n_probe=None):
+        """
+        Loads an index file written by save_index(); algorithm and n_probe override the stored ones.
+        """
+        with np.load(index_file, allow_pickle=False) as data:
+            return cls(
+                data['reference'], data['labels'], data['classes'],
+                n_neighbors=int(data['n_neighbors']),
+                weights=str(data['weights']),
+                metric=str(data['metric']),
+                mean=data['mean'],
+                scale=data['scale'],
+                algorithm=algorithm or str(data['algorithm']),
+                n_probe=n_probe or int(data['n_probe']),
+            )
+
+    # Same conversion and width check as the ONNX models
+    prepare = InferencePlan.prepare
+
+    def run(self, input_array):
+        """
+        Queries the index once for the whole batch and returns (predictions, probabilities).
+        """
+        queries = np.asarray(input_array, dtype=np.float64)
+        if self.mean is not None:
+            queries = (queries - self.mean) / self.scale
+        distances, indices = self._query(queries, self.n_neighbors)
+
+        if self.weights == 'distance':
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / distances
+            exact = np.isinf(weights)
+            exact_rows = exact.any(axis=1)
+            weights[exact_rows] = exact[exact_rows]
+        else:
+            # Missing neighbours (infinite distance, only with 'ivf') do not vote
+            weights = np.isfinite(distances).astype(np.float64)
+
+        neighbor_classes = self._label_index[indices]
+        votes = np.empty((len(queries), len(self.classes)), dtype=np.float64)
+        for class_index in range(len(self.classes)):
+            votes[:, class_index] = (weights * (neighbor_classes == class_index)).sum(axis=1)
+        probabilities = votes / votes.sum(axis=1, keepdims=True)
+        predictions = self._class_array[probabilities.argmax(axis=1)]
+        return predictions, probabilities.astype(np.float32)
+
+
+def _parse_label(value):
+    """
+    0/1 label from a CSV cell: True/False (as written by pandas) or a number.
+    """
+    normalized = value.strip().lower()
+    if normalized in ('true', 'false'):
+        return int(normalized == 'true')
+    return int(float(normalized))
+
+
+def add_cohort(base_file, cohort_file, output_file, label_column='sick', algorithm=None, n_probe=None):
+    """
+    Writes a new index with the references of base_file plus the patients of a CSV cohort
+    (raw fields of heart_disease_clean.csv and a 0/1 label column), scaled like the base ones.
+    algorithm and n_probe default to the ones of base_file.
+    """
+    with np.load(base_file, allow_pickle=False) as data:
+        base = {key: data[key] for key in data.files}
+    # Read with the csv module: pandas is not a dependency of the server image
+    with open(cohort_file, 'r', newline='', encoding='utf-8') as file:
+        cohort = list(csv.DictReader(file))
+    encoded = encode_columns({column: [row[column] for row in cohort] for column in RAW_COLUMNS}, len(cohort))
+    scaled = (encoded - base['mean']) / base['scale']
+    labels = np.array([_parse_label(row[label_column]) for row in cohort], dtype=np.int64)
+
+    save_index(
+        output_file,
+        np.vstack([base['reference'], scaled]),
+        np.concatenate([base['labels'], labels]),
+        base['classes'],
+        int(base['n_neighbors']), str(base['weights']), str(base['metric']),
+        base['mean'], base['scale'], algorithm or str(base['algorithm']), n_probe or int(base['n_probe']),
+    )
+    print(f"Saved '{output_file}': {len(base['reference'])} + {len(cohort)} reference patients.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a KNN index with an additional cohort of reference patients.")
+    parser.add_argument('base_index', help=f"Existing index file (*{INDEX_SUFFIX}) providing scaler and hyperparameters")
+    parser.add_argument('cohort_file', help="CSV of reference patients: raw fields and a label column")
+    parser.add_argument('output_index', help=f"New index file (*{INDEX_SUFFIX}); put it in MODEL_PATH to serve it")
+    parser.add_argument('--label-column', default='sick', help="0/1 label column of the cohort (default: sick)")
+    parser.add_argument('--algorithm', choices=ALGORITHMS, help="Index type (default: the one of base_index)")
+    parser.add_argument('--n-probe', type=int, help="Cells searched per query by the 'ivf' index")
+    args = parser.parse_args()
+
+    if not args.output_index.endswith(INDEX_SUFFIX):
+        parser.error(f"the output file name must end with '{INDEX_SUFFIX}' to be discovered by the server")
+    add_cohort(args.base_index, args.cohort_file, args.output_index, args.label_column, args.algorithm, args.n_probe)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+# Histogram buckets: latencies in seconds, and rows per model run
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROWS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+# Counters and histograms of exited workers, merged into one file of the metrics directory
+RETIRED_FILE = 'retired.json'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsRegistry:
+    """
+    Prometheus-style counters, gauges and histograms of one process.
+
+    With gunicorn every worker is a separate process: when a metrics directory is configured,
+    each worker periodically writes its snapshot there and /metrics sums the snapshots of all
+    workers (counters and histograms of exited workers keep counting, gauges only of live ones).
+    The snapshots of exited workers are folded into a single retired-workers file at scrape time,
+    so the directory does not grow with worker recycling (gunicorn --max-requests).
+    """
+
+    def __init__(self, metrics_dir=None, flush_interval=1.0):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+        self._collectors = []
+        self._flusher = None
+
+    # --- Declaration ---
+
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text):
+        self._meta[name] = ('gauge', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+
+    def add_collector(self, callback):
+        """
+        Registers callback(registry) run before every snapshot, to set values read from elsewhere.
+        """
+        self._collectors.append(callback)
+
+    # --- Recording ---
+
+    def inc(self, name, labels=None, value=1.0):
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name, labels=None, value=0.0):
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, labels=None, value=0.0):
+        buckets = self._meta[name][2]
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = 0
+            while index < len(buckets) and value > buckets[index]:
+                index += 1
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    # --- Export ---
+
+    def snapshot(self):
+        for callback in self._collectors:
+            callback(self)
+        with self._lock:
+            values = [
+                [name, dict(labels), [list(value[0]), value[1], value[2]] if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+        return {"pid": os.getpid(), "values": values}
+
+    def _snapshot_file(self, pid):
+        return os.path.join(self.metrics_dir, f"worker-{pid}.json")
+
+    def flush(self):
+        """
+        Writes this process' snapshot to the metrics directory (atomically, via a rename).
+        """
+        if not self.metrics_dir:
+            return
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        snapshot = self.snapshot()
+        path = self._snapshot_file(snapshot["pid"])
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file)
+        os.replace(path + '.tmp', path)
+
+    def start_flusher(self):
+        if not self.metrics_dir or self._flusher is not None:
+            return
+
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"Error writing metrics snapshot: {e}")
+
+        self._flusher = threading.Thread(target=flush_loop, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    @staticmethod
+    def _is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _merge(self, merged, values, gauges=True):
+        """
+        Adds snapshot values ([name, labels, value] lists) to merged {(name, label key): value}.
+        """
+        for name, labels, value in values:
+            if name not in self._meta:
+                continue
+            kind = self._meta[name][0]
+            if kind == 'gauge' and not gauges:
+                continue
+            key = (name, _label_key(labels))
+            if kind == 'histogram':
+                current = merged.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                current[0] = [a + b for a, b in zip(current[0], value[0])]
+                current[1] += value[1]
+                current[2] += value[2]
+            else:
+                merged[key] = merged.get(key, 0.0) + value
+        return merged
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            return None
+
+    def _retire(self, dead_files):
+        """
+        Merges the counters and histograms of exited workers into RETIRED_FILE and deletes their snapshots.
+        """
+        retired_file = os.path.join(self.metrics_dir, RETIRED_FILE)
+        retired = self._read_json(retired_file) or {"values": []}
+        merged = self._merge({}, retired["values"])
+        for path in dead_files:
+            snapshot = self._read_json(path)
+            if snapshot is not None:
+                self._merge(merged, snapshot["values"], gauges=False)
+        values = [[name, dict(labels), value] for (name, labels), value in merged.items()]
+        with open(retired_file + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({"values": values}, file)
+        os.replace(retired_file + '.tmp', retired_file)
+        # Deleted only once their values are in the retired file: a crash in between loses nothing
+        for path in dead_files:
+            os.remove(path)
+
+    def _collect_snapshots(self):
+        """
+        Returns the snapshots of the live workers and, as one snapshot, the totals of the exited ones.
+        """
+        if not self.metrics_dir:
+            return [self.snapshot()]
+        self.flush()
+        # Scrapes served by different workers must not retire the same snapshot twice
+        with open(os.path.join(self.metrics_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshots, dead_files = [], []
+            for path in glob.glob(os.path.join(self.metrics_dir, 'worker-*.json')):
+                snapshot = self._read_json(path)
+                if snapshot is None:
+                    continue
+                if snapshot["pid"] == os.getpid() or self._is_alive(snapshot["pid"]):
+                    snapshots.append(snapshot)
+                else:
+                    dead_files.append(path)
+            if dead_files:
+                self._retire(dead_files)
+            retired = self._read_json(os.path.join(self.metrics_dir, RETIRED_FILE))
+        if retired is not None:
+            snapshots.append(retired)
+        return snapshots
+
+    def render(self):
+        """
+        Returns the metrics of every worker, summed, in the Prometheus text exposition format.
+        """
+        merged = {}
+        for snapshot in self._collect_snapshots():
+            self._merge(merged, snapshot["values"])
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            series = sorted((labels, value) for (series_name, labels), value in merged.items() if series_name == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[0]):
+                    cumulative += count
+                    bucket_labels = labels + (('le', bound if bound == '+Inf' else _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[2]}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """
+    Splits the time of one prediction request into consecutive stages (parse, convert, inference, serialize).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = {}
+
+    def mark(self, stage):
+        """
+        Ends the current stage: the time since the previous mark is attributed to stage.
+        """
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def record(self, registry, endpoint, model_name, status):
+        labels = {"endpoint": endpoint, "model": model_name}
+        registry.inc('prediction_requests_total', dict(labels, status=str(status)))
+        registry.observe('prediction_request_seconds', labels, time.perf_counter() - self.started)
+        for stage, seconds in self.stages.items():
+            registry.observe('prediction_stage_seconds', dict(labels, stage=stage), seconds)
@@ -0,0 +1,167 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from inference import InferencePlan
+from knn_index import INDEX_SUFFIX, IndexedKNNPlan
+
+MANIFEST_FILE = 'models.json'
+# Served model files: ONNX graphs and KNN spatial indexes
+MODEL_PATTERNS = ('*.onnx', f'*{INDEX_SUFFIX}')
+
+
+def load_plan(model_file, sess_options=None):
+    """
+    Builds the plan serving a model file: an IndexedKNNPlan for KNN indexes, an InferencePlan otherwise.
+    """
+    if model_file.endswith(INDEX_SUFFIX):
+        return IndexedKNNPlan.from_file(model_file)
+    return InferencePlan.from_file(model_file, sess_options)
+
+
+class ModelRegistry:
+    """
+    Discovers the *.onnx files (and *.knn.npz KNN indexes) in a model folder and keeps one plan per model.
+
+    Display names and metadata come from an optional manifest (models.json) in the same folder:
+        {"best_log_model.onnx": {"name": "Logistic Regression", "version": "2024-06-01", ...}}
+    Files missing from the manifest fall back to default_names, then to their file name.
+    When two files get the same name, the first one in discovery order is served and a warning is printed.
+
+    reload() only reloads files whose modification time or size changed, and swaps each
+    plan with a single dict assignment: requests already running keep the plan they
+    fetched, new requests get the new one, so none fails during the swap. A model that
+    fails to load keeps serving its previous version.
+    """
+
+    def __init__(self, model_path, sess_options_factory=None, default_names=None):
+        self.model_path = model_path
+        self.sess_options_factory = sess_options_factory
+        self.default_names = default_names or {}
+        # Model name -> InferencePlan; updated in place so that references to it stay valid
+        self.models = {}
+        self.metadata = {}
+        self._files = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._watcher = None
+        # Name collisions already reported, so the watcher does not repeat the warning at every poll
+        self._collisions = set()
+
+    def add_listener(self, callback):
+        """
+        Registers callback(model_name, plan) called after a model is swapped (plan is None when removed).
+        """
+        self._listeners.append(callback)
+
+    def _read_manifest(self):
+        manifest_file = os.path.join(self.model_path, MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            return {}
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (IOError, ValueError) as e:
+            print(f"Error reading model manifest '{manifest_file}': {e}")
+            return {}
+
+    @staticmethod
+    def _file_version(model_file):
+        stat = os.stat(model_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _discover(self):
+        """
+        Returns {model name: (file path, metadata)} for every model file in the model folder.
+        """
+        manifest = self._read_manifest()
+        discovered = {}
+        # ONNX models first, so the first listed model (the client default) stays a baseline one
+        model_files = sorted(
+            (model_file for pattern in MODEL_PATTERNS for model_file in glob.glob(os.path.join(self.model_path, pattern))),
+            key=lambda model_file: (model_file.endswith(INDEX_SUFFIX), model_file),
+        )
+        for model_file in model_files:
+            file_name = os.path.basename(model_file)
+            metadata = dict(manifest.get(file_name, {}))
+            stem = file_name[:-len(INDEX_SUFFIX)] if file_name.endswith(INDEX_SUFFIX) else os.path.splitext(file_name)[0]
+            name = metadata.get('name') or self.default_names.get(file_name) or stem
+            metadata.update({'name': name, 'file': file_name})
+            if name in discovered:
+                collision = (name, discovered[name][1]['file'], file_name)
+                if collision not in self._collisions:
+                    self._collisions.add(collision)
+                    print(f"WARNING: '{file_name}' and '{collision[1]}' are both named '{name}': "
+                          f"serving '{collision[1]}', ignoring '{file_name}'.")
+                continue
+            discovered[name] = (model_file, metadata)
+        return discovered
+
+    def reload(self):
+        """
+        Loads new or changed model files and drops the models whose file disappeared.
+        Returns a summary {"loaded": [...], "unchanged": [...], "removed": [...], "failed": {...}}.
+        """
+        with self._lock:
+            summary = {"loaded": [], "unchanged": [], "removed": [], "failed": {}}
+            discovered = self._discover()
+
+            for name, (model_file, metadata) in discovered.items():
+                try:
+                    version = self._file_version(model_file)
+                except OSError as e:
+                    summary["failed"][name] = str(e)
+                    continue
+                if name in self.models and self._files.get(name) == (model_file, version):
+                    metadata['load_seconds'] = self.metadata[name].get('load_seconds')
+                    self.metadata[name] = metadata
+                    summary["unchanged"].append(name)
+                    continue
+                try:
+                    sess_options = self.sess_options_factory() if self.sess_options_factory else None
+                    started = time.perf_counter()
+                    plan = load_plan(model_file, sess_options)
+                    metadata['load_seconds'] = time.perf_counter() - started
+                except Exception as e:
+                    print(f"Error loading model '{name}' from {model_file}: {e}")
+                    summary["failed"][name] = str(e)
+                    continue
+                self.models[name] = plan
+                self.metadata[name] = metadata
+                self._files[name] = (model_file, version)
+                summary["loaded"].append(name)
+                print(f"Model {name} successfully loaded from {os.path.basename(model_file)}")
+                self._notify(name, plan)
+
+            for name in [name for name in self.models if name not in discovered]:
+                self.models.pop(name, None)
+                self.metadata.pop(name, None)
+                self._files.pop(name, None)
+                summary["removed"].append(name)
+                print(f"Model {name} removed: its file is no longer in {self.model_path}")
+                self._notify(name, None)
+            return summary
+
+    def _notify(self, name, plan):
+        for callback in self._listeners:
+            callback(name, plan)
+
+    def start_watcher(self, interval):
+        """
+        Polls the model folder every interval seconds in a daemon thread, reloading changed files.
+        """
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Error while reloading models: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
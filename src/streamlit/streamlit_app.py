@@ -1,5 +1,9 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import csv
+import io
 import json
 import os # Importa il modulo os per accedere alle variabili d'ambiente
 
@@ -9,8 +13,31 @@ import os # Importa il modulo os per accedere alle variabili d'ambiente
 # userà http://localhost:5001 come fallback.
 FLASK_API_URL = os.getenv("FLASK_API_URL", "http://localhost:5001")
 
+# Timeout (connessione, lettura) in secondi delle chiamate all'API; il caricamento di un file CSV ha un timeout di lettura più lungo
+API_TIMEOUT = (float(os.getenv("API_CONNECT_TIMEOUT", "3")), float(os.getenv("API_READ_TIMEOUT", "30")))
+BATCH_TIMEOUT = (API_TIMEOUT[0], float(os.getenv("API_BATCH_READ_TIMEOUT", "300")))
+# Per quanti secondi la lista dei modelli e le loro performance vengono riutilizzate senza richiamare l'API
+MODEL_LIST_TTL = int(os.getenv("MODEL_LIST_TTL", "60"))
+PERFORMANCE_TTL = int(os.getenv("PERFORMANCE_TTL", "300"))
+# Ogni quante righe ricevute viene aggiornata la barra di avanzamento della previsione da file
+PROGRESS_EVERY = 256
+
 # --- Funzioni per chiamare l'API ---
 
+@st.cache_resource
+def get_session():
+    """
+    Restituisce la sessione HTTP condivisa da tutte le chiamate all'API (e da tutti gli utenti dell'app):
+    le connessioni verso Flask restano aperte (keep-alive) e vengono riutilizzate tra un rerun e l'altro.
+    Solo gli errori di connessione vengono ritentati, perché in quel caso la richiesta non è mai arrivata al backend.
+    """
+    session = requests.Session()
+    retries = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2, allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 def handle_api_error(response):
     """
     Gestisce gli errori delle risposte API.
@@ -28,15 +55,22 @@ def handle_api_error(response):
         return {"error": "Errore sconosciuto."}
     return response.json()
 
+@st.cache_data(ttl=MODEL_LIST_TTL, show_spinner=False)
+def fetch_model_list():
+    """
+    Lista dei modelli da /model_list, riutilizzata per MODEL_LIST_TTL secondi.
+    Gli errori vengono sollevati e quindi non finiscono in cache.
+    """
+    response = get_session().post(f"{FLASK_API_URL}/model_list", timeout=API_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get("available_models", [])
+
 def get_available_models():
     """
     Recupera i modelli disponibili dall'endpoint /models_list della Flask API.
     """
     try:
-        response = requests.post(f"{FLASK_API_URL}/model_list", timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("available_models", [])
+        return fetch_model_list()
     except requests.RequestException as e:
         st.warning(f"Errore nella richiesta all'API: {e}")
         return []
@@ -44,37 +78,94 @@ def get_available_models():
         st.warning("Risposta API non è un JSON valido.")
         return []
     
-def predict_data(model_name, data):
+def predict_data(model_name, patient):
     """
-    Invia i dati all'endpoint /predict della Flask API per ottenere una previsione.
+    Invia i dati grezzi del paziente all'endpoint /predict della Flask API per ottenere una previsione.
+    La codifica one-hot delle feature viene eseguita dal backend.
     """
     endpoint = f"{FLASK_API_URL}/predict"
-    headers = {"Content-Type": "application/json"}
     payload = {
         "model_name": model_name,
-        "data": [data]  # L'API Flask si aspetta una lista di liste per i dati
+        "patients": [patient]  # L'API Flask si aspetta una lista di pazienti
     }
     try:
-        response = requests.post(endpoint, headers=headers, data=json.dumps(payload))
+        response = get_session().post(endpoint, json=payload, timeout=API_TIMEOUT)
         return handle_api_error(response)
     except requests.exceptions.RequestException as e:
         st.error(f"Errore durante la chiamata all'API /predict: {e}")
         return {"error": "Errore sconosciuto durante la previsione."}
 
+def explain_data(model_name, patient):
+    """
+    Chiede all'endpoint /explain della Flask API il contributo di ogni caratteristica del paziente alla previsione.
+    Restituisce None se l'API non risponde.
+    """
+    endpoint = f"{FLASK_API_URL}/explain"
+    payload = {
+        "model_name": model_name,
+        "patients": [patient]
+    }
+    try:
+        response = get_session().post(endpoint, json=payload, timeout=API_TIMEOUT)
+        body = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    if not response.ok:
+        return {"error": body.get('error', 'Errore sconosciuto')}
+    return body
+
+@st.cache_data(ttl=PERFORMANCE_TTL, show_spinner=False)
+def fetch_model_performance(model_name):
+    """
+    Metriche di un modello da /models, riutilizzate per PERFORMANCE_TTL secondi.
+    Gli errori vengono sollevati e quindi non finiscono in cache.
+    """
+    response = get_session().post(f"{FLASK_API_URL}/models", json={"model_name": model_name}, timeout=API_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
 def get_model_performance(model_name):
     """
     Recupera le metriche di performance di un modello dall'endpoint /models della Flask API.
     """
-    endpoint = f"{FLASK_API_URL}/models"
-    headers = {"Content-Type": "application/json"}
-    payload = {"model_name": model_name}
     try:
-        response = requests.post(endpoint, headers=headers, data=json.dumps(payload))
-        return handle_api_error(response)
+        return fetch_model_performance(model_name)
+    except requests.exceptions.HTTPError as e:
+        return handle_api_error(e.response)
     except requests.exceptions.RequestException as e:
         st.error(f"Errore durante la chiamata all'API /models: {e}")
         return {"error": "Errore sconosciuto durante il recupero delle performance."}
 
+def predict_file(model_name, csv_bytes, on_progress):
+    """
+    Invia un intero file CSV di pazienti all'endpoint /predict_batch in un'unica chiamata e legge i risultati
+    in streaming (NDJSON, una riga per paziente), chiamando on_progress(righe ricevute) ogni PROGRESS_EVERY righe.
+    Restituisce (risultati, errore): se una riga del file non è valida, i risultati precedenti sono comunque restituiti.
+    """
+    endpoint = f"{FLASK_API_URL}/predict_batch"
+    results, error = [], None
+    try:
+        with get_session().post(endpoint, params={"model_name": model_name}, data=csv_bytes,
+                                headers={"Content-Type": "text/csv"}, stream=True, timeout=BATCH_TIMEOUT) as response:
+            if not response.ok:
+                return results, handle_api_error(response)["error"]
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "error" in record:
+                    error = record["error"]
+                    break
+                results.append(record)
+                if len(results) % PROGRESS_EVERY == 0:
+                    on_progress(len(results))
+    except requests.exceptions.RequestException as e:
+        error = f"Errore durante la chiamata all'API /predict_batch: {e}"
+    except ValueError:
+        error = "Risposta API non è un NDJSON valido."
+    on_progress(len(results))
+    return results, error
+
 # --- Interfaccia Utente Streamlit ---
 
 st.set_page_config(page_title="Medical Diagnosis Aid", layout="centered")
@@ -97,11 +188,15 @@ else:
     )
 
     # Visualizza le performance del modello selezionato
+    # Senza file di riferimento per le spiegazioni (explain_background.npz) /models riporta explainable=false
+    # e /explain non viene chiamato; le versioni dell'API senza il campo vengono comunque interrogate
+    explainable = True
     if selected_model:
         st.sidebar.subheader("Performance del Modello Selezionato")
         with st.spinner(f"Recupero performance per {selected_model}..."):
             performance_data = get_model_performance(selected_model)
             if performance_data and "error" not in performance_data:
+                explainable = performance_data.get("explainable", True)
                 st.sidebar.markdown(f"**Accuratezza:** {float(performance_data.get('accuracy', 0)):.4f}")
                 st.sidebar.markdown(f"**Recall:** {float(performance_data.get('recall', 0)):.4f}")
                 st.sidebar.markdown(f"**ROC AUC:** {float(performance_data.get('roc_auc', 0)):.4f}")
@@ -114,95 +209,100 @@ else:
     st.header("Inserisci i Dati del Paziente")
     st.markdown("Si prega di inserire i valori delle caratteristiche pertinenti per ottenere una previsione.")
 
-    # Inizializza la lista per i valori delle feature
-    # La lista sarà popolata nell'ordine esatto richiesto per il modello one-hot encoded
-    feature_values = []
+    # Inizializza il dizionario con i campi grezzi del paziente (come in heart_disease_clean.csv)
+    # La codifica one-hot nell'ordine richiesto dal modello viene eseguita dall'API Flask
+    patient = {}
 
     st.subheader("Informazioni Demografiche e Cliniche:")
 
     # SEX (sex_Female, sex_Male)
     sex_selected = st.radio("Sesso", ["Maschio", "Femmina"], index=0, key="sex_input_ohe")
-    feature_values.append(1.0 if sex_selected == "Femmina" else 0.0) # sex_Female
-    feature_values.append(1.0 if sex_selected == "Maschio" else 0.0) # sex_Male
+    patient["sex"] = "Female" if sex_selected == "Femmina" else "Male"
 
     # CHEST_PAIN_TYPE (chest_pain_type_asymptomatic, chest_pain_type_atypical angina, chest_pain_type_non-anginal, chest_pain_type_typical angina)
     chest_pain_selected = st.selectbox("Tipo di dolore al petto", 
                                        ["Angina tipica", "Angina atipica", "Dolore non anginoso", "Asintomatico"], 
                                        index=3, # Default: Asintomatico (come nell'esempio)
                                        key="chest_pain_input_ohe")
-    feature_values.append(1.0 if chest_pain_selected == "Asintomatico" else 0.0)
-    feature_values.append(1.0 if chest_pain_selected == "Angina atipica" else 0.0)
-    feature_values.append(1.0 if chest_pain_selected == "Dolore non anginoso" else 0.0)
-    feature_values.append(1.0 if chest_pain_selected == "Angina tipica" else 0.0)
+    patient["chest_pain_type"] = {
+        "Asintomatico": "asymptomatic",
+        "Angina atipica": "atypical angina",
+        "Dolore non anginoso": "non-anginal",
+        "Angina tipica": "typical angina",
+    }[chest_pain_selected]
 
     # FASTING_BLOOD_SUGAR (fasting_blood_sugar_False, fasting_blood_sugar_True)
     fasting_blood_sugar_selected = st.radio("Glicemia a digiuno > 120 mg/dl?", ["Sì", "No"], index=1, key="fbs_input_ohe") # Sì = True, No = False
-    feature_values.append(1.0 if fasting_blood_sugar_selected == "No" else 0.0) # fasting_blood_sugar_False
-    feature_values.append(1.0 if fasting_blood_sugar_selected == "Sì" else 0.0) # fasting_blood_sugar_True
+    patient["fasting_blood_sugar"] = fasting_blood_sugar_selected == "Sì"
 
     # ECG_RESTING (ecg_resting_lv hypertrophy, ecg_resting_normal, ecg_resting_st-t abnormality)
     ecg_resting_selected = st.selectbox("Risultati ECG a riposo", 
                                         ["Ipertrofia ventricolare sinistra", "Normale", "Anormalità dell'onda ST-T"], 
                                         index=0, # Default: Ipertrofia ventricolare sinistra
                                         key="ecg_resting_input_ohe")
-    feature_values.append(1.0 if ecg_resting_selected == "Ipertrofia ventricolare sinistra" else 0.0)
-    feature_values.append(1.0 if ecg_resting_selected == "Normale" else 0.0)
-    feature_values.append(1.0 if ecg_resting_selected == "Anormalità dell'onda ST-T" else 0.0)
+    patient["ecg_resting"] = {
+        "Ipertrofia ventricolare sinistra": "lv hypertrophy",
+        "Normale": "normal",
+        "Anormalità dell'onda ST-T": "st-t abnormality",
+    }[ecg_resting_selected]
 
     # EXERCISE_INDUCED_ANGINA (exercise_induced_angina_False, exercise_induced_angina_True)
     exercise_induced_angina_selected = st.radio("Angina indotta da esercizio?", ["Sì", "No"], index=1, key="eia_input_ohe") # Sì = True, No = False
-    feature_values.append(1.0 if exercise_induced_angina_selected == "No" else 0.0) # exercise_induced_angina_False
-    feature_values.append(1.0 if exercise_induced_angina_selected == "Sì" else 0.0) # exercise_induced_angina_True
+    patient["exercise_induced_angina"] = exercise_induced_angina_selected == "Sì"
 
     # ST_SLOPE_TYPE (st_slope_type_downsloping, st_slope_type_flat, st_slope_type_upsloping)
     st_slope_selected = st.selectbox("Pendenza del segmento ST al picco dell'esercizio", 
                                      ["In discesa", "Piatto", "In salita"], 
                                      index=0, # Default: In discesa
                                      key="st_slope_input_ohe")
-    feature_values.append(1.0 if st_slope_selected == "In discesa" else 0.0)
-    feature_values.append(1.0 if st_slope_selected == "Piatto" else 0.0)
-    feature_values.append(1.0 if st_slope_selected == "In salita" else 0.0)
+    patient["st_slope_type"] = {
+        "In discesa": "downsloping",
+        "Piatto": "flat",
+        "In salita": "upsloping",
+    }[st_slope_selected]
 
     # THAL_DEFECT_TYPE (thal_defect_type_fixed defect, thal_defect_type_normal, thal_defect_type_reversable defect)
     thal_defect_selected = st.selectbox("Tipo di difetto alla risonanza (Thal)", 
                                         ["Difetto fisso", "Normale", "Difetto reversibile"], 
                                         index=2, # Default: Difetto reversibile
                                         key="thal_defect_input_ohe")
-    feature_values.append(1.0 if thal_defect_selected == "Difetto fisso" else 0.0)
-    feature_values.append(1.0 if thal_defect_selected == "Normale" else 0.0)
-    feature_values.append(1.0 if thal_defect_selected == "Difetto reversibile" else 0.0)
+    patient["thal_defect_type"] = {
+        "Difetto fisso": "fixed defect",
+        "Normale": "normal",
+        "Difetto reversibile": "reversable defect",
+    }[thal_defect_selected]
 
     st.subheader("Valori Numerici:")
 
     # AGE
     age = st.number_input("Età (anni)", min_value=0.0, max_value=120.0, value=45.0, step=1.0, format="%.0f", key="age_input_num")
-    feature_values.append(age)
+    patient["age"] = age
 
     # BLOOD_PRESSURE_RESTING
     blood_pressure_resting = st.number_input("Pressione sanguigna a riposo (mm Hg)", min_value=70.0, max_value=200.0, value=142.0, step=1.0, format="%.1f", key="bp_resting_input_num")
-    feature_values.append(blood_pressure_resting)
+    patient["blood_pressure_resting"] = blood_pressure_resting
 
     # CHOLESTEROL
     cholesterol = st.number_input("Colesterolo (mg/dl)", min_value=100.0, max_value=600.0, value=150.0, step=1.0, format="%.1f", key="cholesterol_input_num")
-    feature_values.append(cholesterol)
+    patient["cholesterol"] = cholesterol
 
     # MAX_HEART_RATE
     max_heart_rate = st.number_input("Frequenza cardiaca massima (bpm)", min_value=60.0, max_value=220.0, value=147.0, step=1.0, format="%.1f", key="max_hr_input_num")
-    feature_values.append(max_heart_rate)
+    patient["max_heart_rate"] = max_heart_rate
 
     # ST_DEPRESSION_EXERCISE
     st_depression_exercise = st.number_input("Depressione ST indotta da esercizio", min_value=0.0, max_value=6.0, value=0.0, step=0.1, format="%.1f", key="st_dep_input_num")
-    feature_values.append(st_depression_exercise)
+    patient["st_depression_exercise"] = st_depression_exercise
 
     # MAJOR_VESSELS_COLORED
     major_vessels_colored = st.number_input("Numero di vasi maggiori colorati (0-3)", min_value=0.0, max_value=3.0, value=3.0, step=1.0, format="%.0f", key="mvc_input_num")
-    feature_values.append(major_vessels_colored)
+    patient["major_vessels_colored"] = major_vessels_colored
 
     st.markdown("---")
     if st.button("Ottieni Diagnosi"):
-        if selected_model and feature_values:
+        if selected_model and patient:
             with st.spinner("Effettuando la previsione..."):
-                prediction_result = predict_data(selected_model, feature_values)
+                prediction_result = predict_data(selected_model, patient)
 
                 if prediction_result and "error" not in prediction_result:
                     st.subheader("Risultati della Previsione:")
@@ -217,21 +317,37 @@ else:
                         st.markdown("---")
                         st.subheader("Probabilità:")
                         
-                        # [{'0': 0.09090909361839294, '1': 0.9090909361839294}]
-                        # Quindi, dobbiamo estrarre il dizionario e poi accedere alle sue chiavi.
-                        probabilities_list_of_dict = prediction_result["probabilities"]
+                        # {'classes': [0, 1], 'probabilities': [[0.09090909361839294, 0.9090909361839294]]}
+                        # Quindi, dobbiamo estrarre la prima riga e poi accedere alla colonna di ogni classe.
+                        classes = prediction_result.get("classes") or [0, 1]
+                        probabilities_row = prediction_result["probabilities"][0]
                         
-                        # Estrai il dizionario di probabilità
-                        probabilities_dict = probabilities_list_of_dict[0]
+                        # Associa ogni classe alla sua probabilità
+                        probabilities_dict = dict(zip(classes, probabilities_row))
                         
-                        prob_class_0 = probabilities_dict.get('0')
-                        prob_class_1 = probabilities_dict.get('1')
+                        prob_class_0 = probabilities_dict.get(0)
+                        prob_class_1 = probabilities_dict.get(1)
                         
                         if prob_class_0 is not None and prob_class_1 is not None:
                             st.write(f"Probabilità di Classe 0 (sano): **{prob_class_0:.4f}**")
                             st.write(f"Probabilità di Classe 1 (malato): **{prob_class_1:.4f}**")
                         else:
-                            st.warning("Le probabilità di Classe 0 o Classe 1 non sono state trovate nel dizionario.")
+                            st.warning("Le probabilità di Classe 0 o Classe 1 non sono state trovate nella risposta.")
+
+                    explanation = explain_data(selected_model, patient) if explainable else None
+                    if explanation and "error" not in explanation:
+                        st.markdown("---")
+                        st.subheader("Contributo delle Caratteristiche:")
+                        scale = "log-odds" if explanation.get("output") == "log-odds" else "probabilità di malattia"
+                        st.caption(
+                            f"Contributo di ogni dato alla previsione ({scale}) rispetto al valore medio sui pazienti "
+                            f"di addestramento ({explanation['base_value']:.3f}): i valori positivi spingono verso 'Malato'."
+                        )
+                        contributions = sorted(explanation["contributions"][0].items(), key=lambda item: abs(item[1]), reverse=True)
+                        st.table([{"Caratteristica": name, "Valore": str(patient.get(name)), "Contributo": f"{value:+.4f}"}
+                                  for name, value in contributions])
+                    elif explanation:
+                        st.info(f"Spiegazione non disponibile: {explanation['error']}")
             
                 elif prediction_result and "error" in prediction_result:
                     st.error(f"Errore durante la previsione: {prediction_result['error']}")
@@ -239,3 +355,42 @@ else:
                     st.error("Nessuna risposta valida dall'API di previsione.")
         else:
             st.warning("Per favore, seleziona un modello e inserisci tutti i valori delle caratteristiche.")
+
+    st.markdown("---")
+    st.header("Previsione da File CSV")
+    st.markdown(
+        "Carica un file CSV di pazienti con gli stessi campi di `heart_disease_clean.csv` (e una colonna `id` opzionale): "
+        "tutte le previsioni vengono calcolate con un'unica chiamata all'API."
+    )
+    uploaded_file = st.file_uploader("File CSV dei pazienti", type=["csv"], key="batch_csv_upload")
+    if uploaded_file is not None and st.button("Ottieni Diagnosi per il File"):
+        csv_bytes = uploaded_file.getvalue()
+        n_patients = max(sum(1 for line in csv_bytes.splitlines() if line.strip()) - 1, 0)
+        progress_bar = st.progress(0.0, text=f"Previsione di {n_patients} pazienti con {selected_model}...")
+
+        def update_progress(n_done):
+            fraction = min(n_done / n_patients, 1.0) if n_patients else 1.0
+            progress_bar.progress(fraction, text=f"{n_done} / {n_patients} pazienti")
+
+        batch_results, batch_error = predict_file(selected_model, csv_bytes, update_progress)
+        if batch_error:
+            st.error(f"Errore durante la previsione: {batch_error}")
+        if batch_results:
+            rows = []
+            for record in batch_results:
+                row = {
+                    "id": record.get("id", record["row"] + 1),
+                    "Previsione": "Sano" if record["prediction"] == 0 else "Malato",
+                }
+                if "probabilities" in record:
+                    row["Probabilità malato"] = round(record["probabilities"][-1], 4)
+                rows.append(row)
+            n_sick = sum(row["Previsione"] == "Malato" for row in rows)
+            st.success(f"{len(rows)} pazienti analizzati: {n_sick} malati, {len(rows) - n_sick} sani.")
+            st.dataframe(rows, use_container_width=True)
+
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+            st.download_button("Scarica i risultati (CSV)", output.getvalue(), file_name="previsioni.csv", mime="text/csv")
@@ -0,0 +1,382 @@
+"""
+Evaluation of any number of prediction sources against the ground truth, all at once.
+
+Replaces the per-source metric cells of notebooks/heart-data-machine-learning.ipynb (KNN,
+Logistic Regression, GPT-4, human): every source is a column of one label matrix aligned with
+the patients of the data store (src/flask/data_store.py), -1 where the source has no prediction.
+The confusion counts of all the sources come from a single weighted sum over the rows (one
+matrix product), and bootstrap confidence intervals reuse the same pass with the resampling
+counts of each replicate as row weights. Replicates are computed in chunks across a process
+pool, each chunk with its own seed, so the intervals do not depend on --n-jobs.
+
+Sources are the prediction sets of the store (GPT, human annotators, stored model runs) and,
+with --models-dir, the models of a model folder scored on the store's design matrix. Their ROC
+AUC is computed from the probabilities. For label-only sources it is the AUC of the
+single-threshold ROC curve: (recall + specificity) / 2.
+
+Writes a tuned_model_performance.csv-compatible table (Accuracy, Recall, ROC AUC first, then
+the other metrics, the counts and the confidence intervals) and a combined Markdown report.
+
+Example:
+    python src/training/evaluate.py
+    python src/training/evaluate.py --models-dir models --n-bootstrap 2000 --n-jobs 8
+    python src/training/evaluate.py --subset all    # GPT and human labels only: no model training rows
+"""
+import argparse
+import math
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from train_export import DEFAULT_INPUT_FILE, ROOT, TARGET_COLUMN, load_dataset, split_dataset
+
+# src/flask is on sys.path once train_export is imported
+from data_store import MISSING, open_store  # noqa: E402
+from registry import ModelRegistry  # noqa: E402
+
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT, 'data', 'evaluation')
+PERFORMANCE_FILE = 'performance.csv'
+REPORT_FILE = 'report.md'
+# Columns of tuned_model_performance.csv, in order, followed by the other metrics
+METRICS = ['Accuracy', 'Recall', 'ROC AUC', 'Precision', 'F1', 'Specificity']
+COUNTS = ['TP', 'FP', 'FN', 'TN']
+# Bootstrap replicates per job: bounds the (replicates, rows) weight matrix of a worker
+CHUNK_REPLICATES = 50
+
+
+# --- Metrics ---
+
+def confusion_counts(weights, y_true, labels):
+    """
+    Weighted confusion counts of every source in one matrix product.
+
+    weights is (n_replicates, n_rows), y_true (n_rows,) 0/1 and labels (n_rows, n_sources) with
+    MISSING where a source has no prediction. Returns a dict of (n_replicates, n_sources) arrays.
+    """
+    positive = y_true.astype(bool)[:, None]
+    predicted = labels == 1
+    valid = labels != MISSING
+    cells = np.stack([
+        valid & predicted & positive, valid & predicted & ~positive,
+        valid & ~predicted & positive, valid & ~predicted & ~positive,
+    ], axis=1).reshape(len(y_true), -1)
+    # float32 sums of integer weights are exact up to 2**24 rows
+    counts = (weights.astype(np.float32) @ cells.astype(np.float32)).astype(np.float64)
+    counts = counts.reshape(len(weights), len(COUNTS), labels.shape[1])
+    return {name: counts[:, index] for index, name in enumerate(COUNTS)}
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def metrics_from_counts(counts):
+    """
+    Metrics of METRICS (as arrays shaped like the counts) from the output of confusion_counts().
+    """
+    tp, fp, fn, tn = (counts[name] for name in COUNTS)
+    recall = _ratio(tp, tp + fn)
+    precision = _ratio(tp, tp + fp)
+    specificity = _ratio(tn, tn + fp)
+    return {
+        'Accuracy': _ratio(tp + tn, tp + fp + fn + tn),
+        'Recall': recall,
+        'ROC AUC': (recall + specificity) / 2,
+        'Precision': precision,
+        'F1': _ratio(2 * tp, 2 * tp + fp + fn),
+        'Specificity': specificity,
+    }
+
+
+def weighted_auc(weights, y_true, scores):
+    """
+    ROC AUC of one source's probability scores for every row of weights: the weighted
+    Mann-Whitney statistic, with tied scores counted half. Rows without a score (NaN) are skipped.
+    """
+    valid = ~np.isnan(scores)
+    order = np.argsort(scores[valid], kind='stable')
+    scores, positive = scores[valid][order], y_true[valid][order].astype(bool)
+    weights = weights[:, valid][:, order].astype(np.float64)
+    positive_weights = weights * positive
+    negative_weights = weights * ~positive
+
+    # Negative weight below each score group and within it
+    group_ends = np.flatnonzero(np.r_[scores[1:] != scores[:-1], True])
+    group = np.cumsum(np.r_[0, scores[1:] != scores[:-1]])
+    cumulative = np.cumsum(negative_weights, axis=1)[:, group_ends]
+    below = np.concatenate([np.zeros((len(weights), 1)), cumulative[:, :-1]], axis=1)
+    within = cumulative - below
+    wins = (positive_weights * (below + 0.5 * within)[:, group]).sum(axis=1)
+    return _ratio(wins, positive_weights.sum(axis=1) * negative_weights.sum(axis=1))
+
+
+def compute_metrics(weights, y_true, labels, scores=None):
+    """
+    Returns (metrics, counts) of every source for every row of weights; sources with scores
+    (a column of scores that is not all NaN) get their ROC AUC from the scores.
+    """
+    counts = confusion_counts(weights, y_true, labels)
+    metrics = metrics_from_counts(counts)
+    if scores is not None:
+        for source in range(scores.shape[1]):
+            if not np.isnan(scores[:, source]).all():
+                metrics['ROC AUC'][:, source] = weighted_auc(weights, y_true, scores[:, source])
+    return metrics, counts
+
+
+# --- Bootstrap ---
+
+_DATA = {}
+
+
+def _init_worker(y_true, labels, scores):
+    # The matrices are sent once per worker instead of once per chunk
+    _DATA['y_true'], _DATA['labels'], _DATA['scores'] = y_true, labels, scores
+
+
+def bootstrap_chunk(seed, n_replicates):
+    """
+    Metrics of n_replicates bootstrap resamples of the rows: the resampling counts of each
+    replicate are its row weights. Returns {metric: (n_replicates, n_sources)}.
+    """
+    y_true, labels, scores = _DATA['y_true'], _DATA['labels'], _DATA['scores']
+    n_rows = len(y_true)
+    draws = np.random.default_rng(seed).integers(0, n_rows, size=(n_replicates, n_rows))
+    offsets = np.arange(n_replicates)[:, None] * n_rows
+    weights = np.bincount((draws + offsets).ravel(), minlength=n_replicates * n_rows).reshape(n_replicates, n_rows)
+    metrics, _ = compute_metrics(weights, y_true, labels, scores)
+    return metrics
+
+
+def bootstrap(y_true, labels, scores=None, n_bootstrap=1000, n_jobs=1, seed=0):
+    """
+    Returns {metric: (n_bootstrap, n_sources)} of the bootstrap replicates, computed in chunks of
+    CHUNK_REPLICATES across n_jobs processes.
+    """
+    sizes = [min(CHUNK_REPLICATES, n_bootstrap - start) for start in range(0, n_bootstrap, CHUNK_REPLICATES)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    if n_jobs > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(min(n_jobs, len(sizes)), initializer=_init_worker,
+                                 initargs=(y_true, labels, scores)) as executor:
+            chunks = list(executor.map(bootstrap_chunk, seeds, sizes))
+    else:
+        _init_worker(y_true, labels, scores)
+        chunks = [bootstrap_chunk(chunk_seed, size) for chunk_seed, size in zip(seeds, sizes)]
+    return {metric: np.concatenate([chunk[metric] for chunk in chunks]) for metric in METRICS}
+
+
+def evaluate(y_true, labels, names, scores=None, n_bootstrap=1000, confidence=0.95, n_jobs=1, seed=0):
+    """
+    Evaluates every source (column of labels, named by names) against y_true.
+
+    Returns a DataFrame indexed by source with METRICS, the number of rows with a prediction (N),
+    the confusion counts and, if n_bootstrap > 0, the '<metric> CI low' / '<metric> CI high'
+    percentile bootstrap interval of each metric.
+    """
+    y_true = np.asarray(y_true, dtype=np.int8)
+    labels = np.asarray(labels, dtype=np.int8)
+    scores = None if scores is None else np.asarray(scores, dtype=np.float64)
+    metrics, counts = compute_metrics(np.ones((1, len(y_true)), dtype=np.float32), y_true, labels, scores)
+
+    report = pd.DataFrame({metric: metrics[metric][0] for metric in METRICS}, index=pd.Index(names))
+    report['N'] = (labels != MISSING).sum(axis=0)
+    for name in COUNTS:
+        report[name] = counts[name][0].astype(np.int64)
+
+    if n_bootstrap > 0:
+        replicates = bootstrap(y_true, labels, scores, n_bootstrap, n_jobs, seed)
+        tail = (1 - confidence) / 2 * 100
+        for metric in METRICS:
+            with warnings.catch_warnings():
+                # Metrics undefined in every replicate (e.g. recall without positives) stay NaN
+                warnings.simplefilter('ignore', RuntimeWarning)
+                low, high = np.nanpercentile(replicates[metric], [tail, 100 - tail], axis=0)
+            report[f'{metric} CI low'] = low
+            report[f'{metric} CI high'] = high
+    return report
+
+
+# --- Sources ---
+
+def model_sources(store, models_dir, chunk_size=65536):
+    """
+    Scores the store's design matrix with every model of models_dir.
+    Returns {display name: (labels, probability of the last class or None)}.
+    """
+    registry = ModelRegistry(models_dir)
+    registry.reload()
+    sources = {}
+    for name, plan in registry.models.items():
+        labels = np.empty(store.n_rows, dtype=np.int8)
+        scores = np.full(store.n_rows, np.nan)
+        for start in range(0, store.n_rows, chunk_size):
+            chunk = np.ascontiguousarray(store.features[start:start + chunk_size], dtype=plan.input_dtype)
+            predictions, probabilities = plan.run(chunk)
+            labels[start:start + chunk_size] = predictions
+            if probabilities is not None:
+                scores[start:start + chunk_size] = probabilities[:, -1]
+        sources[name] = (labels, scores if plan.has_probabilities else None)
+    return sources
+
+
+def load_sources(store, prediction_sets, models_dir=None):
+    """
+    Returns (names, labels (n_rows, n_sources), scores (n_rows, n_sources), NaN for label-only sources).
+    """
+    names = list(prediction_sets)
+    labels = [store.label_matrix(names)]
+    scores = [np.full((store.n_rows, len(names)), np.nan)]
+    if models_dir:
+        if store.features is None:
+            raise ValueError("The store has no design matrix: models cannot be scored.")
+        for name, (model_labels, model_scores) in model_sources(store, models_dir).items():
+            names.append(name)
+            labels.append(model_labels[:, None])
+            scores.append((model_scores if model_scores is not None else np.full(store.n_rows, np.nan))[:, None])
+    return names, np.concatenate(labels, axis=1), np.concatenate(scores, axis=1)
+
+
+def test_positions(store, input_file):
+    """
+    Store rows of the test split of train_export.py (the rows the notebook evaluates the models on).
+    """
+    X, y = load_dataset(input_file)
+    _, X_test, _, _ = split_dataset(X, y)
+    return np.sort(store.positions(X_test.index))
+
+
+# --- Reports ---
+
+def _interval(row, metric):
+    if f'{metric} CI low' not in row or math.isnan(row[metric]):
+        return f"{row[metric]:.3f}"
+    return f"{row[metric]:.3f} [{row[f'{metric} CI low']:.3f}, {row[f'{metric} CI high']:.3f}]"
+
+
+def write_report(report_file, report, description):
+    """
+    Writes the combined Markdown report: one table of metrics (with intervals) and one of counts.
+    """
+    lines = [f"# Evaluation report", "", description, "",
+             "| Source | N | " + " | ".join(METRICS) + " |",
+             "|---|---:|" + "---:|" * len(METRICS)]
+    for name, row in report.iterrows():
+        lines.append(f"| {name} | {int(row['N'])} | " + " | ".join(_interval(row, metric) for metric in METRICS) + " |")
+    lines += ["", "| Source | " + " | ".join(COUNTS) + " |", "|---|" + "---:|" * len(COUNTS)]
+    for name, row in report.iterrows():
+        lines.append(f"| {name} | " + " | ".join(str(int(row[count])) for count in COUNTS) + " |")
+    with open(report_file, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def update_performance(performance_file, report):
+    """
+    Writes Accuracy, Recall and ROC AUC of every source into an existing tuned_model_performance.csv,
+    keeping its other rows, as train_export.write_reports().
+    """
+    performance = pd.read_csv(performance_file, index_col=0) if os.path.exists(performance_file) else pd.DataFrame()
+    for name, row in report.iterrows():
+        performance.loc[name, METRICS[:3]] = row[METRICS[:3]].to_numpy(dtype=np.float64)
+    performance.to_csv(performance_file, index=True)
+
+
+def plot_confusion_matrices(plot_file, report):
+    """
+    Saves the confusion matrices of all the sources side by side in one figure.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    n_columns = min(4, len(report))
+    n_rows = math.ceil(len(report) / n_columns)
+    figure, axes = plt.subplots(n_rows, n_columns, figsize=(3.5 * n_columns, 3.2 * n_rows), squeeze=False)
+    for axis, (name, row) in zip(axes.ravel(), report.iterrows()):
+        matrix = np.array([[row['TN'], row['FP']], [row['FN'], row['TP']]])
+        axis.imshow(matrix, cmap='Blues')
+        for (i, j), value in np.ndenumerate(matrix):
+            axis.text(j, i, str(int(value)), ha='center', va='center',
+                      color='white' if value > matrix.max() / 2 else 'black')
+        axis.set_xticks([0, 1], ['Not Sick', 'Sick'])
+        axis.set_yticks([0, 1], ['Not Sick', 'Sick'])
+        axis.set_xlabel('Predicted')
+        axis.set_ylabel('True')
+        axis.set_title(name, fontsize=10)
+    for axis in axes.ravel()[len(report):]:
+        axis.axis('off')
+    figure.tight_layout()
+    figure.savefig(plot_file, dpi=150)
+    plt.close(figure)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate every prediction source against the ground truth at once.")
+    parser.add_argument('--input-file', default=DEFAULT_INPUT_FILE, help="Cleaned dataset (heart_disease_clean.csv)")
+    parser.add_argument('--sources', nargs='+', default=None,
+                        help="Prediction sets of the data store to evaluate (default: all of them)")
+    parser.add_argument('--models-dir', default=None, help="Also evaluate every model of this folder")
+    parser.add_argument('--subset', choices=['test', 'all'], default='test',
+                        help="Evaluate on the test split of train_export.py (default) or on all the patients, "
+                             "training rows of the models included")
+    parser.add_argument('--n-bootstrap', type=int, default=1000, help="Bootstrap replicates, 0 to skip the intervals")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Processes computing the bootstrap (default: all cores)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the bootstrap resampling")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help=f"Folder of {PERFORMANCE_FILE} and {REPORT_FILE}")
+    parser.add_argument('--update-performance', default=None, metavar='CSV',
+                        help="Also write Accuracy, Recall and ROC AUC into this tuned_model_performance.csv")
+    parser.add_argument('--plot', default=None, metavar='PNG', help="Save all the confusion matrices in one figure")
+    args = parser.parse_args()
+    if not 0 < args.confidence < 1:
+        parser.error("--confidence must be between 0 and 1.")
+
+    store = open_store(args.input_file)
+    prediction_sets = args.sources if args.sources is not None else store.prediction_names()
+    names, labels, scores = load_sources(store, prediction_sets, args.models_dir)
+    if not names:
+        sys.exit("Nothing to evaluate: the data store has no prediction sets and no --models-dir was given.")
+    y_true = np.asarray(store.column(TARGET_COLUMN), dtype=np.int8)
+    if args.subset == 'test':
+        positions = test_positions(store, args.input_file)
+        y_true, labels, scores = y_true[positions], labels[positions], scores[positions]
+
+    started = time.perf_counter()
+    report = evaluate(y_true, labels, names, scores, args.n_bootstrap, args.confidence, args.n_jobs, args.seed)
+    if args.subset == 'all' and args.models_dir:
+        print("Warning: --subset all scores the models on their own training rows, their metrics are optimistic.")
+    print(f"Evaluated {len(names)} sources on {len(y_true)} patients with {args.n_bootstrap} bootstrap "
+          f"replicates in {time.perf_counter() - started:.2f}s")
+    with pd.option_context('display.width', 160, 'display.max_columns', 20):
+        print(report[METRICS + ['N']].round(3))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    performance_file = os.path.join(args.output_dir, PERFORMANCE_FILE)
+    report.to_csv(performance_file, index=True)
+    report_file = os.path.join(args.output_dir, REPORT_FILE)
+    subset = 'test split' if args.subset == 'test' else 'all rows, including the training rows of the models'
+    description = (
+        f"{len(y_true)} patients ({subset}), generated {datetime.now(timezone.utc).isoformat(timespec='seconds')}. "
+        + (f"Intervals: {args.confidence:.0%} percentile bootstrap, {args.n_bootstrap} replicates."
+           if args.n_bootstrap > 0 else "No confidence intervals.")
+    )
+    write_report(report_file, report, description)
+    print(f"Saved '{performance_file}' and '{report_file}'.")
+    if args.update_performance:
+        update_performance(args.update_performance, report)
+        print(f"Updated '{args.update_performance}'.")
+    if args.plot:
+        plot_confusion_matrices(args.plot, report)
+        print(f"Saved '{args.plot}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,449 @@
+"""
+Reproducible training and ONNX export of the heart disease classifiers.
+
+Replaces the export cells of notebooks/heart-data-machine-learning.ipynb: trains the
+one-hot encoder + StandardScaler + classifier pipelines on heart_disease_clean.csv (same
+split and grids as the notebook), then exports each one as a single ONNX graph that
+contains the scaler and the classifier. For Logistic Regression the scaler is folded
+into the coefficients, so the graph is one LinearClassifier node. The KNN model is also
+written as a KD-tree index over its training rows (<name>.knn.npz, see src/flask/knn_index.py),
+and the background set of the /explain endpoint is saved next to the models
+(explain_background.npz, see src/flask/explain.py).
+
+The graph input is the encoded feature layout of the API ('data' rows, encoding.FEATURE_NAMES),
+which the serving encoder (encoding.py) produces from raw patient records with a vectorized
+lookup. The parity check runs the raw test split through that encoder and the exported
+graph, and compares the result with the scikit-learn pipeline. The encoder, scaler and
+classifier are therefore verified end to end before a model is written to models/.
+
+Example:
+    python src/training/train_export.py
+    python src/training/train_export.py --models knn --quantize fp16 --output-dir /tmp/models
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+import pandas as pd
+from onnx import TensorProto, helper, numpy_helper
+from skl2onnx import to_onnx
+from skl2onnx.common.data_types import FloatTensorType
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, recall_score, roc_auc_score
+from sklearn.model_selection import GridSearchCV, train_test_split
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'flask'))
+
+from data_store import open_store  # noqa: E402
+from encoding import CATEGORICAL_LEVELS, N_FEATURES, NUMERIC_COLUMNS, RAW_COLUMNS, encode_columns  # noqa: E402
+from explain import BACKGROUND_FILE, save_background  # noqa: E402
+from inference import InferencePlan  # noqa: E402
+from knn_index import INDEX_SUFFIX, IndexedKNNPlan, save_index  # noqa: E402
+
+DEFAULT_INPUT_FILE = os.path.join(ROOT, 'data', 'heart_disease_clean.csv')
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT, 'models')
+MODEL_STATS = 'tuned_model_performance.csv'
+MANIFEST_FILE = 'models.json'
+TARGET_COLUMN = 'sick'
+TARGET_OPSET = {'': 15, 'ai.onnx.ml': 3}
+
+# Model key -> (display name, ONNX file, estimator, GridSearchCV grid); grids as in the notebook
+MODEL_SPECS = {
+    'knn': (
+        'K-Nearest Neighbors', 'best_knn_model.onnx', KNeighborsClassifier(),
+        {'n_neighbors': [3, 5, 7, 9, 11], 'weights': ['uniform', 'distance'], 'metric': ['euclidean', 'manhattan']},
+    ),
+    'log': (
+        'Logistic Regression', 'best_log_model.onnx', LogisticRegression(random_state=42, max_iter=1000),
+        [
+            {'solver': ['liblinear'], 'penalty': ['l1', 'l2'], 'C': [0.001, 0.01, 0.1, 1, 10, 100]},
+            {'solver': ['lbfgs'], 'penalty': ['l2'], 'C': [0.001, 0.01, 0.1, 1, 10, 100]},
+        ],
+    ),
+}
+
+
+# --- Training ---
+
+def load_dataset(input_file):
+    """
+    Returns the raw patient fields (categoricals as strings) and the 0/1 target, read from the
+    columnar store of input_file (built on first use, see src/flask/data_store.py).
+    """
+    df = open_store(input_file).frame(RAW_COLUMNS + [TARGET_COLUMN])
+    X = df[RAW_COLUMNS].copy()
+    for column in CATEGORICAL_LEVELS:
+        X[column] = X[column].astype(str)
+    return X, df[TARGET_COLUMN].astype(int)
+
+
+def split_dataset(X, y):
+    """
+    Same train/test split as the notebook: 70/30, stratified, random_state=42.
+    """
+    return train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
+
+
+def make_pipeline(estimator):
+    """
+    One-hot encoder (levels and column order of encoding.py) + StandardScaler + classifier.
+    """
+    encoder = ColumnTransformer([
+        ('cat', OneHotEncoder(categories=list(CATEGORICAL_LEVELS.values()), handle_unknown='ignore',
+                              sparse_output=False), list(CATEGORICAL_LEVELS)),
+        ('num', 'passthrough', NUMERIC_COLUMNS),
+    ])
+    return Pipeline([('encode', encoder), ('scale', StandardScaler()), ('model', estimator)])
+
+
+def train(estimator, grid, X_train, y_train, n_jobs=-1):
+    grid = [{f"model__{name}": values for name, values in params.items()}
+            for params in (grid if isinstance(grid, list) else [grid])]
+    search = GridSearchCV(make_pipeline(estimator), grid, cv=5, scoring='recall', n_jobs=n_jobs)
+    search.fit(X_train, y_train)
+    return search
+
+
+def evaluate(pipeline, X_test, y_test):
+    y_pred = pipeline.predict(X_test)
+    return {
+        "Accuracy": accuracy_score(y_test, y_pred),
+        "Recall": recall_score(y_test, y_pred),
+        "ROC AUC": roc_auc_score(y_test, pipeline.predict_proba(X_test)[:, 1]),
+    }
+
+
+# --- Export ---
+
+def fold_scaler(scaler, model):
+    """
+    Returns a copy of a linear model whose coefficients absorb the StandardScaler:
+    w . (x - mean) / scale + b == (w / scale) . x + (b - (w / scale) . mean)
+    """
+    folded = copy.deepcopy(model)
+    coef = model.coef_ / scaler.scale_
+    folded.coef_ = coef
+    folded.intercept_ = model.intercept_ - coef @ scaler.mean_
+    return folded
+
+
+def to_fused_onnx(pipeline):
+    """
+    Converts the scaler + classifier of a trained pipeline into one ONNX graph over the encoded features.
+    """
+    scaler, model = pipeline.named_steps['scale'], pipeline.named_steps['model']
+    if isinstance(model, LogisticRegression):
+        fused, options = fold_scaler(scaler, model), None
+    else:
+        fused = Pipeline([('scale', scaler), ('model', model)])
+        # CDist computes all the distances in one native kernel instead of a Scan loop; ONNX Runtime
+        # only implements it for the euclidean metric (manhattan fails when the session is created)
+        use_cdist = isinstance(model, KNeighborsClassifier) and model.effective_metric_ == 'euclidean'
+        options = {id(model): {'optim': 'cdist'}} if use_cdist else None
+    onnx_model = to_onnx(
+        fused, initial_types=[('input', FloatTensorType([None, N_FEATURES]))],
+        target_opset=TARGET_OPSET, options=options,
+    )
+    if isinstance(model, KNeighborsClassifier) and model.weights == 'distance':
+        fix_distance_weights(onnx_model)
+    return onnx_model
+
+
+def fix_distance_weights(model):
+    """
+    skl2onnx computes the 'distance' weights as 1 / max(d, 1e-6) on the negated top-k distances, so
+    every weight is clamped to 1e6 and the votes come out uniform. An Abs before the Max restores
+    the distances (both signs occur depending on the distance kernel) and the weights of scikit-learn.
+    """
+    graph = model.graph
+    reciprocal_inputs = {node.input[0] for node in graph.node if node.op_type == 'Reciprocal'}
+    nodes = []
+    for node in graph.node:
+        if node.op_type == 'Max' and node.output[0] in reciprocal_inputs:
+            distances = f"{node.name}_abs"
+            nodes.append(helper.make_node('Abs', [node.input[0]], [distances], name=distances))
+            node.input[0] = distances
+        nodes.append(node)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    return model
+
+
+def optimize(model_file):
+    """
+    Applies ONNX Runtime's portable (basic) graph optimizations offline: constant folding and
+    redundant node elimination are done once here instead of at every session creation.
+    """
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    sess_options.optimized_model_filepath = model_file
+    ort.InferenceSession(model_file, sess_options, providers=['CPUExecutionProvider'])
+
+
+def compress_initializers_fp16(model, min_elements=64):
+    """
+    Stores the large float32 initializers (e.g. the KNN training points) as float16, each
+    followed by a Cast back to float32: the file is about half the size and the arithmetic
+    stays in float32, which is what ONNX Runtime's CPU kernels (Scaler, CDist, ...) support.
+    """
+    graph = model.graph
+    casts = []
+    for initializer in list(graph.initializer):
+        if initializer.data_type != TensorProto.FLOAT:
+            continue
+        array = numpy_helper.to_array(initializer)
+        if array.size < min_elements:
+            continue
+        half = numpy_helper.from_array(array.astype(np.float16), f"{initializer.name}_fp16")
+        graph.initializer.remove(initializer)
+        graph.initializer.append(half)
+        casts.append(helper.make_node(
+            'Cast', [half.name], [initializer.name], to=TensorProto.FLOAT, name=f"{initializer.name}_cast"
+        ))
+    for cast in reversed(casts):
+        graph.node.insert(0, cast)
+    return model
+
+
+def quantize(model_file, mode):
+    """
+    int8: dynamic quantization of the MatMul/Gemm weights (onnxruntime.quantization).
+    fp16: float16 storage of the large weights (see compress_initializers_fp16).
+    ONNX-ML operators (LinearClassifier, Scaler) keep their coefficients as float32 attributes,
+    so none of the MODEL_SPECS graphs has weights that int8 can quantize: a ValueError is raised
+    when the graph comes out unchanged, instead of recording a quantization that did not happen.
+    """
+    if mode == 'int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        op_types = sorted(node.op_type for node in onnx.load(model_file).graph.node)
+        quantize_dynamic(model_file, model_file, weight_type=QuantType.QInt8)
+        if sorted(node.op_type for node in onnx.load(model_file).graph.node) == op_types:
+            raise ValueError("int8 quantization left the graph unchanged (no MatMul/Gemm weights)")
+    elif mode == 'fp16':
+        onnx.save(compress_initializers_fp16(onnx.load(model_file)), model_file)
+
+
+def check_parity(pipeline, plan, X_test, atol):
+    """
+    Scores the raw test split with the scikit-learn pipeline and with the serving path
+    (encoding.py + the exported plan) and compares labels and probabilities.
+    """
+    expected_labels = pipeline.predict(X_test)
+    expected_probabilities = pipeline.predict_proba(X_test)
+
+    input_array = encode_columns({column: X_test[column].tolist() for column in RAW_COLUMNS}, len(X_test))
+    labels, probabilities = plan.run(input_array)
+
+    report = {
+        "rows": len(X_test),
+        "label_agreement": float(np.mean(labels == expected_labels)),
+        "max_probability_diff": float(np.max(np.abs(probabilities - expected_probabilities))),
+    }
+    report["passed"] = report["max_probability_diff"] <= atol and report["label_agreement"] == 1.0
+    return report
+
+
+def publish(temp_file, output_file):
+    """
+    Renames temp_file to output_file. NamedTemporaryFile creates files with mode 0600, so the
+    permissions of a regular file (0666 minus the umask) are restored first: the published file
+    must stay readable by a server running under another user.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp_file, 0o666 & ~umask)
+    os.replace(temp_file, output_file)
+
+
+def export(pipeline, output_file, quantization=None, atol=1e-4, X_test=None):
+    """
+    Writes the fused graph to output_file once it passes the parity check. The file is built
+    under a temporary name and renamed, so a watching server never loads a half-written model.
+    Returns the parity report.
+    """
+    directory = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.onnx.tmp', delete=False) as file:
+        temp_file = file.name
+    try:
+        onnx.save(to_fused_onnx(pipeline), temp_file)
+        optimize(temp_file)
+        if quantization:
+            quantize(temp_file, quantization)
+        report = check_parity(pipeline, InferencePlan.from_file(temp_file), X_test, atol)
+        report["size_bytes"] = os.path.getsize(temp_file)
+        if report["passed"]:
+            publish(temp_file, output_file)
+        return report
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def export_knn_index(pipeline, X_train, y_train, output_file, atol=1e-4, X_test=None):
+    """
+    Writes the KD-tree index of a trained KNN pipeline (knn_index.py): the scaled training
+    rows, their labels, the scaler and the hyperparameters. Same parity check and atomic
+    rename as export(); returns the parity report.
+    """
+    scaler, model = pipeline.named_steps['scale'], pipeline.named_steps['model']
+    directory = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=f"{INDEX_SUFFIX}.tmp", delete=False) as file:
+        temp_file = file.name
+    try:
+        with open(temp_file, 'wb') as file:
+            save_index(
+                file, pipeline[:-1].transform(X_train), np.asarray(y_train), model.classes_,
+                model.n_neighbors, model.weights, model.metric, scaler.mean_, scaler.scale_,
+            )
+        report = check_parity(pipeline, IndexedKNNPlan.from_file(temp_file), X_test, atol)
+        report["size_bytes"] = os.path.getsize(temp_file)
+        if report["passed"]:
+            publish(temp_file, output_file)
+        return report
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def export_background(X_train, output_dir):
+    """
+    Writes the background set of the /explain endpoint (explain.py): a k-means summary of the
+    encoded training rows, shared by all the models of output_dir.
+    """
+    features = encode_columns({column: X_train[column].tolist() for column in RAW_COLUMNS}, len(X_train))
+    background_file = os.path.join(output_dir, BACKGROUND_FILE)
+    with tempfile.NamedTemporaryFile(dir=output_dir, suffix='.npz.tmp', delete=False) as file:
+        save_background(file, features)
+    publish(file.name, background_file)
+    print(f"Explanation background saved to '{background_file}'.")
+
+
+def write_reports(output_dir, results):
+    """
+    Updates tuned_model_performance.csv and the models.json manifest with the exported models.
+    """
+    stats_file = os.path.join(output_dir, MODEL_STATS)
+    performance = pd.read_csv(stats_file, index_col=0) if os.path.exists(stats_file) else pd.DataFrame()
+    for name, result in results.items():
+        performance.loc[name, list(result["metrics"])] = list(result["metrics"].values())
+    performance.to_csv(stats_file, index=True)
+
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    # KD-tree indexes after the ONNX models, which keep their place at the top of the manifest
+    ordered = sorted(results.items(), key=lambda item: item[1]["file"].endswith(INDEX_SUFFIX))
+    for name, result in ordered:
+        entry = manifest.setdefault(result["file"], {"name": name})
+        entry.update({
+            "description": f"{result['estimator']} ({', '.join(f'{k}={v}' for k, v in result['params'].items())}) "
+                           f"tuned for recall",
+            "trained_at": result["trained_at"],
+            "params": result["params"],
+            "preprocessing": "one-hot encoding (server) + StandardScaler (in "
+                             f"{'index' if result['file'].endswith(INDEX_SUFFIX) else 'graph'})",
+            "quantization": result["quantization"] or "none",
+            "cv_recall": result["cv_recall"],
+        })
+    with open(manifest_file, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+        file.write('\n')
+
+
+def export_trained(key, pipeline, params, cv_recall, X_train, y_train, X_test, y_test, output_dir,
+                   quantization=None, atol=1e-4):
+    """
+    Exports a trained pipeline of MODEL_SPECS[key] to output_dir (plus the KD-tree index for KNN).
+    Returns ({model name: result} for write_reports(), whether a parity check failed).
+    """
+    name, file_name, estimator, _ = MODEL_SPECS[key]
+    output_file = os.path.join(output_dir, file_name)
+    try:
+        report = export(pipeline, output_file, quantization, atol, X_test)
+    except ValueError as error:
+        print(f"  ❌ {quantization} export failed ({error}): '{output_file}' was not written.")
+        return {}, True
+    print(f"  parity on {report['rows']} test rows: label agreement {report['label_agreement']:.2%}, "
+          f"max probability diff {report['max_probability_diff']:.2e}, {report['size_bytes']} bytes")
+    if not report["passed"]:
+        print(f"  ❌ parity check failed (atol {atol}): '{output_file}' was not written.")
+        return {}, True
+
+    metrics = evaluate(pipeline, X_test, y_test)
+    print(f"  ✅ saved to '{output_file}': " + ', '.join(f"{metric} {value:.3f}" for metric, value in metrics.items()))
+    results = {name: {
+        "file": file_name, "estimator": type(estimator).__name__, "metrics": metrics, "params": params,
+        "cv_recall": float(cv_recall), "quantization": quantization,
+        "trained_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }}
+
+    if isinstance(estimator, KNeighborsClassifier):
+        # Same model served from a KD-tree over the training rows (knn_index.py)
+        index_file = os.path.splitext(output_file)[0] + INDEX_SUFFIX
+        report = export_knn_index(pipeline, X_train, y_train, index_file, atol, X_test)
+        print(f"  KD-tree index parity: label agreement {report['label_agreement']:.2%}, "
+              f"max probability diff {report['max_probability_diff']:.2e}, {report['size_bytes']} bytes")
+        if not report["passed"]:
+            print(f"  ❌ parity check failed (atol {atol}): '{index_file}' was not written.")
+            return results, True
+        print(f"  ✅ saved to '{index_file}'")
+        results[f"{name} (KD-tree)"] = dict(results[name], file=os.path.basename(index_file), quantization=None)
+    return results, False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the classifiers and export them as fused ONNX graphs.")
+    parser.add_argument('--input-file', default=DEFAULT_INPUT_FILE, help="Cleaned dataset (heart_disease_clean.csv)")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help="Folder of the ONNX models and their metrics")
+    parser.add_argument('--models', nargs='+', choices=sorted(MODEL_SPECS), default=sorted(MODEL_SPECS))
+    parser.add_argument('--quantize', choices=['int8', 'fp16'], default=None, help="Reduced-precision export (int8 needs MatMul/Gemm weights: "
+                             "only fp16 applies to the knn and log models)")
+    parser.add_argument('--atol', type=float, default=None,
+                        help="Max probability difference allowed by the parity check (default: 1e-4, 1e-2 quantized)")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Parallel jobs of the grid search")
+    args = parser.parse_args()
+    atol = args.atol if args.atol is not None else (1e-2 if args.quantize else 1e-4)
+
+    X, y = load_dataset(args.input_file)
+    X_train, X_test, y_train, y_test = split_dataset(X, y)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = {}
+    failed = False
+    for key in args.models:
+        name, _, estimator, grid = MODEL_SPECS[key]
+        started = time.perf_counter()
+        search = train(estimator, grid, X_train, y_train, n_jobs=args.n_jobs)
+        params = {param.split('__', 1)[1]: value for param, value in search.best_params_.items()}
+        print(f"{name}: best params {params}, CV recall {search.best_score_:.3f} "
+              f"({time.perf_counter() - started:.1f}s)")
+
+        exported, export_failed = export_trained(
+            key, search.best_estimator_, params, search.best_score_, X_train, y_train, X_test, y_test,
+            args.output_dir, args.quantize, atol,
+        )
+        results.update(exported)
+        failed = failed or export_failed
+
+    if results:
+        write_reports(args.output_dir, results)
+        export_background(X_train, args.output_dir)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Parallel hyperparameter search for the heart disease classifiers, with cached folds.
+
+Runs the grids of train_export.MODEL_SPECS (the notebook grids, scored on recall) without
+GridSearchCV: every (params, fold) fit is an independent job spread across a process pool,
+and its scores are stored in an on-disk cache keyed by the hash of the data, the model,
+the params and the fold. A rerun, an extended grid or an interrupted search only fits the
+jobs that are not in the cache yet.
+
+With --halving the grid is searched by successive halving: all candidates are
+cross-validated on a small stratified subsample of the training split, and only the best
+1/factor go on to a subsample factor times larger, until the survivors are scored on the
+whole training split. The winners are refitted on the training split and exported by
+train_export.py (parity check, KD-tree index, tuned_model_performance.csv and models.json).
+
+Example:
+    python src/training/tune.py --n-jobs 8
+    python src/training/tune.py --models knn --halving --factor 3 --min-resources 100
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, recall_score, roc_auc_score
+from sklearn.model_selection import ParameterGrid, StratifiedKFold, train_test_split
+
+from train_export import (DEFAULT_INPUT_FILE, DEFAULT_OUTPUT_DIR, MODEL_SPECS, ROOT, export_background,
+                          export_trained, load_dataset, make_pipeline, split_dataset, write_reports)
+
+DEFAULT_CACHE_FILE = os.path.join(ROOT, 'data', 'tuning_cache.sqlite')
+N_SPLITS = 5
+SCORES = ('recall', 'accuracy', 'roc_auc')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folds (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    scores TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def data_hash(X, y):
+    """
+    Content hash of a dataset (values and row order), computed without a Python loop.
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    digest.update(np.asarray(y, dtype=np.int64).tobytes())
+    digest.update(','.join(X.columns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def fold_key(data_key, model_key, params, fold, n_splits):
+    description = {
+        "data": data_key, "model": model_key, "params": params, "fold": fold, "n_splits": n_splits,
+        "sklearn": sklearn.__version__,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class FoldCache:
+    """
+    SQLite store of {hash(data, model, params, fold): fold scores}, with hit/miss counters for the current run.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._connection = sqlite3.connect(db_file)
+        # WAL keeps the file consistent if a run is killed mid-write
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Returns {key: scores} for the folds already computed, counting hits and misses.
+        """
+        keys = list(keys)
+        scores = {}
+        # SQLite limits the number of bound parameters per statement
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._connection.execute(
+                f"SELECT key, scores FROM folds WHERE key IN ({','.join('?' * len(batch))})", batch
+            )
+            for key, value in rows:
+                scores[key] = json.loads(value)
+        self.hits += len(scores)
+        self.misses += len(keys) - len(scores)
+        return scores
+
+    def put(self, key, model_key, params, scores):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO folds (key, model, params, scores, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, model_key, json.dumps(params, sort_keys=True, default=str), json.dumps(scores), time.time())
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+# --- Fold jobs (run in the worker processes) ---
+
+_DATA = {}
+
+
+def _init_worker(X, y):
+    # The dataset is sent once per worker instead of once per job
+    _DATA['X'], _DATA['y'] = X, y
+
+
+def fit_fold(model_key, params, train_index, test_index):
+    """
+    Fits one candidate on one fold and returns its scores (NaN, and the error, if the fit fails).
+    """
+    X, y = _DATA['X'], _DATA['y']
+    started = time.perf_counter()
+    try:
+        estimator = clone(MODEL_SPECS[model_key][2]).set_params(**params)
+        pipeline = make_pipeline(estimator).fit(X.iloc[train_index], y.iloc[train_index])
+        X_test, y_test = X.iloc[test_index], y.iloc[test_index]
+        y_pred = pipeline.predict(X_test)
+        scores = {
+            "recall": recall_score(y_test, y_pred),
+            "accuracy": accuracy_score(y_test, y_pred),
+            "roc_auc": roc_auc_score(y_test, pipeline.predict_proba(X_test)[:, 1]),
+        }
+    except Exception as e:
+        return {**{score: float('nan') for score in SCORES}, "error": f"{type(e).__name__}: {e}"}
+    scores["fit_seconds"] = time.perf_counter() - started
+    return scores
+
+
+# --- Search ---
+
+class TuningRunner:
+    """
+    Cross-validates candidates of one model on (a subsample of) the training split, reusing
+    the cached folds and sending the missing ones to the process pool.
+    """
+
+    def __init__(self, X, y, cache=None, n_jobs=1, n_splits=N_SPLITS):
+        self.X, self.y = X.reset_index(drop=True), y.reset_index(drop=True)
+        self.cache = cache
+        self.n_splits = n_splits
+        self.fitted = 0
+        n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+        self._executor = None
+        if n_jobs > 1:
+            self._executor = ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(self.X, self.y))
+        else:
+            _init_worker(self.X, self.y)
+
+    def subsample(self, n_rows):
+        """
+        Row positions of a stratified subsample of n_rows training rows (all of them if n_rows >= len).
+        """
+        if n_rows >= len(self.y):
+            return np.arange(len(self.y))
+        positions, _ = train_test_split(np.arange(len(self.y)), train_size=n_rows, stratify=self.y, random_state=0)
+        return np.sort(positions)
+
+    def cross_validate(self, model_key, candidates, n_rows):
+        """
+        Returns [{params, mean and std of each score}] for the candidates, scored with stratified
+        k-fold (no shuffling, as GridSearchCV) on a subsample of n_rows training rows.
+        """
+        positions = self.subsample(n_rows)
+        X, y = self.X.iloc[positions], self.y.iloc[positions]
+        folds = [(positions[train], positions[test])
+                 for train, test in StratifiedKFold(self.n_splits).split(X, y)]
+        data_key = data_hash(X, y)
+
+        keys = {(index, fold): fold_key(data_key, model_key, params, fold, self.n_splits)
+                for index, params in enumerate(candidates) for fold in range(len(folds))}
+        scores = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(keys.values())
+            scores = {job: cached[key] for job, key in keys.items() if key in cached}
+        missing = [job for job in keys if job not in scores]
+        print(f"  {len(candidates)} candidates x {len(folds)} folds on {len(positions)} rows: "
+              f"{len(keys) - len(missing)} cached, {len(missing)} to fit")
+
+        def store(job, fold_scores):
+            scores[job] = fold_scores
+            self.fitted += 1
+            if "error" in fold_scores:
+                print(f"  ⚠️ {candidates[job[0]]} fold {job[1]}: {fold_scores['error']}")
+            elif self.cache is not None:
+                self.cache.put(keys[job], model_key, candidates[job[0]], fold_scores)
+
+        if self._executor is None:
+            for job in missing:
+                store(job, fit_fold(model_key, candidates[job[0]], *folds[job[1]]))
+        else:
+            futures = {self._executor.submit(fit_fold, model_key, candidates[job[0]], *folds[job[1]]): job
+                       for job in missing}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+
+        results = []
+        for index, params in enumerate(candidates):
+            fold_scores = [scores[(index, fold)] for fold in range(len(folds))]
+            result = {"params": params, "n_rows": len(positions)}
+            for score in SCORES:
+                values = np.array([fold[score] for fold in fold_scores], dtype=np.float64)
+                result[f"mean_{score}"] = float(values.mean())
+                result[f"std_{score}"] = float(values.std())
+            results.append(result)
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def rank(results):
+    """
+    Sorts results by mean recall, best first; failed candidates last and ties in grid order, as GridSearchCV.
+    """
+    return sorted(results, key=lambda result: -result["mean_recall"] if not math.isnan(result["mean_recall"])
+                  else math.inf)
+
+
+def search(runner, model_key, halving=False, factor=3, min_resources=100):
+    """
+    Returns the ranked results of the last round: the whole grid on the full training split,
+    or the survivors of successive halving.
+    """
+    grid = MODEL_SPECS[model_key][3]
+    candidates = list(ParameterGrid(grid))
+    n_rows = len(runner.y)
+    if not halving:
+        return rank(runner.cross_validate(model_key, candidates, n_rows))
+
+    resources = min(max(min_resources, runner.n_splits * 2), n_rows)
+    while True:
+        results = rank(runner.cross_validate(model_key, candidates, resources))
+        if resources >= n_rows:
+            return results
+        candidates = [result["params"] for result in results[:max(1, math.ceil(len(results) / factor))]]
+        # A single survivor is scored directly on the whole training split
+        resources = n_rows if len(candidates) == 1 else min(resources * factor, n_rows)
+
+
+def print_leaderboard(results, top=5):
+    print(f"  {'mean recall':>12} {'std':>6} {'accuracy':>9} {'ROC AUC':>8}  params")
+    for result in results[:top]:
+        print(f"  {result['mean_recall']:>12.3f} {result['std_recall']:>6.3f} {result['mean_accuracy']:>9.3f} "
+              f"{result['mean_roc_auc']:>8.3f}  {result['params']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel, cached hyperparameter search and ONNX export.")
+    parser.add_argument('--input-file', default=DEFAULT_INPUT_FILE, help="Cleaned dataset (heart_disease_clean.csv)")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help="Folder of the ONNX models and their metrics")
+    parser.add_argument('--models', nargs='+', choices=sorted(MODEL_SPECS), default=sorted(MODEL_SPECS))
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Worker processes (default: one per core)")
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_FILE, help="SQLite cache of the fold results")
+    parser.add_argument('--no-cache', action='store_true', help="Fit every fold, without reading or writing the cache")
+    parser.add_argument('--halving', action='store_true', help="Successive halving instead of the full grid")
+    parser.add_argument('--factor', type=int, default=3, help="Halving: keep 1/factor of the candidates per round")
+    parser.add_argument('--min-resources', type=int, default=100, help="Halving: training rows of the first round")
+    parser.add_argument('--no-export', action='store_true', help="Only print the leaderboards")
+    parser.add_argument('--quantize', choices=['int8', 'fp16'], default=None, help="Reduced-precision export")
+    parser.add_argument('--atol', type=float, default=None,
+                        help="Max probability difference allowed by the parity check (default: 1e-4, 1e-2 quantized)")
+    args = parser.parse_args()
+    if args.factor < 2:
+        parser.error("--factor must be at least 2.")
+    atol = args.atol if args.atol is not None else (1e-2 if args.quantize else 1e-4)
+
+    X, y = load_dataset(args.input_file)
+    X_train, X_test, y_train, y_test = split_dataset(X, y)
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = None if args.no_cache else FoldCache(args.cache_file)
+    runner = TuningRunner(X_train, y_train, cache, args.n_jobs)
+
+    results = {}
+    failed = False
+    try:
+        for key in args.models:
+            name = MODEL_SPECS[key][0]
+            print(f"{name}:")
+            started = time.perf_counter()
+            ranked = search(runner, key, args.halving, args.factor, args.min_resources)
+            print_leaderboard(ranked)
+            best = ranked[0]
+            print(f"  best params {best['params']}, CV recall {best['mean_recall']:.3f} "
+                  f"({time.perf_counter() - started:.1f}s)")
+            if args.no_export:
+                continue
+
+            estimator = clone(MODEL_SPECS[key][2]).set_params(**best["params"])
+            pipeline = make_pipeline(estimator).fit(X_train, y_train)
+            exported, export_failed = export_trained(
+                key, pipeline, best["params"], best["mean_recall"], X_train, y_train, X_test, y_test,
+                args.output_dir, args.quantize, atol,
+            )
+            results.update(exported)
+            failed = failed or export_failed
+    finally:
+        runner.close()
+        if cache is not None:
+            print(f"\n{runner.fitted} folds fitted, {cache.hits} read from '{cache.db_file}'.")
+            cache.close()
+
+    if results:
+        write_reports(args.output_dir, results)
+        export_background(X_train, args.output_dir)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+FLASK_DIR = os.path.join(ROOT, 'src', 'flask')
+TRAINING_DIR = os.path.join(ROOT, 'src', 'training')
+MODEL_DIR = os.path.join(ROOT, 'models')
+
+# The server modules import each other as top-level modules, as when run from src/flask
+os.environ.setdefault('MODEL_PATH', MODEL_DIR + os.sep)
+os.environ.setdefault('MODEL_WATCH_INTERVAL', '0')
+sys.path.insert(0, FLASK_DIR)
+sys.path.insert(0, TRAINING_DIR)
+
+
+def make_clean_dataset(n_rows=240, seed=0):
+    """
+    Synthetic rows shaped like data/heart_disease_clean.csv (which is not shipped), with a
+    target that depends on a few fields so the models have something to learn.
+    """
+    import pandas as pd
+    from encoding import CATEGORICAL_LEVELS
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'id': np.arange(1, n_rows + 1)})
+    for column, levels in CATEGORICAL_LEVELS.items():
+        df[column] = rng.choice(levels, n_rows)
+    df['age'] = rng.integers(30, 80, n_rows)
+    df['blood_pressure_resting'] = rng.normal(130, 15, n_rows).round(1)
+    df['cholesterol'] = rng.normal(240, 40, n_rows).round(1)
+    df['max_heart_rate'] = rng.normal(140, 20, n_rows).round(1)
+    df['st_depression_exercise'] = rng.uniform(0, 4, n_rows).round(1)
+    df['major_vessels_colored'] = rng.integers(0, 4, n_rows)
+    risk = (df['age'] - 55) / 10 + df['st_depression_exercise'] - 2 + (df['chest_pain_type'] == 'asymptomatic')
+    df['sick'] = (risk + rng.normal(0, 0.5, n_rows)) > 0
+    return df
+
+
+@pytest.fixture
+def clean_csv(tmp_path):
+    """
+    Path of a synthetic heart_disease_clean.csv in a temporary folder.
+    """
+    csv_file = tmp_path / 'heart_disease_clean.csv'
+    make_clean_dataset().to_csv(csv_file, index=False)
+    return str(csv_file)
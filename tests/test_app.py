@@ -0,0 +1,42 @@
+import pytest
+
+import app as backend
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+@pytest.mark.parametrize('field', ['data', 'patients'])
+def test_predict_rejects_an_empty_batch(client, field):
+    response = client.post('/predict', json={"model_name": "Logistic Regression", field: []})
+    assert response.status_code == 400
+    assert 'empty' in response.get_json()["error"]
+
+
+PATIENT = {
+    "age": 63, "sex": "Male", "chest_pain_type": "typical angina", "blood_pressure_resting": 145.0,
+    "cholesterol": 233.0, "fasting_blood_sugar": True, "ecg_resting": "lv hypertrophy",
+    "max_heart_rate": 150.0, "exercise_induced_angina": False, "st_depression_exercise": 2.3,
+    "st_slope_type": "downsloping", "major_vessels_colored": 0.0, "thal_defect_type": "fixed defect",
+}
+
+
+@pytest.mark.parametrize('model_name', ["Logistic Regression", "K-Nearest Neighbors"])
+def test_predict_response_shape(client, model_name):
+    """
+    Probabilities are one array per patient in the order of 'classes' (they used to be
+    objects keyed by class, without 'classes').
+    """
+    response = client.post('/predict', json={"model_name": model_name, "patients": [PATIENT, PATIENT]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(body) == {"model_used", "predictions", "classes", "probabilities"}
+    assert body["model_used"] == model_name
+    assert body["classes"] == [0, 1]
+    assert len(body["predictions"]) == len(body["probabilities"]) == 2
+    for prediction, row in zip(body["predictions"], body["probabilities"]):
+        assert isinstance(row, list) and len(row) == len(body["classes"])
+        assert sum(row) == pytest.approx(1, abs=1e-5)
+        assert prediction == body["classes"][row.index(max(row))]
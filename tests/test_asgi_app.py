@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import asgi_app
+from encoding import FEATURE_NAMES
+
+PAYLOAD = {"model_name": "Logistic Regression", "data": [[0.0] * len(FEATURE_NAMES)]}
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """
+    Replaces the model run with one that blocks until the returned event is set, on a fresh
+    executor admitting a single pending prediction.
+    """
+    gate = threading.Event()
+
+    def blocked_predict(model_name, chosen_model, input_data, patients, timer):
+        gate.wait(10)
+        return {"model_used": model_name, "predictions": [0]}
+
+    monkeypatch.setattr(asgi_app, '_predict', blocked_predict)
+    monkeypatch.setattr(asgi_app, 'inference_executor', asgi_app.InferenceExecutor(max_workers=1, max_pending=1))
+    yield gate
+    gate.set()
+
+
+async def wait_for_pending(executor, count):
+    for _ in range(500):
+        if executor.pending == count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{executor.pending} pending predictions instead of {count}")
+
+
+def run(scenario):
+    async def main():
+        transport = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def test_too_many_pending_predictions_get_429(gate):
+    async def scenario(client):
+        first = asyncio.create_task(client.post('/predict', json=PAYLOAD))
+        await wait_for_pending(asgi_app.inference_executor, 1)
+
+        rejected = await client.post('/predict', json=PAYLOAD)
+        assert rejected.status_code == 429
+        assert rejected.headers['Retry-After'] == '1'
+        assert 'Retry later' in rejected.json()["error"]
+
+        gate.set()
+        assert (await first).status_code == 200
+        # Once the pending prediction is done new ones are admitted again
+        assert (await client.post('/predict', json=PAYLOAD)).status_code == 200
+
+    run(scenario)
+
+
+def test_shutdown_drains_pending_predictions(gate):
+    async def scenario(client):
+        executor = asgi_app.inference_executor
+        lifespan = asgi_app.lifespan(asgi_app.app)
+        await lifespan.__aenter__()
+        first = asyncio.create_task(client.post('/predict', json=PAYLOAD))
+        await wait_for_pending(executor, 1)
+
+        shutdown = asyncio.create_task(lifespan.__aexit__(None, None, None))
+        await asyncio.sleep(0.1)
+        # New predictions are refused, the pending one keeps the shutdown waiting
+        refused = await client.post('/predict', json=PAYLOAD)
+        assert refused.status_code == 503
+        assert not shutdown.done()
+
+        gate.set()
+        response = await first
+        assert response.status_code == 200
+        assert response.json()["predictions"] == [0]
+        await asyncio.wait_for(shutdown, 5)
+        assert executor.pending == 0
+
+    run(scenario)
@@ -0,0 +1,46 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_score
+from conftest import MODEL_DIR, make_clean_dataset
+from encoding import RAW_COLUMNS, encode_columns
+from registry import load_plan
+
+MODEL_FILE = f"{MODEL_DIR}/best_log_model.onnx"
+
+
+def test_score_file_end_to_end(tmp_path):
+    patients = make_clean_dataset(50)
+    input_file, output_file = tmp_path / 'patients.csv', tmp_path / 'predictions.csv'
+    patients.to_csv(input_file, index=False)
+
+    n_rows = batch_score.score_file(str(input_file), str(output_file), MODEL_FILE, workers=2, chunk_size=16)
+
+    scored = pd.read_csv(output_file)
+    features = encode_columns({column: patients[column].to_numpy() for column in RAW_COLUMNS}, len(patients))
+    predictions, probabilities = load_plan(MODEL_FILE).run(features)
+    assert n_rows == 50
+    assert scored['id'].tolist() == patients['id'].tolist()
+    assert scored['prediction'].tolist() == predictions.tolist()
+    np.testing.assert_allclose(scored[['probability_0', 'probability_1']], probabilities, rtol=1e-6)
+
+
+def test_invalid_row_exits_with_its_row_number(tmp_path, monkeypatch, capsys):
+    patients = make_clean_dataset(50)
+    patients['cholesterol'] = patients['cholesterol'].astype(object)
+    patients.loc[37, 'cholesterol'] = 'high'
+    input_file, output_file = tmp_path / 'patients.csv', tmp_path / 'predictions.csv'
+    patients.to_csv(input_file, index=False)
+    monkeypatch.setattr(sys, 'argv', [
+        'batch_score.py', str(input_file), str(output_file), '--model', MODEL_FILE,
+        '--workers', '1', '--chunk-size', '16',
+    ])
+
+    with pytest.raises(SystemExit) as exit_info:
+        batch_score.main()
+    assert "row 38 of" in str(exit_info.value.code)
+    assert "'cholesterol'" in str(exit_info.value.code)
+    assert not output_file.exists()
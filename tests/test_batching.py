@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher, QueueFullError
+
+
+class FakePlan:
+    """
+    Scores a row as (its first value, [1 - value, value]) and records the size of every run.
+    Runs block while `gate` is cleared.
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def run(self, input_array):
+        self.entered.set()
+        self.gate.wait()
+        self.batch_sizes.append(len(input_array))
+        values = input_array[:, 0]
+        return values.astype(np.int64), np.column_stack([1 - values, values])
+
+
+def rows(*values):
+    return np.array([[value, 0.0] for value in values], dtype=np.float32)
+
+
+def test_concurrent_requests_share_one_run():
+    plan = FakePlan()
+    plan.gate.clear()
+    batcher = MicroBatcher(plan, max_batch_size=64, max_wait_ms=50)
+    # The first request holds the worker, the next three queue up and are scored together
+    first = batcher.submit(rows(1))
+    plan.entered.wait(1)
+    futures = [batcher.submit(rows(0, 1)), batcher.submit(rows(1)), batcher.submit(rows(0))]
+    plan.gate.set()
+
+    assert first.result(1)[0].tolist() == [1]
+    results = [future.result(1) for future in futures]
+    assert [predictions.tolist() for predictions, _ in results] == [[0, 1], [1], [0]]
+    np.testing.assert_array_equal(results[0][1], [[1, 0], [0, 1]])
+    assert plan.batch_sizes == [1, 4]
+    assert batcher.stats.snapshot()["batches"] == 2
+    batcher.close()
+
+
+def test_full_queue_raises_queue_full_error():
+    plan = FakePlan()
+    plan.gate.clear()
+    batcher = MicroBatcher(plan, max_wait_ms=0, max_queue_size=1)
+    running = batcher.submit(rows(1))
+    plan.entered.wait(1)
+    queued = batcher.submit(rows(0))
+    with pytest.raises(QueueFullError):
+        batcher.submit(rows(1))
+    plan.gate.set()
+    assert running.result(1)[0].tolist() == [1] and queued.result(1)[0].tolist() == [0]
+    batcher.close()
+
+
+def test_failing_on_batch_callback_does_not_stop_the_batcher():
+    def on_batch(n_requests, n_rows):
+        raise RuntimeError("metrics backend down")
+
+    batcher = MicroBatcher(FakePlan(), max_wait_ms=0, on_batch=on_batch)
+    assert batcher.run(rows(1), timeout=1)[0].tolist() == [1]
+    assert batcher.run(rows(0), timeout=1)[0].tolist() == [0]
+    batcher.close()
+
+
+def test_close_scores_queued_requests_then_refuses_new_ones():
+    plan = FakePlan()
+    plan.gate.clear()
+    batcher = MicroBatcher(plan, max_wait_ms=0)
+    futures = [batcher.submit(rows(1)), batcher.submit(rows(0))]
+    plan.entered.wait(1)
+    closer = threading.Thread(target=batcher.close)
+    closer.start()
+    plan.gate.set()
+    closer.join(2)
+
+    assert [future.result(1)[0].tolist() for future in futures] == [[1], [0]]
+    assert not batcher._thread.is_alive()
+    with pytest.raises(QueueFullError):
+        batcher.submit(rows(1))
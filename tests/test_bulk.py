@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from bulk import BulkInputError, iter_chunks, iter_ndjson_rows
+
+
+def test_ndjson_rows_accept_arrays_and_objects():
+    lines = [b'[1, 2]\n', b'{"id": "a", "data": [3, 4]}\n']
+    chunks = list(iter_chunks(iter_ndjson_rows(lines), n_features=2))
+    ids, array = chunks[0]
+    assert ids == [None, 'a']
+    np.testing.assert_array_equal(array, [[1, 2], [3, 4]])
+
+
+@pytest.mark.parametrize('line', [b'42\n', b'null\n', b'"text"\n', b'{"data": 7}\n'])
+def test_ndjson_scalar_line_is_a_bulk_input_error(line):
+    rows = iter_ndjson_rows([b'[1, 2]\n', line])
+    with pytest.raises(BulkInputError) as error:
+        list(iter_chunks(rows, n_features=2))
+    assert error.value.row_number == 2
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+from cache import PredictionCache
+
+
+class CountingPlan:
+    """
+    Scores a row as its first value and counts the rows it actually ran.
+    """
+
+    def __init__(self):
+        self.rows_run = 0
+
+    def run(self, input_array):
+        self.rows_run += len(input_array)
+        values = input_array[:, 0]
+        return values.astype(np.int64), np.column_stack([1 - values, values])
+
+
+def rows(*values):
+    return np.array([[value, 0.0] for value in values], dtype=np.float32)
+
+
+def test_hits_and_misses_are_counted_per_row():
+    cache, plan = PredictionCache(max_entries=10), CountingPlan()
+    cache.run('model', plan, rows(0, 1))
+    predictions, probabilities = cache.run('model', plan, rows(1, 0, 2))
+
+    assert predictions.tolist() == [1, 0, 2]
+    np.testing.assert_array_equal(probabilities[:, 1], [1, 0, 2])
+    assert plan.rows_run == 3
+    stats = cache.stats.snapshot()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 3, 0.4)
+    assert len(cache) == 3
+
+
+def test_least_recently_used_rows_are_evicted():
+    cache, plan = PredictionCache(max_entries=2), CountingPlan()
+    cache.run('model', plan, rows(0, 1))
+    cache.run('model', plan, rows(0))      # 0 becomes the most recently used row
+    cache.run('model', plan, rows(2))      # evicts 1
+
+    assert cache.stats.snapshot()["evictions"] == 1
+    plan.rows_run = 0
+    cache.run('model', plan, rows(0, 2))
+    assert plan.rows_run == 0
+    cache.run('model', plan, rows(1))
+    assert plan.rows_run == 1
+
+
+def test_expired_rows_are_scored_again(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: clock[0])
+    cache, plan = PredictionCache(ttl_seconds=10), CountingPlan()
+    cache.run('model', plan, rows(1))
+    clock[0] += 5
+    cache.run('model', plan, rows(1))
+    assert plan.rows_run == 1
+    clock[0] += 10
+    cache.run('model', plan, rows(1))
+
+    assert plan.rows_run == 2
+    stats = cache.stats.snapshot()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 2, 1)
+
+
+def test_entries_are_dropped_when_the_model_file_changes(tmp_path):
+    model_file = tmp_path / 'model.onnx'
+    model_file.write_bytes(b'v1')
+    cache, plan = PredictionCache(check_interval=0), CountingPlan()
+    cache.watch('model', str(model_file))
+    cache.watch('other', str(tmp_path / 'other.onnx'))
+    cache.run('model', plan, rows(1))
+    cache.run('other', plan, rows(1))
+
+    model_file.write_bytes(b'version 2')
+    os.utime(model_file, ns=(0, 0))
+    cache.run('model', plan, rows(1))
+    assert plan.rows_run == 3
+    assert cache.stats.snapshot()["invalidations"] == 1
+    assert len(cache) == 2
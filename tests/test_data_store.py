@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_clean_dataset
+from data_store import MISSING, build, open_store
+from encoding import CATEGORICAL_LEVELS, RAW_COLUMNS, encode_columns
+
+
+def shuffled_csv(tmp_path, n_rows=240, seed=0):
+    """
+    Synthetic clean dataset whose rows are not sorted by id, as after a merge of sources.
+    """
+    df = make_clean_dataset(n_rows, seed)
+    df = df.sample(frac=1, random_state=seed).reset_index(drop=True)
+    csv_file = tmp_path / 'heart_disease_clean.csv'
+    df.to_csv(csv_file, index=False)
+    return str(csv_file), df
+
+
+def test_split_matches_notebook(tmp_path):
+    from train_export import load_dataset, split_dataset
+    from sklearn.model_selection import train_test_split
+
+    csv_file, _ = shuffled_csv(tmp_path)
+    # Notebook: read the CSV indexed by id and split it 70/30
+    df = pd.read_csv(csv_file, index_col='id')
+    _, X_test_notebook, _, _ = train_test_split(df.drop('sick', axis=1), df['sick'], test_size=0.3,
+                                                random_state=42, stratify=df['sick'])
+
+    X, y = load_dataset(csv_file)
+    X_train, X_test, _, _ = split_dataset(X, y)
+    assert X_test.index.tolist() == X_test_notebook.index.tolist()
+    assert set(X_train.index).isdisjoint(X_test.index)
+
+
+def test_round_trip(tmp_path):
+    csv_file, df = shuffled_csv(tmp_path)
+    store = open_store(csv_file)
+
+    assert store.n_rows == len(df)
+    np.testing.assert_array_equal(store.ids, df['id'])
+    assert store.columns == [column for column in df.columns if column != 'id']
+    for column in CATEGORICAL_LEVELS:
+        assert list(store.values(column)) == df[column].tolist()
+    np.testing.assert_allclose(store.column('cholesterol'), df['cholesterol'])
+    np.testing.assert_array_equal(store.column('sick'), df['sick'])
+    expected = encode_columns({column: df[column].to_numpy() for column in RAW_COLUMNS}, len(df))
+    np.testing.assert_array_equal(store.features, expected)
+
+    # A second open maps the files written by the first one instead of parsing the CSV again
+    features_file = tmp_path / 'heart_disease_clean.store' / 'features.npy'
+    mtime = features_file.stat().st_mtime_ns
+    reopened = open_store(csv_file)
+    assert features_file.stat().st_mtime_ns == mtime
+    assert isinstance(np.load(features_file, mmap_mode='r'), np.memmap)
+    assert not reopened.features.flags.writeable
+    np.testing.assert_array_equal(reopened.features, expected)
+
+
+def test_predictions_are_joined_by_id(tmp_path):
+    csv_file, df = shuffled_csv(tmp_path)
+    store = open_store(csv_file)
+    ids = df['id'].to_numpy()[::-1][:100]
+    labels = [None if index % 10 == 0 else index % 2 for index in range(len(ids))]
+    assert store.write_predictions('gpt_prediction', ids, labels) == 90
+
+    frame = store.frame(['sick'], predictions=['gpt_prediction'])
+    for patient_id, label in zip(ids, labels):
+        value = frame.loc[patient_id, 'gpt_prediction']
+        assert (value is pd.NA) if label is None else value == label
+    assert (store.predictions('gpt_prediction') != MISSING).sum() == 90
+    np.testing.assert_array_equal(store.positions([str(ids[0])]), [len(df) - 1])
+    with pytest.raises(KeyError):
+        store.positions([0])
+
+
+def test_rebuild_keeps_predictions_of_appended_csv(tmp_path):
+    csv_file, df = shuffled_csv(tmp_path, n_rows=200)
+    store = open_store(csv_file)
+    store.write_predictions('human_prediction', df['id'], df['sick'].astype(int))
+
+    # Append new patients in front of the old ones: the old predictions follow their ids
+    extra = make_clean_dataset(260, seed=1).iloc[200:]
+    pd.concat([extra, df]).to_csv(csv_file, index=False)
+    store = open_store(csv_file)
+
+    assert store.n_rows == 260
+    labels = store.frame(predictions=['human_prediction'])['human_prediction']
+    assert labels.loc[extra['id']].isna().all()
+    assert (labels.loc[df['id']].to_numpy() == df['sick'].astype(int).to_numpy()).all()
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    df = make_clean_dataset(20)
+    df.loc[5, 'id'] = df.loc[4, 'id']
+    csv_file = tmp_path / 'heart_disease_clean.csv'
+    df.to_csv(csv_file, index=False)
+    with pytest.raises(ValueError, match='duplicates'):
+        build(str(csv_file))
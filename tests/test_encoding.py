@@ -0,0 +1,22 @@
+import pytest
+
+from encoding import N_FEATURES, EncodingError, encode_records
+
+PATIENT = {
+    "age": 54, "sex": "Male", "chest_pain_type": "asymptomatic", "blood_pressure_resting": 130,
+    "cholesterol": 246, "fasting_blood_sugar": "False", "ecg_resting": "normal", "max_heart_rate": 150,
+    "exercise_induced_angina": "False", "st_depression_exercise": 1.0, "st_slope_type": "flat",
+    "thal_defect_type": "normal", "major_vessels_colored": 0,
+}
+
+
+def test_encode_records_layout():
+    assert encode_records([PATIENT, PATIENT]).shape == (2, N_FEATURES)
+
+
+@pytest.mark.parametrize('value', [None, float('nan'), 'inf'])
+def test_null_cholesterol_is_an_encoding_error(value):
+    with pytest.raises(EncodingError) as error:
+        encode_records([PATIENT, dict(PATIENT, cholesterol=value)])
+    assert error.value.index == 1
+    assert "'cholesterol'" in str(error.value)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, precision_score, recall_score, roc_auc_score
+
+from data_store import MISSING
+from evaluate import METRICS, evaluate
+
+
+@pytest.fixture
+def sources():
+    rng = np.random.default_rng(7)
+    n_rows = 300
+    y_true = rng.integers(0, 2, n_rows)
+    # Two label-only sources (the second with missing predictions) and one scored model
+    noisy = np.where(rng.random(n_rows) < 0.8, y_true, 1 - y_true)
+    partial = np.where(rng.random(n_rows) < 0.3, MISSING, np.where(rng.random(n_rows) < 0.7, y_true, 1 - y_true))
+    probabilities = np.clip(y_true * 0.3 + rng.random(n_rows) * 0.7, 0, 1).round(2)  # rounded: tied scores
+    labels = np.column_stack([noisy, partial, probabilities >= 0.5]).astype(np.int8)
+    scores = np.column_stack([np.full(n_rows, np.nan), np.full(n_rows, np.nan), probabilities])
+    return y_true, labels, ['noisy', 'partial', 'model'], scores
+
+
+def test_evaluate_matches_sklearn(sources):
+    y_true, labels, names, scores = sources
+    report = evaluate(y_true, labels, names, scores, n_bootstrap=0)
+
+    for index, name in enumerate(names):
+        valid = labels[:, index] != MISSING
+        y, predicted = y_true[valid], labels[valid, index]
+        tn, fp, fn, tp = confusion_matrix(y, predicted).ravel()
+        row = report.loc[name]
+        assert (row['TP'], row['FP'], row['FN'], row['TN'], row['N']) == (tp, fp, fn, tn, valid.sum())
+        assert row['Accuracy'] == pytest.approx(accuracy_score(y, predicted))
+        assert row['Recall'] == pytest.approx(recall_score(y, predicted))
+        assert row['Precision'] == pytest.approx(precision_score(y, predicted))
+        assert row['F1'] == pytest.approx(f1_score(y, predicted))
+        assert row['Specificity'] == pytest.approx(tn / (tn + fp))
+        # Label-only sources: AUC of the single-threshold ROC curve
+        ranking = scores[valid, index] if not np.isnan(scores[:, index]).all() else predicted
+        assert row['ROC AUC'] == pytest.approx(roc_auc_score(y, ranking))
+
+
+def test_bootstrap_intervals_contain_the_point_estimate(sources):
+    y_true, labels, names, scores = sources
+    report = evaluate(y_true, labels, names, scores, n_bootstrap=200, n_jobs=1)
+    for metric in METRICS:
+        assert (report[f'{metric} CI low'] <= report[metric]).all()
+        assert (report[metric] <= report[f'{metric} CI high']).all()
+        assert (report[f'{metric} CI low'] < report[f'{metric} CI high']).all()
+
+
+def test_bootstrap_does_not_depend_on_n_jobs(sources):
+    y_true, labels, names, scores = sources
+    serial = evaluate(y_true, labels, names, scores, n_bootstrap=120, n_jobs=1)
+    parallel = evaluate(y_true, labels, names, scores, n_bootstrap=120, n_jobs=2)
+    np.testing.assert_allclose(serial.to_numpy(dtype=float), parallel.to_numpy(dtype=float))
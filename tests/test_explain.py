@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+import app as backend
+from conftest import MODEL_DIR
+from encoding import CATEGORICAL_LEVELS, FEATURE_NAMES, RAW_COLUMNS
+from explain import (BACKGROUND_FILE, FEATURE_GROUPS, Background, LinearExplainer, PermutationExplainer, linear_terms,
+                     save_background)
+from registry import load_plan
+
+LOG_MODEL_FILE = os.path.join(MODEL_DIR, 'best_log_model.onnx')
+
+
+class LogOddsPlan:
+    """
+    Stand-in plan whose 'probability' of the last class is the log-odds of a linear model, so the
+    permutation explainer works on the same scale as the closed form.
+    """
+
+    input_dtype = np.float64
+    has_probabilities = True
+
+    def __init__(self, coef, intercept):
+        self.coef = coef
+        self.intercept = intercept
+
+    def run(self, input_array):
+        log_odds = np.asarray(input_array, dtype=np.float64) @ self.coef + self.intercept
+        return (log_odds > 0).astype(np.int64), np.stack([-log_odds, log_odds], axis=1)
+
+
+def random_features(n_rows, seed=0):
+    """
+    Encoded rows: one-hot columns 0/1, numeric columns standard normal.
+    """
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(n_rows, len(FEATURE_NAMES)))
+    one_hot = FEATURE_GROUPS < len(CATEGORICAL_LEVELS)
+    features[:, one_hot] = rng.integers(0, 2, (n_rows, one_hot.sum()))
+    return features
+
+
+@pytest.fixture
+def background(tmp_path):
+    # Fewer rows than clusters: the background is the rows themselves and its mean is their exact mean
+    background_file = str(tmp_path / BACKGROUND_FILE)
+    save_background(background_file, random_features(8, seed=1))
+    return Background(background_file)
+
+
+def test_linear_closed_form_matches_permutations(background):
+    coef, intercept = linear_terms(LOG_MODEL_FILE)
+    plan = LogOddsPlan(coef, intercept)
+    rows = random_features(5, seed=2)
+
+    linear = LinearExplainer(plan, coef, intercept, background)
+    permutation = PermutationExplainer(plan, background, n_permutations=4)
+    linear_outputs, linear_contributions = linear.run(rows)
+    permutation_outputs, permutation_contributions = permutation.run(rows)
+
+    assert linear.base_value == pytest.approx(permutation.base_value)
+    np.testing.assert_allclose(linear_outputs, permutation_outputs, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(linear_contributions, permutation_contributions, rtol=1e-7, atol=1e-9)
+    assert linear_contributions.shape == (len(rows), len(RAW_COLUMNS))
+
+
+def test_linear_terms_match_the_onnx_graph(background):
+    plan = load_plan(LOG_MODEL_FILE)
+    rows = random_features(16, seed=3)
+    _, probabilities = plan.run(rows.astype(plan.input_dtype))
+
+    outputs, contributions = LinearExplainer(plan, *linear_terms(LOG_MODEL_FILE), background).run(rows)
+    np.testing.assert_allclose(1 / (1 + np.exp(-outputs)), probabilities[:, -1], atol=1e-4)
+
+
+def test_permutation_contributions_sum_to_the_output(background):
+    plan = load_plan(os.path.join(MODEL_DIR, 'best_knn_model.onnx'))
+    explainer = PermutationExplainer(plan, background, n_permutations=4)
+    outputs, contributions = explainer.run(random_features(3, seed=4))
+    np.testing.assert_allclose(explainer.base_value + contributions.sum(axis=1), outputs, atol=1e-5)
+
+
+def test_models_reports_whether_explain_is_available(tmp_path, monkeypatch):
+    client = backend.app.test_client()
+    monkeypatch.setattr(backend, 'MODEL_PATH', str(tmp_path) + os.sep)
+    (tmp_path / backend.MODEL_STATS).write_text("Logistic Regression,0.8,0.8,0.9\n")
+
+    response = client.post('/models', json={"model_name": "Logistic Regression"})
+    assert response.status_code == 200
+    assert response.get_json()["explainable"] is False
+    explain = client.post('/explain', json={"model_name": "Logistic Regression", "data": [[0.0] * len(FEATURE_NAMES)]})
+    assert explain.status_code == 503
+
+    save_background(str(tmp_path / BACKGROUND_FILE), random_features(8))
+    assert client.post('/models', json={"model_name": "Logistic Regression"}).get_json()["explainable"] is True
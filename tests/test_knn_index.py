@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import KNeighborsClassifier
+
+from knn_index import INDEX_SUFFIX, IndexedKNNPlan, save_index
+
+
+@pytest.fixture
+def reference():
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(900, 6))
+    y = (X[:, 0] + 0.5 * X[:, 1] + rng.normal(0, 0.5, len(X)) > 0).astype(np.int64)
+    return X, y, rng.normal(size=(200, 6))
+
+
+def brute_force(X, y, queries, k, weights, metric):
+    model = KNeighborsClassifier(n_neighbors=k, weights=weights, metric=metric, algorithm='brute').fit(X, y)
+    return model.predict(queries), model.predict_proba(queries)
+
+
+@pytest.mark.parametrize('weights', ['uniform', 'distance'])
+@pytest.mark.parametrize('metric', ['euclidean', 'manhattan'])
+@pytest.mark.parametrize('algorithm', ['kd_tree', 'ball_tree', 'ivf'])
+def test_index_matches_brute_force_knn(reference, algorithm, metric, weights):
+    X, y, queries = reference
+    # Probing every cell makes the inverted file exact
+    plan = IndexedKNNPlan(X, y, [0, 1], n_neighbors=7, weights=weights, metric=metric,
+                          algorithm=algorithm, n_probe=10 ** 6)
+    predictions, probabilities = plan.run(queries)
+    expected_predictions, expected_probabilities = brute_force(X, y, queries, 7, weights, metric)
+    np.testing.assert_array_equal(predictions, expected_predictions)
+    np.testing.assert_allclose(probabilities, expected_probabilities, atol=1e-6)
+
+
+@pytest.mark.parametrize('weights', ['uniform', 'distance'])
+def test_ivf_with_too_few_probed_neighbours_falls_back_to_exact_search(reference, weights):
+    X, y, queries = reference
+    # ~30 cells of ~30 rows: one probed cell cannot hold 60 neighbours
+    plan = IndexedKNNPlan(X, y, [0, 1], n_neighbors=60, weights=weights, algorithm='ivf', n_probe=1)
+    predictions, probabilities = plan.run(queries)
+    expected_predictions, expected_probabilities = brute_force(X, y, queries, 60, weights, 'euclidean')
+    assert not np.isnan(probabilities).any()
+    np.testing.assert_array_equal(predictions, expected_predictions)
+    np.testing.assert_allclose(probabilities, expected_probabilities, atol=1e-6)
+
+
+def test_index_file_round_trip(reference, tmp_path):
+    X, y, queries = reference
+    mean, scale = X.mean(axis=0), X.std(axis=0)
+    index_file = tmp_path / f"model{INDEX_SUFFIX}"
+    save_index(str(index_file), (X - mean) / scale, y, [0, 1], 5, 'distance', 'manhattan', mean, scale, 'ivf', 4)
+
+    plan = IndexedKNNPlan.from_file(str(index_file), algorithm='kd_tree')
+    expected = IndexedKNNPlan((X - mean) / scale, y, [0, 1], 5, 'distance', 'manhattan', mean, scale)
+    np.testing.assert_allclose(plan.run(queries)[1], expected.run(queries)[1], atol=1e-6)
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from metrics import RETIRED_FILE, MetricsRegistry
+
+
+def make_registry(metrics_dir):
+    registry = MetricsRegistry(str(metrics_dir))
+    registry.counter('requests_total', 'Requests.')
+    registry.gauge('queue_depth', 'Queue depth.')
+    registry.histogram('rows', 'Rows per run.', buckets=(1, 10))
+    return registry
+
+
+def write_worker_snapshot(metrics_dir, pid, requests, queue_depth, rows):
+    """
+    Snapshot of another gunicorn worker, as written by MetricsRegistry.flush() in that process.
+    """
+    registry = make_registry(metrics_dir)
+    registry.inc('requests_total', {"status": "200"}, requests)
+    registry.set('queue_depth', None, queue_depth)
+    for value in rows:
+        registry.observe('rows', None, value)
+    snapshot = dict(registry.snapshot(), pid=pid)
+    (metrics_dir / f"worker-{pid}.json").write_text(json.dumps(snapshot))
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_worker_snapshots_aggregate_into_one_scrape(tmp_path):
+    write_worker_snapshot(tmp_path, os.getppid(), requests=3, queue_depth=2, rows=[1, 20])
+    registry = make_registry(tmp_path)
+    registry.inc('requests_total', {"status": "200"}, 4)
+    registry.set('queue_depth', None, 5)
+    registry.observe('rows', None, 5)
+
+    lines = registry.render().splitlines()
+    assert 'requests_total{status="200"} 7' in lines
+    assert 'queue_depth 7' in lines
+    assert 'rows_bucket{le="1"} 1' in lines
+    assert 'rows_bucket{le="10"} 2' in lines
+    assert 'rows_bucket{le="+Inf"} 3' in lines
+    assert 'rows_count 3' in lines
+
+
+def test_exited_workers_are_merged_into_the_retired_file(tmp_path, dead_pid):
+    write_worker_snapshot(tmp_path, dead_pid, requests=3, queue_depth=2, rows=[20])
+    registry = make_registry(tmp_path)
+    registry.inc('requests_total', {"status": "200"}, 4)
+
+    for _ in range(2):
+        lines = registry.render().splitlines()
+        # Counters and histograms of the exited worker keep counting, once; its gauge is dropped
+        assert 'requests_total{status="200"} 7' in lines
+        assert 'rows_count 1' in lines
+        assert not any(line.startswith('queue_depth') for line in lines)
+
+    assert not (tmp_path / f"worker-{dead_pid}.json").exists()
+    assert (tmp_path / RETIRED_FILE).exists()
+
+
+def test_cache_statistics_are_exported_as_counters():
+    import app as backend
+
+    page = backend.app.test_client().get('/metrics').get_data(as_text=True)
+    for name in ['prediction_cache_hits_total', 'prediction_cache_misses_total', 'prediction_cache_evictions_total']:
+        assert backend.metrics._meta[name][0] == 'counter'
+        assert name not in page or f"# TYPE {name} counter" in page
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from conftest import MODEL_DIR
+from knn_index import INDEX_SUFFIX
+from registry import ModelRegistry
+
+LOG_MODEL = os.path.join(MODEL_DIR, 'best_log_model.onnx')
+KNN_MODEL = os.path.join(MODEL_DIR, 'best_knn_model.onnx')
+
+
+@pytest.fixture
+def registry(tmp_path):
+    (tmp_path / 'models.json').write_text(json.dumps({"model.onnx": {"name": "Model"}}))
+    registry = ModelRegistry(str(tmp_path))
+    registry.events = []
+    registry.add_listener(lambda name, plan: registry.events.append((name, plan)))
+    return registry
+
+
+def test_hot_reload_adds_replaces_and_removes_models(registry, tmp_path):
+    model_file = tmp_path / 'model.onnx'
+    shutil.copy(LOG_MODEL, model_file)
+    assert registry.reload()["loaded"] == ["Model"]
+    first_plan = registry.models["Model"]
+    assert registry.reload()["unchanged"] == ["Model"]
+
+    # Replaced in place (another graph, so the size changes): the new plan is swapped in
+    shutil.copy(KNN_MODEL, model_file)
+    assert registry.reload()["loaded"] == ["Model"]
+    assert registry.models["Model"] is not first_plan
+
+    model_file.unlink()
+    assert registry.reload()["removed"] == ["Model"]
+    assert "Model" not in registry.models
+    assert [(name, plan is None) for name, plan in registry.events] == [
+        ("Model", False), ("Model", False), ("Model", True),
+    ]
+
+
+def test_a_file_that_fails_to_load_keeps_the_previous_version(registry, tmp_path):
+    model_file = tmp_path / 'model.onnx'
+    shutil.copy(LOG_MODEL, model_file)
+    registry.reload()
+    plan = registry.models["Model"]
+
+    model_file.write_bytes(b'not an onnx graph')
+    assert "Model" in registry.reload()["failed"]
+    assert registry.models["Model"] is plan
+
+
+def test_name_collisions_are_reported_once(tmp_path, capsys):
+    manifest = {"a.onnx": {"name": "Model"}, "b.onnx": {"name": "Model"}}
+    (tmp_path / 'models.json').write_text(json.dumps(manifest))
+    shutil.copy(LOG_MODEL, tmp_path / 'a.onnx')
+    shutil.copy(KNN_MODEL, tmp_path / 'b.onnx')
+    registry = ModelRegistry(str(tmp_path))
+
+    registry.reload()
+    assert registry.metadata["Model"]["file"] == 'a.onnx'
+    assert "'b.onnx' and 'a.onnx' are both named 'Model'" in capsys.readouterr().out
+    registry.reload()
+    assert 'both named' not in capsys.readouterr().out
+
+
+def test_model_list_keeps_the_onnx_models_first(tmp_path):
+    manifest = {
+        'best_knn_model.onnx': {"name": "K-Nearest Neighbors"},
+        'best_knn_model' + INDEX_SUFFIX: {"name": "K-Nearest Neighbors (KD-tree)"},
+        'best_log_model.onnx': {"name": "Logistic Regression"},
+    }
+    (tmp_path / 'models.json').write_text(json.dumps(manifest))
+    for file_name in manifest:
+        (tmp_path / file_name).write_bytes(b'')
+    assert list(ModelRegistry(str(tmp_path))._discover()) == [
+        "K-Nearest Neighbors", "Logistic Regression", "K-Nearest Neighbors (KD-tree)",
+    ]
@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+from conftest import FLASK_DIR, MODEL_DIR
+
+# Makes every import of pandas fail, as in the server image where it is not installed
+BLOCK_PANDAS = """
+import sys
+
+class BlockPandas:
+    def find_spec(self, name, path=None, target=None):
+        if name == 'pandas' or name.startswith('pandas.'):
+            raise ImportError(f"No module named '{name}' (blocked)")
+        return None
+
+sys.meta_path.insert(0, BlockPandas())
+import app
+print(sorted(app.loaded_models))
+"""
+
+
+def test_app_imports_without_pandas():
+    result = subprocess.run(
+        [sys.executable, '-c', BLOCK_PANDAS], cwd=FLASK_DIR, capture_output=True, text=True, timeout=120,
+        env={'MODEL_PATH': MODEL_DIR + '/', 'MODEL_WATCH_INTERVAL': '0', 'PATH': ''},
+    )
+    assert result.returncode == 0, result.stderr
+    assert 'Logistic Regression' in result.stdout
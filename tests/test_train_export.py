@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import KNeighborsClassifier
+
+from encoding import RAW_COLUMNS, encode_columns
+from inference import InferencePlan
+from train_export import export, load_dataset, make_pipeline, split_dataset, to_fused_onnx
+
+
+@pytest.fixture
+def split(clean_csv):
+    return split_dataset(*load_dataset(clean_csv))
+
+
+@pytest.mark.parametrize('weights', ['uniform', 'distance'])
+@pytest.mark.parametrize('metric', ['manhattan', 'euclidean'])
+def test_knn_export_matches_predict_proba(split, tmp_path, metric, weights):
+    X_train, X_test, y_train, _ = split
+    pipeline = make_pipeline(KNeighborsClassifier(n_neighbors=5, weights=weights, metric=metric))
+    pipeline.fit(X_train, y_train)
+
+    output_file = tmp_path / 'knn.onnx'
+    report = export(pipeline, str(output_file), X_test=X_test)
+    assert report["passed"] and output_file.exists()
+
+    plan = InferencePlan.from_file(str(output_file))
+    features = encode_columns({column: X_test[column].tolist() for column in RAW_COLUMNS}, len(X_test))
+    _, probabilities = plan.run(features)
+    np.testing.assert_allclose(probabilities, pipeline.predict_proba(X_test), atol=1e-4)
+
+
+def test_cdist_is_only_used_for_the_euclidean_metric(split):
+    X_train, _, y_train, _ = split
+    for metric, expected in [('manhattan', False), ('euclidean', True)]:
+        pipeline = make_pipeline(KNeighborsClassifier(metric=metric)).fit(X_train, y_train)
+        op_types = {node.op_type for node in to_fused_onnx(pipeline).graph.node}
+        assert ('CDist' in op_types) == expected
@@ -0,0 +1,26 @@
+import json
+import sys
+
+import pytest
+
+import train_export
+import tune
+
+
+def test_tuning_run_exports_a_winning_manhattan_knn(clean_csv, tmp_path, monkeypatch):
+    name, file_name, estimator, _ = train_export.MODEL_SPECS['knn']
+    grid = {'n_neighbors': [5, 7], 'weights': ['distance'], 'metric': ['manhattan']}
+    monkeypatch.setitem(train_export.MODEL_SPECS, 'knn', (name, file_name, estimator, grid))
+    output_dir = tmp_path / 'models'
+    monkeypatch.setattr(sys, 'argv', [
+        'tune.py', '--input-file', clean_csv, '--output-dir', str(output_dir), '--models', 'knn',
+        '--no-cache', '--n-jobs', '1',
+    ])
+
+    with pytest.raises(SystemExit) as exit_info:
+        tune.main()
+    assert exit_info.value.code == 0
+
+    manifest = json.loads((output_dir / 'models.json').read_text())
+    assert manifest[file_name]["params"]["metric"] == 'manhattan'
+    assert (output_dir / file_name).exists()